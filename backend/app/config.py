@@ -0,0 +1,112 @@
+import os
+
+# Runtime settings for the backend. Everything here can be overridden with an
+# environment variable so the same build runs on a laptop or a 16-core host.
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Ignoring invalid value for {name}: {value!r} (using {default})")
+        return default
+
+
+_CPU_COUNT = os.cpu_count() or 2
+
+# ── Executor pools ──────────────────────────────────────────────────────────
+# Embedding, Chroma reads/writes and other blocking calls that release the GIL.
+CPU_THREADS = _env_int("VAULT_CPU_THREADS", min(8, _CPU_COUNT))
+# PDF parsing is pure-Python and CPU bound, so it runs in separate processes.
+PDF_PROCESSES = _env_int("VAULT_PDF_PROCESSES", max(1, _CPU_COUNT - 1))
+# Pages handed to each PDF worker process per task, and the page count below
+# which a document is simply read in-process.
+PDF_PAGES_PER_TASK = _env_int("VAULT_PDF_PAGES_PER_TASK", 8)
+PDF_PARALLEL_MIN_PAGES = _env_int("VAULT_PDF_PARALLEL_MIN_PAGES", 16)
+# Text extractor used unless a vault or upload picks another ("pdfium" is the
+# fast text-only one, "pdfplumber" does layout analysis), and the extractor
+# that re-reads pages the first one gets no text from ("" to disable).
+_PDF_BACKENDS = ("pdfium", "pdfplumber")
+PDF_BACKEND = os.environ.get("VAULT_PDF_BACKEND", "pdfium").strip().lower()
+if PDF_BACKEND not in _PDF_BACKENDS:
+    print(f"Ignoring invalid value for VAULT_PDF_BACKEND: {PDF_BACKEND!r} (using 'pdfium')")
+    PDF_BACKEND = "pdfium"
+PDF_FALLBACK_BACKEND = os.environ.get("VAULT_PDF_FALLBACK_BACKEND", "pdfplumber").strip().lower() or None
+if PDF_FALLBACK_BACKEND is not None and PDF_FALLBACK_BACKEND not in _PDF_BACKENDS:
+    print(f"Ignoring invalid value for VAULT_PDF_FALLBACK_BACKEND: {PDF_FALLBACK_BACKEND!r} (using 'pdfplumber')")
+    PDF_FALLBACK_BACKEND = "pdfplumber"
+
+# ── SQLite ──────────────────────────────────────────────────────────────────
+# Pooled connections to users.db shared by all requests, and how long a write
+# waits for the database lock before failing.
+DB_POOL_SIZE = _env_int("VAULT_DB_POOL_SIZE", 8)
+DB_BUSY_TIMEOUT_MS = _env_int("VAULT_DB_BUSY_TIMEOUT_MS", 5000)
+
+# ── Ingestion queue ─────────────────────────────────────────────────────────
+# Number of uploads processed concurrently by the background job workers.
+INGESTION_WORKERS = _env_int("VAULT_INGESTION_WORKERS", 2)
+# Chunks embedded per batch, and batches allowed to wait between the embed and
+# write stages before the workers pause parsing.
+INGESTION_EMBED_BATCH_SIZE = _env_int("VAULT_INGESTION_EMBED_BATCH_SIZE", 64)
+INGESTION_QUEUE_SIZE = _env_int("VAULT_INGESTION_QUEUE_SIZE", 4)
+# Most PDFs accepted by one /upload/bulk request (zip members included).
+BULK_UPLOAD_MAX_FILES = _env_int("VAULT_BULK_UPLOAD_MAX_FILES", 500)
+
+# ── Chunking ────────────────────────────────────────────────────────────────
+# "chars" chunks each page on its own by character count; "tokens" measures
+# chunks in embedding-model tokens and lets them run across pages.
+CHUNK_MODE = os.environ.get("VAULT_CHUNK_MODE", "chars").strip().lower()
+if CHUNK_MODE not in ("chars", "tokens"):
+    print(f"Ignoring invalid value for VAULT_CHUNK_MODE: {CHUNK_MODE!r} (using 'chars')")
+    CHUNK_MODE = "chars"
+# Token-mode chunk size and overlap; all-MiniLM-L6-v2 reads at most 256 tokens.
+CHUNK_TOKENS = _env_int("VAULT_CHUNK_TOKENS", 200)
+CHUNK_OVERLAP_TOKENS = _env_int("VAULT_CHUNK_OVERLAP_TOKENS", 40)
+
+# ── Embedding cache ─────────────────────────────────────────────────────────
+# Upper bound for the on-disk cache of chunk embeddings (least recently used
+# vectors are evicted past this).
+EMBEDDING_CACHE_MB = _env_int("VAULT_EMBEDDING_CACHE_MB", 512)
+
+# ── Query caches ────────────────────────────────────────────────────────────
+# In-process LRU sizes for query embeddings and per-vault search results.
+QUERY_EMBEDDING_CACHE_SIZE = _env_int("VAULT_QUERY_EMBEDDING_CACHE_SIZE", 1024)
+RETRIEVAL_CACHE_SIZE = _env_int("VAULT_RETRIEVAL_CACHE_SIZE", 2048)
+
+# ── Retrieval ───────────────────────────────────────────────────────────────
+# "vector" (embeddings only), "lexical" (FTS5/BM25 only) or "hybrid" (both,
+# fused with reciprocal rank fusion).
+SEARCH_MODE = os.environ.get("VAULT_SEARCH_MODE", "hybrid").strip().lower()
+if SEARCH_MODE not in ("vector", "lexical", "hybrid"):
+    print(f"Ignoring invalid value for VAULT_SEARCH_MODE: {SEARCH_MODE!r} (using 'hybrid')")
+    SEARCH_MODE = "hybrid"
+# Upper bound on the tokens of retrieved text packed into each LLM prompt.
+CONTEXT_TOKEN_BUDGET = _env_int("VAULT_CONTEXT_TOKEN_BUDGET", 1024)
+
+# ── LLM ─────────────────────────────────────────────────────────────────────
+# Context window of each GPT4All instance, in tokens.
+LLM_CONTEXT_TOKENS = _env_int("VAULT_LLM_CONTEXT_TOKENS", 2048)
+
+# ── LLM scheduler ───────────────────────────────────────────────────────────
+# Model worker processes (each loads its own copy of the model), the number of
+# requests allowed to wait for one, and how long a request may wait before it
+# is answered with 503.
+LLM_WORKERS = _env_int("VAULT_LLM_WORKERS", 1)
+LLM_QUEUE_SIZE = _env_int("VAULT_LLM_QUEUE_SIZE", 32)
+LLM_QUEUE_TIMEOUT = _env_int("VAULT_LLM_QUEUE_TIMEOUT", 60)
+# Model wrapper the workers load, as "module:Class" (the benchmarks swap in a
+# deterministic stub: benchmarks.stub_llm:StubLLMService).
+LLM_SERVICE = os.environ.get("VAULT_LLM_SERVICE", "app.services.llm_service:LLMService").strip()
+
+# ── Answer cache ────────────────────────────────────────────────────────────
+# Size and age limits for the on-disk cache of generated answers (least
+# recently used answers are evicted past the size limit).
+ANSWER_CACHE_MB = _env_int("VAULT_ANSWER_CACHE_MB", 64)
+ANSWER_CACHE_MAX_AGE_HOURS = _env_int("VAULT_ANSWER_CACHE_MAX_AGE_HOURS", 168)
+
+# ── Administration ──────────────────────────────────────────────────────────
+# Comma-separated usernames allowed to call the /admin endpoints.
+ADMIN_USERS = {name.strip() for name in os.getenv("VAULT_ADMIN_USERS", "").split(",") if name.strip()}
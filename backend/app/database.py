@@ -1,88 +1,350 @@
+import asyncio
+import contextlib
 import aiosqlite
 import os
 
+from app import config
+
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "users.db")
 
+
+class ConnectionPool:
+    """
+    A fixed set of long-lived aiosqlite connections shared by all requests.
+
+    Every connection is opened once with WAL journaling (readers no longer
+    block the writer), synchronous=NORMAL, a busy timeout instead of instant
+    "database is locked" errors, and a larger page cache and mmap window.
+    Because connections outlive requests, sqlite3's per-connection statement
+    cache keeps the app's prepared statements compiled between requests.
+    """
+
+    def __init__(self, db_path: str, size: int = 8, busy_timeout_ms: int = 5000, cache_mb: int = 16,
+                 mmap_mb: int = 128, cached_statements: int = 256):
+        self.db_path = db_path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_mb = cache_mb
+        self.mmap_mb = mmap_mb
+        self.cached_statements = cached_statements
+        self._idle: asyncio.Queue[aiosqlite.Connection] | None = None
+        self._connections: list[aiosqlite.Connection] = []
+
+    @property
+    def is_open(self) -> bool:
+        return self._idle is not None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(
+            self.db_path, timeout=self.busy_timeout_ms / 1000, cached_statements=self.cached_statements
+        )
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("PRAGMA synchronous=NORMAL")
+        await db.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        await db.execute(f"PRAGMA cache_size={-int(self.cache_mb) * 1024}")
+        await db.execute(f"PRAGMA mmap_size={int(self.mmap_mb) * 1024 * 1024}")
+        await db.execute("PRAGMA temp_store=MEMORY")
+        return db
+
+    async def open(self):
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            db = await self._connect()
+            self._connections.append(db)
+            self._idle.put_nowait(db)
+        print(f"SQLite pool opened with {self.size} connection(s) (WAL)")
+
+    async def close(self):
+        for db in self._connections:
+            await db.close()
+        self._connections = []
+        self._idle = None
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        '''Borrow a connection; anything left uncommitted is rolled back when it is returned.'''
+        if self._idle is None:
+            # Outside the app's lifespan (scripts, tools)
+            async with aiosqlite.connect(self.db_path) as db:
+                yield db
+            return
+        db = await self._idle.get()
+        try:
+            yield db
+        finally:
+            try:
+                if db.in_transaction:
+                    await db.rollback()
+            finally:
+                self._idle.put_nowait(db)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+        }
+
+
+DB_POOL = ConnectionPool(DB_PATH, size=config.DB_POOL_SIZE, busy_timeout_ms=config.DB_BUSY_TIMEOUT_MS)
+
+
 async def get_db():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with DB_POOL.connection() as db:
         yield db
 
 async def init_db():
     async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                hashed_password TEXT NOT NULL,
-                first_name TEXT,
-                last_name TEXT,
-                role TEXT,
-                email TEXT
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS user_vaults (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                vault_name TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                UNIQUE(user_id, vault_name)
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS vault_files (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                vault_name TEXT NOT NULL,
-                filename TEXT NOT NULL,
-                uploaded_at TEXT NOT NULL,
-                UNIQUE(user_id, vault_name, filename)
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS chats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                vault_name TEXT,
-                title TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                sender_name TEXT,
-                receiver_name TEXT,
-                label TEXT,
-                time_frame TEXT
-            )
-        """)
-        
-        # Add new columns to existing table if they don't exist
-        try:
-            await db.execute("ALTER TABLE users ADD COLUMN role TEXT")
-        except:
-            pass
-        try:
-            await db.execute("ALTER TABLE chats ADD COLUMN sender_name TEXT")
-            await db.execute("ALTER TABLE chats ADD COLUMN receiver_name TEXT")
-        except:
-            pass
-        try:
-            await db.execute("ALTER TABLE chats ADD COLUMN label TEXT")
-        except:
-            pass
-        try:
-            await db.execute("ALTER TABLE chats ADD COLUMN time_frame TEXT")
-        except:
-            pass
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS chat_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER NOT NULL,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                timestamp TEXT NOT NULL,
-                FOREIGN KEY(chat_id) REFERENCES chats(id)
-            )
-        """)
+        await run_migrations(db)
+        # Refresh the planner's statistics for tables whose shape changed a lot
+        await db.execute("PRAGMA optimize")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Migrations
+#
+# Each migration runs once, in its own transaction, and records its number in
+# PRAGMA user_version; startup skips every migration at or below it. Append new
+# ones to MIGRATIONS, never edit one that has shipped.
+# ─────────────────────────────────────────────────────────────────────────────
+
+async def _columns(db: aiosqlite.Connection, table: str) -> set[str]:
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        return {row[1] for row in await cursor.fetchall()}
+
+
+async def _add_column(db: aiosqlite.Connection, table: str, column: str, definition: str):
+    if column not in await _columns(db, table):
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+async def _migrate_base_schema(db: aiosqlite.Connection):
+    # Databases created before versioning have these tables with some or all of the columns
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            hashed_password TEXT NOT NULL,
+            first_name TEXT,
+            last_name TEXT,
+            role TEXT,
+            email TEXT
+        )
+    """)
+    await _add_column(db, "users", "role", "TEXT")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_vaults (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            vault_name TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            UNIQUE(user_id, vault_name)
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS vault_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            vault_name TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            uploaded_at TEXT NOT NULL,
+            UNIQUE(user_id, vault_name, filename)
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS chats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            vault_name TEXT,
+            title TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            sender_name TEXT,
+            receiver_name TEXT,
+            label TEXT,
+            time_frame TEXT
+        )
+    """)
+    for column in ("sender_name", "receiver_name", "label", "time_frame"):
+        await _add_column(db, "chats", column, "TEXT")
+    # 'pending' while the LLM title is still being generated in the background
+    await _add_column(db, "chats", "title_status", "TEXT NOT NULL DEFAULT 'final'")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            FOREIGN KEY(chat_id) REFERENCES chats(id)
+        )
+    """)
+    await _add_column(db, "chat_messages", "sources", "TEXT")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS ingestion_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            vault_name TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            status TEXT NOT NULL,
+            pages_total INTEGER,
+            pages_parsed INTEGER NOT NULL DEFAULT 0,
+            chunks_total INTEGER,
+            chunks_embedded INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    """)
+    await _add_column(db, "ingestion_jobs", "pages_per_sec", "REAL")
+    for column in ("chunks_added", "chunks_removed", "chunks_kept"):
+        await _add_column(db, "ingestion_jobs", column, "INTEGER")
+    await _add_column(db, "ingestion_jobs", "replace_existing", "INTEGER NOT NULL DEFAULT 0")
+
+
+async def _migrate_chat_search_index(db: aiosqlite.Connection):
+    '''FTS5 indexes over chat titles/labels and message content, kept in sync by triggers.'''
+    async with db.execute("SELECT name FROM sqlite_master WHERE name IN ('chats_fts', 'chat_messages_fts')") as cursor:
+        existing = {row[0] for row in await cursor.fetchall()}
+    statements = [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts USING fts5(
+            title, label, content='chats', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS chats_fts_ai AFTER INSERT ON chats BEGIN
+            INSERT INTO chats_fts(rowid, title, label) VALUES (new.id, new.title, new.label);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS chats_fts_ad AFTER DELETE ON chats BEGIN
+            INSERT INTO chats_fts(chats_fts, rowid, title, label) VALUES ('delete', old.id, old.title, old.label);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS chats_fts_au AFTER UPDATE OF title, label ON chats BEGIN
+            INSERT INTO chats_fts(chats_fts, rowid, title, label) VALUES ('delete', old.id, old.title, old.label);
+            INSERT INTO chats_fts(rowid, title, label) VALUES (new.id, new.title, new.label);
+        END""",
+        """CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(
+            content, content='chat_messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ai AFTER INSERT ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts(rowid, content) VALUES (new.id, new.content);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ad AFTER DELETE ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_au AFTER UPDATE OF content ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO chat_messages_fts(rowid, content) VALUES (new.id, new.content);
+        END""",
+    ]
+    for statement in statements:
+        await db.execute(statement)
+    # Backfill chats that existed before the FTS tables did
+    if "chats_fts" not in existing:
+        await db.execute("INSERT INTO chats_fts(chats_fts) VALUES ('rebuild')")
+    if "chat_messages_fts" not in existing:
+        await db.execute("INSERT INTO chat_messages_fts(chat_messages_fts) VALUES ('rebuild')")
+
+
+async def _migrate_query_indexes(db: aiosqlite.Connection):
+    # One per hot WHERE/ORDER BY, so none of them needs a scan or a temp sort
+    for statement in (
+        # /chats/{id}/messages, delete_vault's sub-select
+        "CREATE INDEX IF NOT EXISTS idx_chat_messages_chat ON chat_messages(chat_id, id)",
+        # /chats: WHERE user_id = ? ORDER BY created_at DESC
+        "CREATE INDEX IF NOT EXISTS idx_chats_user_created ON chats(user_id, created_at DESC)",
+        # delete_vault: WHERE vault_name = ? AND user_id = ?
+        "CREATE INDEX IF NOT EXISTS idx_chats_vault_user ON chats(vault_name, user_id)",
+        # /vaults/{name}/files: WHERE user_id = ? AND vault_name = ? ORDER BY uploaded_at DESC
+        "CREATE INDEX IF NOT EXISTS idx_vault_files_user_vault_uploaded ON vault_files(user_id, vault_name, uploaded_at DESC)",
+        # /jobs and the duplicate-upload check
+        "CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_user ON ingestion_jobs(user_id, vault_name, filename, status)",
+        # The ingestion workers' claim query: WHERE status = ? ORDER BY id
+        "CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs(status, id)",
+    ):
+        await db.execute(statement)
+    await db.execute("ANALYZE")
+
+
+async def _migrate_chat_keyset_index(db: aiosqlite.Connection):
+    # /chats pages on (created_at, id), so id must be in the index to avoid a temp sort
+    await db.execute("DROP INDEX IF EXISTS idx_chats_user_created")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_chats_user_created_id ON chats(user_id, created_at DESC, id DESC)")
+
+
+async def _migrate_message_sources(db: aiosqlite.Connection):
+    # Chunk references replacing the JSON copy in chat_messages.sources;
+    # MessageSourceStore moves existing messages over in the background.
+    # content is only kept for chunks the vault no longer has.
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS message_sources (
+            message_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            chunk_id TEXT NOT NULL,
+            source TEXT,
+            page INTEGER,
+            score REAL,
+            content TEXT,
+            PRIMARY KEY (message_id, position),
+            FOREIGN KEY(message_id) REFERENCES chat_messages(id)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS chat_messages_sources_ad AFTER DELETE ON chat_messages BEGIN
+            DELETE FROM message_sources WHERE message_id = old.id;
+        END
+    """)
+
+
+async def _migrate_ingestion_batches(db: aiosqlite.Connection):
+    # Files of one bulk upload share a batch_id
+    await _add_column(db, "ingestion_jobs", "batch_id", "TEXT")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_batch ON ingestion_jobs(batch_id)")
+
+
+async def _migrate_pdf_backends(db: aiosqlite.Connection):
+    # Text extractor chosen for a vault (NULL: server default), the one each
+    # job used, and the job's per-extractor timings as JSON
+    await _add_column(db, "user_vaults", "pdf_backend", "TEXT")
+    await _add_column(db, "ingestion_jobs", "pdf_backend", "TEXT")
+    await _add_column(db, "ingestion_jobs", "extract_timings", "TEXT")
+
+
+async def _migrate_ingestion_memory(db: aiosqlite.Connection):
+    # Process RSS and chunks waiting in the embed/write pipeline at their peak during a job
+    await _add_column(db, "ingestion_jobs", "peak_rss_mb", "REAL")
+    await _add_column(db, "ingestion_jobs", "peak_pending_chunks", "INTEGER")
+
+
+async def _migrate_message_source_chunks(db: aiosqlite.Connection):
+    # Chunks about to be deleted from a vault are looked up by ID, to copy
+    # their text into the message sources citing them
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_message_sources_chunk ON message_sources(chunk_id)")
+
+
+MIGRATIONS = [
+    (1, "base schema", _migrate_base_schema),
+    (2, "chat search index", _migrate_chat_search_index),
+    (3, "query indexes", _migrate_query_indexes),
+    (4, "chat keyset index", _migrate_chat_keyset_index),
+    (5, "message sources as chunk references", _migrate_message_sources),
+    (6, "ingestion batches", _migrate_ingestion_batches),
+    (7, "pdf backends", _migrate_pdf_backends),
+    (8, "ingestion memory metrics", _migrate_ingestion_memory),
+    (9, "message source chunk index", _migrate_message_source_chunks),
+]
+
+
+async def run_migrations(db: aiosqlite.Connection):
+    async with db.execute("PRAGMA user_version") as cursor:
+        current = (await cursor.fetchone())[0]
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        await db.execute("BEGIN")
         try:
-            await db.execute("ALTER TABLE chat_messages ADD COLUMN sources TEXT")
-        except:
-            pass
-        await db.commit()
+            await migrate(db)
+            await db.execute(f"PRAGMA user_version = {version}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        print(f"Applied database migration {version}: {description}")
@@ -1,22 +1,40 @@
+import asyncio
+import base64
 import os
 import shutil
+import time
+import uuid
+import zipfile
 from datetime import datetime, timezone
 
-from fastapi import FastAPI, HTTPException, Depends, Query, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Depends, Query, UploadFile, File, Form, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.auth import router as auth_router
-from app.database import init_db, get_db
-from app.utils.security import get_current_user
+from app.database import init_db, get_db, DB_PATH, DB_POOL
+from app.utils.security import get_current_user, require_admin
 import contextlib
 import aiosqlite
 from pathlib import Path
 from pydantic import BaseModel
 import json
 from app.services.chunking_service import ChunkingService
-from app.services.pdf_service import PDFProcessor
+from app.services.pdf_service import PDF_BACKENDS, PDFProcessor
 from app.services.vector_db_service import VectorDBService
-from app.services.llm_service import LLMService
+from app.services.embedding_cache import EmbeddingCache
+from app.services.answer_cache import AnswerCache
+from app.services.lexical_index_service import LexicalIndex
+from app.services.llm_scheduler import LLMScheduler, SchedulerBusy, ERROR_RESPONSE, NO_CONTEXT_RESPONSE
+from app.services.context_builder import ContextBuilder, estimate_tokens
+from app.services.executor_service import ExecutorService
+from app.services.ingestion_service import IngestionService
+from app.services.singleflight import SingleFlight
+from app.services.cache_service import normalize_query
+from app.services.chat_search_service import ChatSearchService
+from app.services.message_sources_service import MessageSourceStore
+from app.services.title_service import TitleService, extractive_title, TITLE_PENDING
+from app.services.metrics_service import MetricsRegistry, RequestTimer, COUNT_BUCKETS, CONTENT_TYPE
+from app import config
 
 
 class QueryRequest(BaseModel):
@@ -33,7 +51,21 @@ class QueryRequest(BaseModel):
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
+    await DB_POOL.open()
+    await LLM_SCHEDULER.start()
+    await INGESTION_SERVICE.start()
+    await TITLE_SERVICE.start()
+    await MESSAGE_SOURCES.start()
+    # Load the embedding model now; hybrid searches use the keyword index until it is ready
+    EXECUTORS.cpu_pool.submit(VECTOR_SERVICE.warm_up)
+    EXECUTORS.cpu_pool.submit(VECTOR_SERVICE.backfill_lexical_index)
     yield
+    await INGESTION_SERVICE.stop()
+    await TITLE_SERVICE.stop()
+    await MESSAGE_SOURCES.stop()
+    await LLM_SCHEDULER.stop()
+    EXECUTORS.shutdown()
+    await DB_POOL.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -54,19 +86,126 @@ app.add_middleware(
 )
 
 app.include_router(auth_router.router, prefix="/auth", tags=["auth"])
+# Newer FastAPI versions match an included router's routes in place, so
+# scope["route"] is the router's own route and its path lacks the prefix;
+# these give route_template the full path (older versions copy the routes
+# into the app with the prefix already in their path)
+INCLUDED_ROUTE_PATHS = {id(route): "/auth" + route.path for route in auth_router.router.routes}
+
+# Prometheus metrics served on GET /metrics; services given METRICS record into it
+METRICS = MetricsRegistry()
+HTTP_SECONDS = METRICS.histogram(
+    "vault_http_request_seconds", "Time to respond per route (for streams, until the response starts)",
+    ("method", "route", "status")
+)
+STAGE_SECONDS = METRICS.histogram(
+    "vault_request_stage_seconds", "Time spent in each stage of /upload and /chat/query", ("endpoint", "stage")
+)
+CONTEXT_CHUNKS = METRICS.histogram(
+    "vault_chat_context_chunks", "Chunks retrieved for a question, and how many were packed into its prompt",
+    ("step",), buckets=COUNT_BUCKETS
+)
+ANSWER_CACHE_LOOKUPS = METRICS.counter("vault_answer_cache_lookups_total", "Answer cache lookups by chat queries", ("result",))
+
+
+def route_template(request: Request) -> str:
+    '''The matched route's path template, so each chat or job ID doesn't get its own series.'''
+    route = request.scope.get("route")
+    if route is None:
+        return "unmatched"
+    return INCLUDED_ROUTE_PATHS.get(id(route), route.path)
+
+
+@app.middleware("http")
+async def record_request_time(request: Request, call_next):
+    began = time.perf_counter()
+    response = await call_next(request)
+    HTTP_SECONDS.observe(time.perf_counter() - began, method=request.method, route=route_template(request),
+                         status=response.status_code)
+    return response
 
 # Initialize services once at startup to keep the AI model in memory
-CHUNK_SERVICE = ChunkingService(chunk_size=800, chunk_overlap=150)
-PDF_PROCESSOR = PDFProcessor(chunking_service=CHUNK_SERVICE)
-VECTOR_SERVICE = VectorDBService()
+CHUNK_SERVICE = ChunkingService(
+    chunk_size=800,
+    chunk_overlap=150,
+    mode=config.CHUNK_MODE,
+    chunk_tokens=config.CHUNK_TOKENS,
+    overlap_tokens=config.CHUNK_OVERLAP_TOKENS
+)
+PDF_PROCESSOR = PDFProcessor(
+    chunking_service=CHUNK_SERVICE,
+    pages_per_task=config.PDF_PAGES_PER_TASK,
+    parallel_min_pages=config.PDF_PARALLEL_MIN_PAGES,
+    backend=config.PDF_BACKEND,
+    fallback_backend=config.PDF_FALLBACK_BACKEND
+)
+# Generated answers, keyed by vault version so any change to a vault retires them
+ANSWER_CACHE = AnswerCache(
+    "data/answer_cache.db",
+    max_bytes=config.ANSWER_CACHE_MB * 1024 * 1024,
+    max_age=config.ANSWER_CACHE_MAX_AGE_HOURS * 3600
+)
+# Keyword (FTS5) index of every vault's chunks, stored next to users.db
+LEXICAL_INDEX = LexicalIndex(os.path.join(os.path.dirname(DB_PATH), "vault_index.db"))
+VECTOR_SERVICE = VectorDBService(
+    embedding_cache=EmbeddingCache("data/embedding_cache.db", max_bytes=config.EMBEDDING_CACHE_MB * 1024 * 1024),
+    query_cache_size=config.QUERY_EMBEDDING_CACHE_SIZE,
+    result_cache_size=config.RETRIEVAL_CACHE_SIZE,
+    lexical_index=LEXICAL_INDEX,
+    search_mode=config.SEARCH_MODE,
+    version_store=ANSWER_CACHE
+)
 
-# Lazily initialized to prevent process lock errors during Uvicorn hot-reloads
-LLM_SERVICE = None
+# GPT4All runs in separate worker processes behind a bounded priority queue.
+# Each worker loads the model on its first request, so Uvicorn hot-reloads
+# don't pay for it.
+LLM_SCHEDULER = LLMScheduler(
+    workers=config.LLM_WORKERS,
+    max_queue=config.LLM_QUEUE_SIZE,
+    queue_timeout=config.LLM_QUEUE_TIMEOUT,
+    llm_kwargs={"n_ctx": config.LLM_CONTEXT_TOKENS},
+    service_class=config.LLM_SERVICE,
+    metrics=METRICS
+)
 
-# Temp upload dir
+# Blocking vector DB and PDF work is awaited on these pools so the event
+# loop stays free for lightweight endpoints (login, /vaults, /chats...)
+EXECUTORS = ExecutorService(
+    cpu_threads=config.CPU_THREADS,
+    pdf_processes=config.PDF_PROCESSES
+)
+
+# Temp upload dir (uploads wait here until their ingestion job has run)
 TEMP_DIR = Path("temp")
 TEMP_DIR.mkdir(exist_ok=True)
 
+INGESTION_SERVICE = IngestionService(
+    db_path=DB_PATH,
+    pdf_processor=PDF_PROCESSOR,
+    vector_service=VECTOR_SERVICE,
+    executors=EXECUTORS,
+    num_workers=config.INGESTION_WORKERS,
+    vault_root=Path("data/vaults"),
+    embed_batch_size=config.INGESTION_EMBED_BATCH_SIZE,
+    queue_size=config.INGESTION_QUEUE_SIZE,
+    metrics=METRICS
+)
+
+# Identical questions asked at the same time share one LLM generation (answers
+# don't depend on the chat they're asked in, so the key has no chat in it)
+ANSWER_FLIGHTS = SingleFlight()
+
+# Message sources are stored as chunk references; the text is read from the vault
+MESSAGE_SOURCES = MessageSourceStore(db_path=DB_PATH, vector_service=VECTOR_SERVICE, executors=EXECUTORS)
+# ...and cited chunks get their text copied there before a delete or re-upload removes them
+VECTOR_SERVICE.source_archive = MESSAGE_SOURCES
+
+# Ranked full-text search over chat titles, labels and messages (FTS5)
+CHAT_SEARCH = ChatSearchService()
+
+# New chats get an extractive title at once; the LLM title follows when the model is idle
+TITLE_SERVICE = TitleService(db_path=DB_PATH, scheduler=LLM_SCHEDULER)
+
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Vault file tracking helpers
@@ -80,70 +219,232 @@ async def file_exists_in_vault(db: aiosqlite.Connection, user_id: int, vault_nam
         return await cursor.fetchone() is not None
 
 
-async def record_vault_file(db: aiosqlite.Connection, user_id: int, vault_name: str, filename: str):
-    await db.execute(
-        "INSERT OR IGNORE INTO vault_files (user_id, vault_name, filename, uploaded_at) VALUES (?, ?, ?, ?)",
-        (user_id, vault_name, filename, datetime.now(timezone.utc).isoformat())
-    )
-    await db.commit()
+def check_pdf_backend(name: str) -> str:
+    if name not in PDF_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"Unknown PDF backend '{name}'. Available: {', '.join(PDF_BACKENDS)}.")
+    return name
+
+
+async def resolve_pdf_backend(db: aiosqlite.Connection, user_id: int, vault_name: str, requested: str | None) -> str:
+    '''Extractor for an upload: the one requested, else the vault's, else the server default.'''
+    if requested:
+        return check_pdf_backend(requested)
+    async with db.execute(
+        "SELECT pdf_backend FROM user_vaults WHERE user_id = ? AND vault_name = ?", (user_id, vault_name)
+    ) as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row and row[0] in PDF_BACKENDS else PDF_PROCESSOR.backend
 
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Upload endpoint (extended with file tracking)
+# Upload endpoint (queues a background ingestion job)
 # ─────────────────────────────────────────────────────────────────────────────
 
-@app.post("/upload")
+@app.post("/upload", status_code=202)
 async def upload_document(
+        response: Response,
         file: UploadFile = File(...),
         domain: str = Form(...),
+        replace: bool = Form(False),
+        pdf_backend: str | None = Form(None),
         current_user_id: int = Depends(get_current_user),
         db: aiosqlite.Connection = Depends(get_db)
 ):
     user_id = current_user_id
-    temp_path = TEMP_DIR / file.filename
+    timer = RequestTimer("upload", STAGE_SECONDS)
+    with timer.span("resolve_backend"):
+        pdf_backend = await resolve_pdf_backend(db, user_id, domain, pdf_backend)
 
-    # Check for duplicate BEFORE doing expensive PDF processing
-    if await file_exists_in_vault(db, user_id, domain, file.filename):
+    # Check for duplicate BEFORE doing expensive PDF processing.
+    # replace=true re-ingests a revised version, syncing only changed chunks.
+    with timer.span("duplicate_check"):
+        active = await INGESTION_SERVICE.has_active_job(db, user_id, domain, file.filename)
+        exists = await file_exists_in_vault(db, user_id, domain, file.filename)
+    if active:
+        raise HTTPException(
+            status_code=409,
+            detail=f"'{file.filename}' is already being added to this vault."
+        )
+    if exists and not replace:
         raise HTTPException(
             status_code=409,
             detail=f"'{file.filename}' has already been added to this vault."
         )
 
+    # Unique name so two users uploading "report.pdf" at once don't collide
+    temp_path = TEMP_DIR / f"{uuid.uuid4().hex}_{Path(file.filename).name}"
     try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        processed_chunks = PDF_PROCESSOR.process_pdf(str(temp_path), domain)
-        if not processed_chunks:
-            raise HTTPException(status_code=400, detail="PDF contained no extractable text.")
-
-        VECTOR_SERVICE.add_to_vault(vault_name=domain, processed_chunks=processed_chunks)
+        with timer.span("save_file"), open(temp_path, "wb") as buffer:
+            await EXECUTORS.run_cpu(shutil.copyfileobj, file.file, buffer)
 
-        # Record the file so we can track it and prevent re-uploads
-        await record_vault_file(db, user_id, domain, file.filename)
-
-        # Move it to persistent vault storage instead of deleting
-        vault_dir = Path("data/vaults") / domain
-        vault_dir.mkdir(parents=True, exist_ok=True)
-        dest_path = vault_dir / file.filename
-        shutil.move(str(temp_path), str(dest_path))
-
-        return {
-            "status": "success",
-            "filename": file.filename,
-            "chunks_count": len(processed_chunks),
-            "vault": domain
-        }
-    except HTTPException:
-        raise
+        with timer.span("enqueue"):
+            job_id = await INGESTION_SERVICE.enqueue(
+                db, user_id, domain, file.filename, str(temp_path), replace_existing=exists, pdf_backend=pdf_backend
+            )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
-    finally:
         if temp_path.exists():
             try:
                 os.remove(temp_path)
             except:
                 pass
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+    timer.finish()
+    response.headers["Server-Timing"] = timer.server_timing()
+    return {
+        "status": "queued",
+        "job_id": job_id,
+        "filename": file.filename,
+        "vault": domain,
+        "pdf_backend": pdf_backend
+    }
+
+
+def remove_temp_file(path: Path):
+    if path.exists():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def extract_zip_pdfs(zip_path: Path, max_files: int) -> list[tuple[str, Path]]:
+    '''Unpack up to max_files PDFs of a zip into TEMP_DIR as [(filename, temp_path)]; other members are ignored.'''
+    extracted = []
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            for member in archive.infolist():
+                # Only the base name is used, so members can't be written outside TEMP_DIR
+                name = Path(member.filename.replace("\\", "/")).name
+                if member.is_dir() or member.filename.startswith("__MACOSX/") or not name.lower().endswith(".pdf"):
+                    continue
+                if len(extracted) >= max_files:
+                    break
+                temp_path = TEMP_DIR / f"{uuid.uuid4().hex}_{name}"
+                extracted.append((name, temp_path))
+                with archive.open(member) as source, open(temp_path, "wb") as target:
+                    shutil.copyfileobj(source, target)
+    except Exception:
+        for _, path in extracted:
+            remove_temp_file(path)
+        raise
+    return extracted
+
+
+@app.post("/upload/bulk", status_code=202)
+async def upload_documents_bulk(
+        files: list[UploadFile] = File(...),
+        domain: str = Form(...),
+        replace: bool = Form(False),
+        pdf_backend: str | None = Form(None),
+        current_user_id: int = Depends(get_current_user),
+        db: aiosqlite.Connection = Depends(get_db)
+):
+    """
+    Queue many PDFs at once, sent as several files and/or zip archives of PDFs.
+
+    The files share a batch_id; GET /batches/{batch_id} reports each file's
+    status and the batch's throughput. Files already in the vault (unless
+    replace=true), already being added, or repeated in the request are
+    skipped and listed with the reason.
+    """
+    user_id = current_user_id
+    pdf_backend = await resolve_pdf_backend(db, user_id, domain, pdf_backend)
+    staged: list[tuple[str, Path]] = []
+    try:
+        for upload in files:
+            temp_path = TEMP_DIR / f"{uuid.uuid4().hex}_{Path(upload.filename).name}"
+            with open(temp_path, "wb") as buffer:
+                await EXECUTORS.run_cpu(shutil.copyfileobj, upload.file, buffer)
+            if upload.filename.lower().endswith(".zip"):
+                try:
+                    staged.extend(await EXECUTORS.run_cpu(
+                        extract_zip_pdfs, temp_path, config.BULK_UPLOAD_MAX_FILES + 1 - len(staged)
+                    ))
+                finally:
+                    remove_temp_file(temp_path)
+            else:
+                staged.append((Path(upload.filename).name, temp_path))
+            if len(staged) > config.BULK_UPLOAD_MAX_FILES:
+                raise HTTPException(status_code=413, detail=f"At most {config.BULK_UPLOAD_MAX_FILES} files per bulk upload.")
+    except Exception as e:
+        for _, path in staged:
+            remove_temp_file(path)
+        if isinstance(e, HTTPException):
+            raise
+        if isinstance(e, zipfile.BadZipFile):
+            raise HTTPException(status_code=400, detail="One of the zip archives could not be read.")
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+    accepted, skipped, seen = [], [], set()
+    for filename, temp_path in staged:
+        reason = None
+        if filename in seen:
+            reason = "Repeated in this upload."
+        elif await INGESTION_SERVICE.has_active_job(db, user_id, domain, filename):
+            reason = "Already being added to this vault."
+        else:
+            exists = await file_exists_in_vault(db, user_id, domain, filename)
+            if exists and not replace:
+                reason = "Already added to this vault."
+        seen.add(filename)
+        if reason:
+            skipped.append({"filename": filename, "reason": reason})
+            remove_temp_file(temp_path)
+        else:
+            accepted.append((filename, str(temp_path), exists))
+
+    batch_id = uuid.uuid4().hex if accepted else None
+    try:
+        job_ids = await INGESTION_SERVICE.enqueue_batch(db, user_id, domain, batch_id, accepted, pdf_backend) if accepted else []
+    except Exception as e:
+        for _, path, _ in accepted:
+            remove_temp_file(Path(path))
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+    return {
+        "status": "queued",
+        "batch_id": batch_id,
+        "vault": domain,
+        "pdf_backend": pdf_backend,
+        "queued": [{"job_id": job_id, "filename": filename} for job_id, (filename, _, _) in zip(job_ids, accepted)],
+        "skipped": skipped
+    }
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Ingestion job endpoints
+# ─────────────────────────────────────────────────────────────────────────────
+
+@app.get("/jobs")
+async def list_jobs(vault_name: str | None = Query(None), current_user_id: int = Depends(get_current_user), db: aiosqlite.Connection = Depends(get_db)):
+    """Return the user's most recent ingestion jobs, optionally for one vault."""
+    return {"jobs": await INGESTION_SERVICE.list_jobs(db, current_user_id, vault_name)}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: int, current_user_id: int = Depends(get_current_user), db: aiosqlite.Connection = Depends(get_db)):
+    job = await INGESTION_SERVICE.get_job(db, job_id, current_user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/batches/{batch_id}")
+async def get_batch(batch_id: str, current_user_id: int = Depends(get_current_user), db: aiosqlite.Connection = Depends(get_db)):
+    """Per-file status, totals and throughput of a bulk upload."""
+    batch = await INGESTION_SERVICE.get_batch(db, batch_id, current_user_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int, current_user_id: int = Depends(get_current_user), db: aiosqlite.Connection = Depends(get_db)):
+    job = await INGESTION_SERVICE.cancel_job(db, job_id, current_user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -153,17 +454,24 @@ async def upload_document(
 class CreateVaultRequest(BaseModel):
     vault_name: str
     user_id: int
+    pdf_backend: str | None = None
+
+class UpdateVaultRequest(BaseModel):
+    # None goes back to the server default
+    pdf_backend: str | None = None
 
 @app.post("/vaults")
 async def create_vault(request: CreateVaultRequest, current_user_id: int = Depends(get_current_user), db: aiosqlite.Connection = Depends(get_db)):
     """Create a new empty vault for a user."""
+    if request.pdf_backend:
+        check_pdf_backend(request.pdf_backend)
     try:
         await db.execute(
-            "INSERT INTO user_vaults (user_id, vault_name, created_at) VALUES (?, ?, ?)",
-            (current_user_id, request.vault_name, datetime.now(timezone.utc).isoformat())
+            "INSERT INTO user_vaults (user_id, vault_name, created_at, pdf_backend) VALUES (?, ?, ?, ?)",
+            (current_user_id, request.vault_name, datetime.now(timezone.utc).isoformat(), request.pdf_backend or None)
         )
         await db.commit()
-        return {"status": "success", "vault_name": request.vault_name}
+        return {"status": "success", "vault_name": request.vault_name, "pdf_backend": request.pdf_backend or None}
     except aiosqlite.IntegrityError:
         raise HTTPException(status_code=409, detail="A vault with this name already exists.")
     except Exception as e:
@@ -175,7 +483,7 @@ async def list_vaults(current_user_id: int = Depends(get_current_user), db: aios
     """Return all vaults for a user with their file counts, including empty vaults."""
     async with db.execute(
         """
-        SELECT uv.vault_name, COUNT(vf.id) as file_count
+        SELECT uv.vault_name, COUNT(vf.id) as file_count, uv.pdf_backend
         FROM user_vaults uv
         LEFT JOIN vault_files vf ON uv.user_id = vf.user_id AND uv.vault_name = vf.vault_name
         WHERE uv.user_id = ?
@@ -187,10 +495,25 @@ async def list_vaults(current_user_id: int = Depends(get_current_user), db: aios
         rows = await cursor.fetchall()
 
     return {
-        "vaults": [{"name": row[0], "file_count": row[1]} for row in rows]
+        "vaults": [{"name": row[0], "file_count": row[1], "pdf_backend": row[2]} for row in rows]
     }
 
 
+@app.patch("/vaults/{vault_name}")
+async def update_vault(vault_name: str, request: UpdateVaultRequest, current_user_id: int = Depends(get_current_user), db: aiosqlite.Connection = Depends(get_db)):
+    """Change a vault's settings; pdf_backend applies to files uploaded from now on."""
+    if request.pdf_backend:
+        check_pdf_backend(request.pdf_backend)
+    cursor = await db.execute(
+        "UPDATE user_vaults SET pdf_backend = ? WHERE user_id = ? AND vault_name = ?",
+        (request.pdf_backend or None, current_user_id, vault_name)
+    )
+    await db.commit()
+    if cursor.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Vault not found")
+    return {"vault_name": vault_name, "pdf_backend": request.pdf_backend or None}
+
+
 @app.get("/vaults/{vault_name}/files")
 async def list_vault_files(vault_name: str, current_user_id: int = Depends(get_current_user), db: aiosqlite.Connection = Depends(get_db)):
     """Return all files in a specific vault for a user."""
@@ -219,66 +542,199 @@ async def download_vault_file(vault_name: str, filename: str, current_user_id: i
 
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Chat query endpoint
+# Chat query helpers
 # ─────────────────────────────────────────────────────────────────────────────
 
-@app.post("/chat/query")
-async def chat_query(request: QueryRequest, current_user_id: int = Depends(get_current_user), db: aiosqlite.Connection = Depends(get_db)) -> dict:
-    global LLM_SERVICE
-    try:
-        # Determine chat_id
-        chat_id = request.chat_id
-        if request.chat_id is None:
-            if LLM_SERVICE is None:
-                LLM_SERVICE = LLMService()
-            title = LLM_SERVICE.generate_chat_title(request.query)
-            async with db.execute(
-                "INSERT INTO chats (user_id, vault_name, title, created_at, sender_name, receiver_name, label, time_frame) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                (current_user_id, request.vault_name, title, datetime.now(timezone.utc).isoformat(), request.sender_name or "User", request.receiver_name or "Vault AI", request.label or "General", request.time_frame or "Recent")
-            ) as cursor:
-                chat_id = cursor.lastrowid
-            await db.commit()
+def llm_busy_error(e: SchedulerBusy) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+async def generate_answer(query: str, context: str, user_id: int, usage: dict | None = None) -> str:
+    answer = await LLM_SCHEDULER.run("answer", {"query": query, "context": context}, user_id=user_id, usage=usage)
+    return answer.strip()
+
+
+def submit_answer(query: str, context: str, user_id: int):
+    '''Queue an answer; its tokens come from LLM_SCHEDULER.results(). Raises SchedulerBusy if the LLM queue is full.'''
+    return LLM_SCHEDULER.submit("answer", {"query": query, "context": context}, user_id=user_id)
+
+
+def add_llm_usage(timer: RequestTimer, usage: dict):
+    '''Split an answer's LLM time into queue wait, prompt evaluation and generation.'''
+    timer.add("llm_queue", usage.get("queue_seconds"))
+    timer.add("llm_prompt", usage.get("prompt_seconds"))
+    timer.add("llm_generate", usage.get("generate_seconds"))
+
+
+async def search_vault(vault_name: str, query_text: str, timer: RequestTimer) -> list[dict]:
+    '''Search on the CPU pool; the query embedding, Chroma and keyword search times go into `timer`.'''
+    timings = {}
+    with timer.span("search"):
+        results = await EXECUTORS.run_cpu(
+            VECTOR_SERVICE.search_vault, vault_name=vault_name, query_text=query_text, timings=timings
+        )
+    for stage, seconds in timings.items():
+        timer.add(f"search_{stage}", seconds)
+    return results
+
+
+async def create_chat(db: aiosqlite.Connection, user_id: int, request: QueryRequest) -> int:
+    '''
+    Insert the chat with a provisional title; the caller commits. Once its
+    messages are saved, queue the LLM title with TITLE_SERVICE.enqueue.
+    '''
+    async with db.execute(
+        "INSERT INTO chats (user_id, vault_name, title, title_status, created_at, sender_name, receiver_name, label, time_frame) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (user_id, request.vault_name, extractive_title(request.query), TITLE_PENDING, datetime.now(timezone.utc).isoformat(), request.sender_name or "User", request.receiver_name or "Vault AI", request.label or "General", request.time_frame or "Recent")
+    ) as cursor:
+        return cursor.lastrowid
 
-        # Save user message
+
+async def delete_chat_if_empty(chat_id: int):
+    '''Remove a chat no message was saved to (its answer failed or the client left).'''
+    async with DB_POOL.connection() as db:
         await db.execute(
-            "INSERT INTO chat_messages (chat_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
-            (chat_id, "user", request.query, datetime.now(timezone.utc).isoformat())
+            "DELETE FROM chats WHERE id = ? AND NOT EXISTS (SELECT 1 FROM chat_messages WHERE chat_id = ?)",
+            (chat_id, chat_id)
         )
         await db.commit()
 
-        results = VECTOR_SERVICE.search_vault(
-            vault_name=request.vault_name,
-            query_text=request.query
-        )
 
+async def save_user_message(db: aiosqlite.Connection, chat_id: int, content: str, timestamp: str | None = None):
+    '''Insert the user's message; the caller commits.'''
+    await db.execute(
+        "INSERT INTO chat_messages (chat_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+        (chat_id, "user", content, timestamp or datetime.now(timezone.utc).isoformat())
+    )
+
+
+async def save_assistant_message(db: aiosqlite.Connection, chat_id: int, content: str, results: list[dict]) -> int:
+    '''Insert the assistant's message and references to its sources, and return its id; the caller commits.'''
+    cursor = await db.execute(
+        "INSERT INTO chat_messages (chat_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+        (chat_id, "assistant", content, datetime.now(timezone.utc).isoformat())
+    )
+    await MESSAGE_SOURCES.save(db, cursor.lastrowid, results)
+    return cursor.lastrowid
+
+
+def count_prompt_tokens(text: str) -> int:
+    # Once a worker has answered, its calibrated ratio is more accurate
+    if LLM_SCHEDULER.chars_per_token:
+        return estimate_tokens(text, LLM_SCHEDULER.chars_per_token)
+    return estimate_tokens(text)
+
+
+CONTEXT_BUILDER = ContextBuilder(count_tokens=count_prompt_tokens, token_budget=config.CONTEXT_TOKEN_BUDGET)
+
+
+def build_context_block(results: list[dict]) -> tuple[str, list[dict]]:
+    '''Pack search results into the prompt's context; returns (context_block, results actually used).'''
+    context_block, used, stats = CONTEXT_BUILDER.build(results)
+    CONTEXT_CHUNKS.observe(stats["chunks_in"], step="retrieved")
+    CONTEXT_CHUNKS.observe(stats["chunks_used"], step="packed")
+    print(f"Context packed: {stats['chunks_used']}/{stats['chunks_in']} chunks, {stats['tokens_after']} tokens "
+          f"(saved {stats['tokens_saved']} of {stats['tokens_before']} prompt tokens)")
+    return context_block, used
+
+
+def encode_cursor(*values) -> str:
+    '''Opaque keyset cursor: the sort key of the last row returned.'''
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def sse_event(event: str, data) -> str:
+    """Format a single Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+NO_RESULTS_RESPONSE = "No relevant documents found in this vault to construct an answer."
+
+
+def answer_cache_key(vault_name: str, query: str, results: list[dict]) -> tuple[str, int]:
+    '''
+    (cache key, vault version) for answering `query` from these chunks of the
+    vault as it is now. The chat isn't part of the key: answers are generated
+    without chat history, so one cached answer is valid in every chat.
+    '''
+    version = ANSWER_CACHE.vault_version(vault_name)
+    key = AnswerCache.make_key(vault_name, version, normalize_query(query), [r["id"] for r in results])
+    return key, version
+
+
+def store_answer(key: str, vault_name: str, version: int, response: str):
+    # Fallback messages mean generation failed; don't replay them
+    if response and response not in (ERROR_RESPONSE, NO_CONTEXT_RESPONSE):
+        ANSWER_CACHE.put(key, vault_name, version, response)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Chat query endpoints
+# ─────────────────────────────────────────────────────────────────────────────
+
+@app.post("/chat/query")
+async def chat_query(request: QueryRequest, response: Response, current_user_id: int = Depends(get_current_user), db: aiosqlite.Connection = Depends(get_db)) -> dict:
+    """Answers with a Server-Timing header giving the time spent in each stage."""
+    timer = RequestTimer("chat_query", STAGE_SECONDS)
+    try:
+        asked_at = datetime.now(timezone.utc).isoformat()
+        results = await search_vault(request.vault_name, request.query, timer)
+
+        cache_key = None
         if not results:
-            generated_response = "No relevant documents found in this vault to construct an answer."
+            generated_response = NO_RESULTS_RESPONSE
             context_block = ""
         else:
-            context_block = "\n\n".join([f"[Source: {res['metadata']['source']}, Page: {res['metadata']['page']}]\n{res['content']}" for res in results])
-            if LLM_SERVICE is None:
-                LLM_SERVICE = LLMService()
-                
-            generated_response = LLM_SERVICE.generate_answer(
-                query=request.query, 
-                context=context_block
-            )
+            with timer.span("context"):
+                context_block, results = build_context_block(results)
+            with timer.span("answer_cache"):
+                cache_key, vault_version = answer_cache_key(request.vault_name, request.query, results)
+                generated_response = await EXECUTORS.run_cpu(ANSWER_CACHE.get, cache_key)
+            ANSWER_CACHE_LOOKUPS.inc(result="miss" if generated_response is None else "hit")
+            if generated_response is None:
+                # Fail fast (503) before creating anything if the LLM queue is full
+                LLM_SCHEDULER.ensure_capacity()
 
-        # Save assistant message
-        sources_json = json.dumps(results) if results else "[]"
-        try:
-            await db.execute(
-                "INSERT INTO chat_messages (chat_id, role, content, timestamp, sources) VALUES (?, ?, ?, ?, ?)",
-                (chat_id, "assistant", generated_response, datetime.now(timezone.utc).isoformat(), sources_json)
-            )
-        except Exception:
-            # Fallback if migration hasn't run
-            await db.execute(
-                "INSERT INTO chat_messages (chat_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
-                (chat_id, "assistant", generated_response, datetime.now(timezone.utc).isoformat())
-            )
-        await db.commit()
+        if generated_response is None:
+            usage = {}
 
+            async def generate_and_store():
+                answer = await generate_answer(request.query, context_block, current_user_id, usage)
+                await EXECUTORS.run_cpu(store_answer, cache_key, request.vault_name, vault_version, answer)
+                return answer
+
+            # The prompt is the system prompt plus this question and context,
+            # with no chat history or session state, so concurrent duplicates
+            # (same vault version, question and chunks) wait for one answer
+            # whichever chats they were asked in; each saves its own messages below
+            with timer.span("llm"):
+                generated_response, _ = await ANSWER_FLIGHTS.do(cache_key, generate_and_store)
+            add_llm_usage(timer, usage)
+
+        # Save a new chat and both messages in one transaction, so a failed
+        # answer leaves no empty chat behind
+        chat_id = request.chat_id
+        with timer.span("save_messages"):
+            if chat_id is None:
+                chat_id = await create_chat(db, current_user_id, request)
+            await save_user_message(db, chat_id, request.query, asked_at)
+            await save_assistant_message(db, chat_id, generated_response, results)
+            await db.commit()
+        if request.chat_id is None:
+            TITLE_SERVICE.enqueue(chat_id, request.query)
+
+        timer.finish()
+        response.headers["Server-Timing"] = timer.server_timing()
         return {
             "status": "success",
             "chat_id": chat_id,
@@ -288,10 +744,130 @@ async def chat_query(request: QueryRequest, current_user_id: int = Depends(get_c
             "context": context_block,
             "sources": results
         }
+    except SchedulerBusy as e:
+        raise llm_busy_error(e)
     except Exception as e:
         print(f"Chat query error: {e}")
         raise HTTPException(status_code=500, detail="An internal error occurred.")
 
+
+@app.post("/chat/query/stream")
+async def chat_query_stream(request: QueryRequest, current_user_id: int = Depends(get_current_user)):
+    """
+    Streaming variant of /chat/query using Server-Sent Events.
+
+    Events, in order:
+      - "sources": the chunks packed into the prompt, sent before generation starts
+      - "token":   one event per token as GPT4All produces it (a cached answer
+                   arrives as a single event)
+      - "done":    sent once the question and answer are saved to chat_messages
+      - "error":   sent instead of "done" if generation or saving fails
+
+    Responds 503 with Retry-After instead when the LLM queue is full.
+
+    The Server-Timing header covers the stages before the first event; the
+    "done" event carries the timings of the whole request.
+    """
+    timer = RequestTimer("chat_query_stream", STAGE_SECONDS)
+    asked_at = datetime.now(timezone.utc).isoformat()
+    usage = {}
+    try:
+        results = await search_vault(request.vault_name, request.query, timer)
+        cached_response = None
+        if results:
+            with timer.span("context"):
+                context_block, results = build_context_block(results)
+            with timer.span("answer_cache"):
+                cache_key, vault_version = answer_cache_key(request.vault_name, request.query, results)
+                cached_response = await EXECUTORS.run_cpu(ANSWER_CACHE.get, cache_key)
+            ANSWER_CACHE_LOOKUPS.inc(result="miss" if cached_response is None else "hit")
+            if cached_response is None:
+                LLM_SCHEDULER.ensure_capacity()
+    except SchedulerBusy as e:
+        raise llm_busy_error(e)
+    except Exception as e:
+        print(f"Chat stream setup error: {e}")
+        raise HTTPException(status_code=500, detail="An internal error occurred.")
+
+    async def event_stream():
+        tokens = []
+        ttft_ms = None
+        answer_job = None
+        chat_id = request.chat_id
+        saved = False
+        try:
+            if chat_id is None:
+                # Created once the response is streaming (so the "sources"
+                # event can carry its ID), and deleted below if no message is
+                # saved to it. Pooled connections are borrowed only while
+                # writing, not for the whole stream.
+                with timer.span("create_chat"):
+                    async with DB_POOL.connection() as db:
+                        chat_id = await create_chat(db, current_user_id, request)
+                        await db.commit()
+            yield sse_event("sources", {"chat_id": chat_id, "vault": request.vault_name, "sources": results})
+
+            if not results or cached_response is not None:
+                text = cached_response if cached_response is not None else NO_RESULTS_RESPONSE
+                tokens.append(text)
+                yield sse_event("token", {"text": text})
+            else:
+                # Queued only once the response is streaming, so a client that
+                # disconnects before then leaves nothing behind (a full queue
+                # was already answered with a 503 by ensure_capacity)
+                answer_job = submit_answer(request.query, context_block, current_user_id)
+                with timer.span("llm"):
+                    async for token in LLM_SCHEDULER.results(answer_job, usage):
+                        if ttft_ms is None:
+                            ttft_ms = round(timer.elapsed() * 1000, 1)
+                            print(f"Chat stream time-to-first-token: {ttft_ms} ms")
+                        tokens.append(token)
+                        yield sse_event("token", {"text": token})
+                add_llm_usage(timer, usage)
+
+            generated_response = "".join(tokens).strip()
+            if answer_job is not None:
+                await EXECUTORS.run_cpu(store_answer, cache_key, request.vault_name, vault_version, generated_response)
+            with timer.span("save_messages"):
+                async with DB_POOL.connection() as stream_db:
+                    await save_user_message(stream_db, chat_id, request.query, asked_at)
+                    message_id = await save_assistant_message(stream_db, chat_id, generated_response, results)
+                    await stream_db.commit()
+            saved = True
+            if request.chat_id is None:
+                TITLE_SERVICE.enqueue(chat_id, request.query)
+
+            timer.finish()
+            timings = timer.as_dict()
+            yield sse_event("done", {
+                "chat_id": chat_id,
+                "message_id": message_id,
+                "response": generated_response,
+                "ttft_ms": ttft_ms,
+                "total_ms": timings["total"],
+                "timings": timings
+            })
+        except SchedulerBusy as e:
+            # Waited in the LLM queue longer than VAULT_LLM_QUEUE_TIMEOUT, or it
+            # filled up after the ensure_capacity check
+            yield sse_event("error", {"chat_id": chat_id, "detail": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            yield sse_event("error", {"chat_id": chat_id, "detail": "An internal error occurred."})
+        finally:
+            if answer_job is not None:
+                # The client went away mid-answer: free the queue slot or stop the worker
+                LLM_SCHEDULER.cancel(answer_job)
+            if not saved and request.chat_id is None and chat_id is not None:
+                # Shielded, so a cancelled stream still finishes the delete
+                await asyncio.shield(delete_chat_if_empty(chat_id))
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Server-Timing": timer.server_timing()}
+    )
+
 # ─────────────────────────────────────────────────────────────────────────────
 # User and Chat History Endpoints
 # ─────────────────────────────────────────────────────────────────────────────
@@ -309,75 +885,147 @@ async def get_user_profile(user_id: int, current_user_id: int = Depends(get_curr
         # Default person description fallback
         return {"id": user_id, "username": "sapnish", "first_name": "Sapnish", "last_name": "", "email": "sapnish@example.com", "title": "System Administrator"}
 
+CHAT_COLUMNS = "id, title, created_at, sender_name, receiver_name, label, time_frame, vault_name, title_status"
+
+
 @app.get("/chats")
 async def list_chats(
     search_query: str | None = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = Query(None),
+    offset: int = Query(0, ge=0),
     current_user_id: int = Depends(get_current_user),
     db: aiosqlite.Connection = Depends(get_db)
 ):
-    query = "SELECT id, title, created_at, sender_name, receiver_name, label, time_frame, vault_name FROM chats WHERE user_id = ?"
-    params = [current_user_id]
-    
+    """
+    List the user's chats, newest first, `limit` at a time; pass the returned
+    next_cursor to get the next page. With search_query, return chats whose
+    title, label or messages contain it as whole words, best match first, each
+    with a highlighted snippet; limit/offset page through those results.
+    """
     if search_query:
-        query += " AND (title LIKE ? OR label LIKE ? OR EXISTS (SELECT 1 FROM chat_messages cm WHERE cm.chat_id = chats.id AND cm.content LIKE ?))"
-        term = f"%{search_query}%"
-        params.extend([term, term, term])
-        
-    query += " ORDER BY created_at DESC"
-    
+        rows, has_more = await CHAT_SEARCH.search(db, current_user_id, search_query, limit=limit, offset=offset)
+        page_info = {"next_offset": offset + limit if has_more else None}
+    else:
+        query = f"SELECT {CHAT_COLUMNS} FROM chats WHERE user_id = ?"
+        params = [current_user_id]
+        if cursor:
+            # Keyset: continue strictly after the last chat of the previous page
+            query += " AND (created_at, id) < (?, ?)"
+            params.extend(decode_cursor(cursor, 2))
+        query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+        async with db.execute(query, tuple(params)) as c:
+            rows = await c.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        page_info = {"next_cursor": encode_cursor(rows[-1][2], rows[-1][0]) if has_more else None}
+
+    chats = []
+    for r in rows:
+        chat = {
+            "id": str(r[0]),
+            "title": r[1],
+            "timestamp": r[2],
+            "sender_name": r[3],
+            "receiver_name": r[4],
+            "label": r[5],
+            "time_frame": r[6],
+            "vault_name": r[7],
+            "title_status": r[8]
+        }
+        if search_query:
+            chat["snippet"] = r[10]
+        chats.append(chat)
+
+    return {"chats": chats, **page_info}
+
+
+async def check_chat_owner(db: aiosqlite.Connection, chat_id: int, user_id: int) -> str | None:
+    '''Raise 403 unless the user owns the chat; returns the chat's vault name.'''
+    async with db.execute("SELECT user_id, vault_name FROM chats WHERE id = ?", (chat_id,)) as c:
+        row = await c.fetchone()
+    if not row or row[0] != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this chat")
+    return row[1]
+
+
+async def load_message_sources(db: aiosqlite.Connection, vault_name: str, rows: list[tuple]) -> dict[int, list[dict]]:
+    '''Sources for (id, ..., legacy_sources_json) message rows, legacy JSON copies first.'''
+    sources = await MESSAGE_SOURCES.load(db, vault_name, [r[0] for r in rows if r[-1] is None])
+    for r in rows:
+        if r[-1] is not None:
+            # Saved before message_sources existed and not migrated yet
+            sources[r[0]] = json.loads(r[-1])
+    return sources
+
+
+@app.get("/chats/{chat_id}/messages")
+async def list_chat_messages(
+    chat_id: int,
+    limit: int = Query(100, ge=1, le=500),
+    before: str | None = Query(None),
+    include_sources: bool = Query(True),
+    current_user_id: int = Depends(get_current_user),
+    db: aiosqlite.Connection = Depends(get_db)
+):
+    """
+    The chat's latest `limit` messages, oldest first. Pass the returned
+    next_cursor as `before` to load the page of older messages. With
+    include_sources=false each message only says whether it has sources
+    (has_sources); fetch them from /chats/{chat_id}/messages/{message_id}/sources.
+    """
+    vault_name = await check_chat_owner(db, chat_id, current_user_id)
+
+    if include_sources:
+        sources_column = "sources"
+    else:
+        sources_column = ("EXISTS (SELECT 1 FROM message_sources s WHERE s.message_id = chat_messages.id) "
+                          "OR (sources IS NOT NULL AND sources != '[]')")
+    query = f"SELECT id, role, content, timestamp, {sources_column} FROM chat_messages WHERE chat_id = ?"
+    params = [chat_id]
+    if before:
+        query += " AND id < ?"
+        params.extend(decode_cursor(before, 1))
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(limit + 1)
     async with db.execute(query, tuple(params)) as cursor:
         rows = await cursor.fetchall()
-        
-    if search_query:
-        import re
-        pattern = re.compile(rf'\b{re.escape(search_query)}\b', re.IGNORECASE)
-        filtered_rows = []
-        for r in rows:
-            chat_id, title, _, _, _, label, _, vault_name = r
-            if (title and pattern.search(title)) or (label and pattern.search(label)):
-                filtered_rows.append(r)
-                continue
-            
-            async with db.execute("SELECT content FROM chat_messages WHERE chat_id = ?", (chat_id,)) as msg_cursor:
-                msg_rows = await msg_cursor.fetchall()
-                if any(pattern.search(m[0]) for m in msg_rows):
-                    filtered_rows.append(r)
-        rows = filtered_rows
-        
-    return {"chats": [{
-        "id": str(r[0]), 
-        "title": r[1], 
-        "timestamp": r[2],
-        "sender_name": r[3],
-        "receiver_name": r[4],
-        "label": r[5],
-        "time_frame": r[6],
-        "vault_name": r[7]
-    } for r in rows]}
+    has_more = len(rows) > limit
+    rows = rows[:limit][::-1]
+    sources = await load_message_sources(db, vault_name, rows) if include_sources else {}
 
-@app.get("/chats/{chat_id}/messages")
-async def list_chat_messages(chat_id: int, current_user_id: int = Depends(get_current_user), db: aiosqlite.Connection = Depends(get_db)):
-    # Verify user owns this chat
-    async with db.execute("SELECT user_id FROM chats WHERE id = ?", (chat_id,)) as c:
+    messages = []
+    for r in rows:
+        message = {"id": str(r[0]), "role": r[1], "content": r[2], "timestamp": r[3]}
+        if include_sources:
+            message["sources"] = sources.get(r[0], [])
+        else:
+            message["has_sources"] = bool(r[4])
+        messages.append(message)
+    return {"messages": messages, "next_cursor": encode_cursor(rows[0][0]) if has_more else None}
+
+
+@app.get("/chats/{chat_id}/messages/{message_id}/sources")
+async def get_message_sources(chat_id: int, message_id: int, current_user_id: int = Depends(get_current_user), db: aiosqlite.Connection = Depends(get_db)):
+    """Sources of one message, for clients listing messages with include_sources=false."""
+    vault_name = await check_chat_owner(db, chat_id, current_user_id)
+    async with db.execute("SELECT id, sources FROM chat_messages WHERE id = ? AND chat_id = ?", (message_id, chat_id)) as c:
         row = await c.fetchone()
-        if not row or row[0] != current_user_id:
-            raise HTTPException(status_code=403, detail="Not authorized to access this chat")
+    if row is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    sources = await load_message_sources(db, vault_name, [row])
+    return {"message_id": message_id, "sources": sources.get(message_id, [])}
 
-    try:
-        async with db.execute(
-            "SELECT id, role, content, timestamp, sources FROM chat_messages WHERE chat_id = ? ORDER BY id ASC", 
-            (chat_id,)
-        ) as cursor:
-            rows = await cursor.fetchall()
-        return {"messages": [{"id": str(r[0]), "role": r[1], "content": r[2], "timestamp": r[3], "sources": json.loads(r[4]) if r[4] else []} for r in rows]}
-    except Exception:
-        # Fallback if sources column missing
-        async with db.execute(
-            "SELECT id, role, content, timestamp FROM chat_messages WHERE chat_id = ? ORDER BY id ASC", 
-            (chat_id,)
-        ) as cursor:
-            rows = await cursor.fetchall()
-        return {"messages": [{"id": str(r[0]), "role": r[1], "content": r[2], "timestamp": r[3]} for r in rows]}
+
+@app.get("/chats/{chat_id}/title")
+async def get_chat_title(chat_id: int, current_user_id: int = Depends(get_current_user), db: aiosqlite.Connection = Depends(get_db)):
+    """Poll until status is 'final': new chats start with a provisional title that the LLM replaces later."""
+    async with db.execute("SELECT user_id, title, title_status FROM chats WHERE id = ?", (chat_id,)) as c:
+        row = await c.fetchone()
+    if not row or row[0] != current_user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this chat")
+    return {"chat_id": chat_id, "title": row[1], "status": row[2]}
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -395,8 +1043,7 @@ async def delete_vault_file(vault_name: str, filename: str, current_user_id: int
         
         # Delete from Vector DB
         try:
-            collection = VECTOR_SERVICE.get_or_create_vault(vault_name)
-            collection.delete(where={"source": filename})
+            await EXECUTORS.run_cpu(VECTOR_SERVICE.delete_source, vault_name, filename)
         except Exception as e:
             print(f"Error removing from vector DB: {e}")
             
@@ -419,10 +1066,7 @@ async def delete_vault(vault_name: str, current_user_id: int = Depends(get_curre
             shutil.rmtree(vault_dir, ignore_errors=True)
             
         # 2. Delete ChromaDB collection
-        global VECTOR_SERVICE
-        if VECTOR_SERVICE is None:
-            VECTOR_SERVICE = VectorDBService()
-        VECTOR_SERVICE.delete_vault(vault_name)
+        await EXECUTORS.run_cpu(VECTOR_SERVICE.delete_vault, vault_name)
         
         # 3. Clean SQLite data
         await db.execute(
@@ -440,9 +1084,38 @@ async def delete_vault(vault_name: str, current_user_id: int = Depends(get_curre
         raise HTTPException(status_code=500, detail=str(e))
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Health check
+# Health check and service stats
 # ─────────────────────────────────────────────────────────────────────────────
 
+@app.get("/stats/cache")
+async def cache_stats(current_user_id: int = Depends(get_current_user)):
+    """Hit/miss counters for the embedding, retrieval and answer caches, for sizing them."""
+    return {**VECTOR_SERVICE.cache_stats(), "answers": ANSWER_CACHE.stats()}
+
+
+@app.delete("/admin/answer-cache")
+async def purge_answer_cache(vault_name: str | None = Query(None), admin_user_id: int = Depends(require_admin)):
+    """Drop cached answers for one vault, or for every vault if vault_name is omitted."""
+    purged = await EXECUTORS.run_cpu(ANSWER_CACHE.purge, vault_name)
+    return {"status": "success", "vault": vault_name, "purged": purged}
+
+
+@app.get("/stats/llm")
+async def llm_stats(current_user_id: int = Depends(get_current_user)):
+    """LLM queue depth, wait times, rejections, each worker's prompt prefix reuse and coalesced queries."""
+    return {**LLM_SCHEDULER.stats(), "coalescing": ANSWER_FLIGHTS.stats()}
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics: per-route and per-stage latency histograms, LLM
+    queue waits, prompt/generation times, tokens and tokens/sec, and
+    ingestion counters. Unauthenticated so a scraper can read it.
+    """
+    return Response(content=METRICS.render(), media_type=CONTENT_TYPE)
+
+
 @app.get("/")
 def read_root():
     return {"message": "Vault AI Backend is running"}
@@ -0,0 +1,161 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class AnswerCache:
+    """
+    Persistent cache of generated answers, keyed by vault content version.
+
+    A key is sha256(vault, vault version, normalized query, retrieved chunk
+    IDs), so a hit means the same question was answered from exactly the same
+    chunks of exactly the same vault contents. Every write to a vault bumps
+    its version (see VectorDBService.invalidate_vault) and drops that vault's
+    stored answers, and get() only matches the current version, so an answer
+    that was still being generated during the change can't be served either.
+
+    Entries older than `max_age` seconds are never returned, and once the
+    stored answers exceed `max_bytes` the least recently used ones are evicted
+    down to 90% of the limit.
+    """
+
+    def __init__(self, db_path: str = "data/answer_cache.db", max_bytes: int = 64 * 1024 * 1024,
+                 max_age: float = 7 * 24 * 3600):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS vault_versions (
+                vault TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                vault TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_answers_vault ON answers(vault);
+            CREATE INDEX IF NOT EXISTS idx_answers_last_used ON answers(last_used);
+        """)
+        self._conn.commit()
+
+        self._versions: dict[str, int] = dict(self._conn.execute("SELECT vault, version FROM vault_versions"))
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(CAST(response AS BLOB))), 0) FROM answers").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ── Vault versions ──────────────────────────────────────────────────────
+
+    def vault_version(self, vault_name: str) -> int:
+        with self._lock:
+            return self._versions.get(vault_name, 0)
+
+    def bump_vault(self, vault_name: str) -> int:
+        '''Record that a vault's contents changed; its cached answers are dropped.'''
+        with self._lock:
+            version = self._versions.get(vault_name, 0) + 1
+            self._versions[vault_name] = version
+            self._conn.execute(
+                "INSERT INTO vault_versions (vault, version) VALUES (?, ?) "
+                "ON CONFLICT(vault) DO UPDATE SET version = excluded.version",
+                (vault_name, version)
+            )
+            self._delete_where("vault = ?", (vault_name,))
+            self._conn.commit()
+            return version
+
+    # ── Answers ─────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def make_key(vault_name: str, version: int, normalized_query: str, chunk_ids) -> str:
+        parts = [vault_name, str(version), normalized_query, *sorted(chunk_ids)]
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.max_age:
+                self._delete_where("key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, vault_name: str, version: int, response: str):
+        now = time.time()
+        with self._lock:
+            if self._versions.get(vault_name, 0) != version:
+                # The vault changed while this answer was being generated
+                return
+            self._delete_where("key = ?", (key,))
+            self._conn.execute(
+                "INSERT INTO answers (key, vault, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, vault_name, response, now, now)
+            )
+            self._bytes += len(response.encode("utf-8"))
+            self._delete_where("created_at < ?", (now - self.max_age,))
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def purge(self, vault_name: str | None = None) -> int:
+        '''Drop every cached answer, or only one vault's. Returns the number removed.'''
+        with self._lock:
+            if vault_name is None:
+                removed = self._delete_where("1 = 1", ())
+            else:
+                removed = self._delete_where("vault = ?", (vault_name,))
+            self._conn.commit()
+            return removed
+
+    def _delete_where(self, condition: str, params: tuple) -> int:
+        '''Delete matching answers and keep the byte count right. Caller holds the lock and commits.'''
+        freed = self._conn.execute(
+            f"SELECT COALESCE(SUM(LENGTH(CAST(response AS BLOB))), 0) FROM answers WHERE {condition}", params
+        ).fetchone()[0]
+        removed = self._conn.execute(f"DELETE FROM answers WHERE {condition}", params).rowcount
+        self._bytes -= freed
+        return removed
+
+    def _evict(self):
+        '''Drop least recently used answers until at 90% of max_bytes. Caller holds the lock.'''
+        target = int(self.max_bytes * 0.9)
+        while self._bytes > target:
+            removed = self._delete_where(
+                "key IN (SELECT key FROM answers ORDER BY last_used LIMIT 100)", ()
+            )
+            if removed == 0:
+                break
+            self.evictions += removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,87 @@
+import html
+import re
+
+import aiosqlite
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# Title/label hits count double against message hits
+_TITLE_WEIGHT = 2.0
+
+# What snippet() wraps matches in; swapped for the highlight tags after the
+# text is HTML-escaped. Private-use characters, so stored text never has them.
+_MATCH_START, _MATCH_END = "\ue000", "\ue001"
+
+
+def build_phrase_query(text: str) -> str:
+    '''FTS5 MATCH expression for `text` as one phrase of whole words ("" if it has no words).'''
+    tokens = _WORD.findall(text)
+    if not tokens:
+        return ""
+    return '"' + " ".join(tokens) + '"'
+
+
+class ChatSearchService:
+    """
+    Ranked full-text search over a user's chat history.
+
+    Uses the FTS5 indexes `chats_fts` (title, label) and `chat_messages_fts`
+    (message content) that init_db creates and keeps in sync with triggers.
+    Matching is on whole words, like the old `\\b...\\b` regex, and each chat
+    is ranked by its best BM25 hit and returned with a snippet of it. The
+    snippet is HTML: the stored text is escaped and matches are wrapped in
+    the highlight tags.
+    """
+
+    def __init__(self, snippet_tokens: int = 12, highlight: tuple[str, str] = ("<mark>", "</mark>")):
+        self.snippet_tokens = snippet_tokens
+        self.highlight = highlight
+
+    async def search(self, db: aiosqlite.Connection, user_id: int, text: str, limit: int = 50,
+                     offset: int = 0) -> tuple[list[tuple], bool]:
+        '''
+        Return (rows, has_more). Each row is the chat's columns as selected by
+        /chats, followed by its rank and snippet.
+        '''
+        match = build_phrase_query(text)
+        if not match:
+            return [], False
+        # Each branch only keeps the user's own chats, so other users' hits
+        # are never ranked, grouped or snippeted
+        async with db.execute(
+            f"""
+            WITH hits AS (
+                SELECT c.id AS chat_id, bm25(chats_fts) * {_TITLE_WEIGHT} AS rank,
+                       snippet(chats_fts, -1, ?, ?, '…', ?) AS snippet
+                FROM chats_fts JOIN chats c ON c.id = chats_fts.rowid
+                WHERE chats_fts MATCH ? AND c.user_id = ?
+                UNION ALL
+                SELECT m.chat_id, bm25(chat_messages_fts),
+                       snippet(chat_messages_fts, 0, ?, ?, '…', ?)
+                FROM chat_messages_fts
+                JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+                JOIN chats c ON c.id = m.chat_id
+                WHERE chat_messages_fts MATCH ? AND c.user_id = ?
+            ),
+            best AS (
+                -- SQLite takes the bare `snippet` from the row holding MIN(rank)
+                SELECT chat_id, MIN(rank) AS rank, snippet FROM hits GROUP BY chat_id
+            )
+            SELECT c.id, c.title, c.created_at, c.sender_name, c.receiver_name, c.label, c.time_frame,
+                   c.vault_name, c.title_status, best.rank, best.snippet
+            FROM best JOIN chats c ON c.id = best.chat_id
+            ORDER BY best.rank, c.created_at DESC
+            LIMIT ? OFFSET ?
+            """,
+            (_MATCH_START, _MATCH_END, self.snippet_tokens, match, user_id,
+             _MATCH_START, _MATCH_END, self.snippet_tokens, match, user_id, limit + 1, offset)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return [(*row[:-1], self._highlight(row[-1])) for row in rows[:limit]], len(rows) > limit
+
+    def _highlight(self, snippet: str | None) -> str | None:
+        '''HTML-escape a snippet and turn its match markers into the highlight tags.'''
+        if snippet is None:
+            return None
+        start, end = self.highlight
+        return html.escape(snippet).replace(_MATCH_START, start).replace(_MATCH_END, end)
@@ -1,7 +1,136 @@
+import math
+import threading
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import Callable, Iterable, Iterator
+
+# Words that end a sentence, where token-mode chunks prefer to break
+_SENTENCE_ENDS= (".", "?", "!")
+
+# Per-word token counts kept before the cache is cleared
+_TOKEN_CACHE_SIZE= 200_000
+
+
+def estimate_word_tokens(word: str) -> int:
+    '''Rough WordPiece count for one word: common words are one token, longer ones split every ~4 characters.'''
+    return max(1, math.ceil(len(word) / 4))
+
+
+def embedding_token_counter(model_name: str = "all-MiniLM-L6-v2") -> Callable[[str], int] | None:
+    '''Token counter for the embedding model's own tokenizer, or None if it can't be loaded.'''
+    try:
+        from transformers import AutoTokenizer
+        tokenizer= AutoTokenizer.from_pretrained(f"sentence-transformers/{model_name}")
+    except Exception as e:
+        print(f"Could not load the {model_name} tokenizer ({e}); estimating chunk tokens instead")
+        return None
+    return lambda word: len(tokenizer.tokenize(word))
+
+
 class ChunkingService:
-    def __init__(self, chunk_size=1000, chunk_overlap=200):
+    """
+    Splits extracted text into overlapping chunks for embedding.
+
+    mode="chars" (the default) chunks each page on its own with create_chunks,
+    measuring chunk_size/chunk_overlap in characters.
+
+    mode="tokens" measures chunks in embedding-model tokens instead, so no
+    chunk runs past the model's input window (all-MiniLM-L6-v2 truncates at
+    256) and short pages don't become tiny chunks: stream_chunks reads pages
+    one after another, lets chunks and their overlap cross page boundaries,
+    and records the pages each chunk spans. Word token counts come from
+    `count_tokens` (by default the embedding model's tokenizer, loaded on
+    first use, else an estimate) and are cached, so each word of the text is
+    tokenized about once and the whole pass is linear in its length.
+    """
+
+    def __init__(self, chunk_size=1000, chunk_overlap=200, mode: str = "chars", chunk_tokens: int = 200,
+                 overlap_tokens: int = 40, count_tokens: Callable[[str], int] | None = None,
+                 model_name: str = "all-MiniLM-L6-v2"):
         self.chunk_size= chunk_size
         self.chunk_overlap=chunk_overlap
+        if mode not in ("chars", "tokens"):
+            raise ValueError(f"Unknown chunking mode: {mode!r}")
+        if not 0 <= overlap_tokens < chunk_tokens:
+            raise ValueError("overlap_tokens must be at least 0 and less than chunk_tokens")
+        self.mode= mode
+        self.chunk_tokens= chunk_tokens
+        self.overlap_tokens= overlap_tokens
+        self.model_name= model_name
+        self._count_tokens= count_tokens
+        self._token_cache: dict[str, int]= {}
+        self._counter_lock= threading.Lock()
+
+    # ── Token mode ──────────────────────────────────────────────────────────
+
+    def word_tokens(self, word: str) -> int:
+        n= self._token_cache.get(word)
+        if n is None:
+            if self._count_tokens is None:
+                with self._counter_lock:
+                    if self._count_tokens is None:
+                        self._count_tokens= embedding_token_counter(self.model_name) or estimate_word_tokens
+            n= max(1, self._count_tokens(word))
+            if len(self._token_cache) >= _TOKEN_CACHE_SIZE:
+                self._token_cache.clear()
+            self._token_cache[word]= n
+        return n
+
+    def stream_chunks(self, pages: Iterable[tuple[int, str]]) -> Iterator[dict]:
+        '''
+        Yield {"content", "page_start", "page_end", "tokens"} chunks from
+        (page_number, text) pairs in page order, consuming pages as it goes.
+        '''
+        cache= self._token_cache
+        # Words not yet fully chunked, their pages, and running token totals:
+        # prefix[i] is the token count of words[:i] (plus a constant offset)
+        words: list[str]= []
+        word_pages: list[int]= []
+        prefix: list[int]= [0]
+        # words[start:] is the chunk being filled; words[:emitted] have been output
+        start= emitted= 0
+        for page_number, text in pages:
+            if not text:
+                continue
+            page_words= text.split()
+            words.extend(page_words)
+            word_pages.extend([page_number] * len(page_words))
+            counts= list(map(cache.get, page_words))
+            if None in counts:
+                counts= [n or self.word_tokens(w) for w, n in zip(page_words, counts)]
+            # `initial` re-adds the running total popped off the end
+            prefix.extend(accumulate(counts, initial=prefix.pop()))
+
+            while prefix[-1] - prefix[start] > self.chunk_tokens:
+                # Most words that fit, always including at least one new word
+                end= max(bisect_right(prefix, prefix[start] + self.chunk_tokens) - 1, start + 1, emitted + 1)
+                # Prefer to end at a sentence within the last overlap_tokens
+                cut= end
+                for i in range(end - 1, max(start, emitted - 1), -1):
+                    if words[i].endswith(_SENTENCE_ENDS):
+                        cut= i + 1
+                        break
+                    if prefix[end] - prefix[i] > self.overlap_tokens:
+                        break
+                yield self._make_chunk(words, word_pages, start, cut, prefix[cut] - prefix[start])
+                # The next chunk starts with the last overlap_tokens of this one
+                start= bisect_left(prefix, prefix[cut] - self.overlap_tokens, start + 1, cut)
+                emitted= cut
+
+            # Forget words that no later chunk can include
+            del words[:start], word_pages[:start], prefix[:start]
+            emitted-= start
+            start= 0
+        if len(words) > emitted:
+            yield self._make_chunk(words, word_pages, start, len(words), prefix[-1] - prefix[start])
+
+    @staticmethod
+    def _make_chunk(words: list[str], word_pages: list[int], start: int, end: int, tokens: int) -> dict:
+        return {"content": " ".join(words[start:end]), "page_start": word_pages[start],
+                "page_end": word_pages[end - 1], "tokens": tokens}
+
+    # ── Character mode ──────────────────────────────────────────────────────
+
     def create_chunks(self, text:str)-> list[str]:
         chunks=[]
         text= " ".join(text.split())
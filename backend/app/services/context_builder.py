@@ -0,0 +1,216 @@
+import math
+import re
+from typing import Callable
+
+# Llama 3's tokenizer averages a little over 4 characters per token on English
+# prose; 3.5 keeps the estimate on the safe side for numbers and code.
+DEFAULT_CHARS_PER_TOKEN = 3.5
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# (min_relative_score, score_gap) for the scores of each search mode (the
+# result's "search_mode"), which have different scales and spreads:
+#   vector:  1 - L2 distance, mostly between 0 and 1
+#   lexical: BM25, unbounded, and only a fraction of the best for chunks
+#            matching fewer or more common terms
+#   hybrid:  scaled RRF, 0.87-1.0 for chunks both searches found and at most
+#            0.5 for chunks only one found, so the gap cut lands between them
+SCORE_THRESHOLDS = {
+    "vector": (0.4, 0.5),
+    "lexical": (0.3, 0.5),
+    "hybrid": (0.45, 0.3),
+}
+
+
+def estimate_tokens(text: str, chars_per_token: float = DEFAULT_CHARS_PER_TOKEN) -> int:
+    return math.ceil(len(text) / chars_per_token) if text else 0
+
+
+def format_chunk(result: dict) -> str:
+    '''One context entry, with the citation tag the system prompt asks the model to copy.'''
+    metadata = result['metadata']
+    page = metadata['page']
+    # Token-mode chunks can run onto later pages
+    if metadata.get('page_end', page) != page:
+        page = f"{page}-{metadata['page_end']}"
+    return f"[Source: {metadata['source']}, Page: {page}]\n{result['content']}"
+
+
+def _page_span(metadata: dict) -> tuple:
+    page = metadata.get("page")
+    return page, metadata.get("page_end", page)
+
+
+def _pages_meet(first: dict, second: dict) -> bool:
+    '''Whether two chunks' pages are the same, or (for chunks spanning pages) overlap.'''
+    (start, end), (other_start, other_end) = _page_span(first), _page_span(second)
+    if start == other_start:
+        return True
+    try:
+        return start <= other_end and other_start <= end
+    except TypeError:
+        return False
+
+
+def _join_pages(target: dict, other: dict):
+    if "page_end" in target or "page_end" in other:
+        (start, end), (other_start, other_end) = _page_span(target), _page_span(other)
+        target["page"], target["page_end"] = min(start, other_start), max(end, other_end)
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _overlap_length(first: str, second: str, min_overlap: int) -> int:
+    '''Length of the longest suffix of `first` that is also a prefix of `second`.'''
+    longest = min(len(first), len(second))
+    for size in range(longest, min_overlap - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+
+class ContextBuilder:
+    """
+    Packs search results into the LLM's context block under a token budget.
+
+    Prompt evaluation time grows with prompt length, so results are trimmed
+    before they reach the model:
+      1. chunks scoring far below the best one are dropped,
+      2. the ranking is cut at the first large score gap (adaptive top-k),
+         with both thresholds set per search mode (see SCORE_THRESHOLDS),
+      3. near-duplicate chunks (same text from re-uploads or other files) are dropped,
+      4. chunks from the same page whose text overlaps (the chunker's
+         overlap window) are merged into one entry,
+      5. chunks are added best-first until `token_budget` is reached.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int] = estimate_tokens, token_budget: int = 1024,
+                 score_thresholds: dict[str, tuple[float, float]] | None = None, min_chunks: int = 2,
+                 duplicate_threshold: float = 0.85, min_merge_overlap: int = 40):
+        self.count_tokens = count_tokens
+        self.token_budget = token_budget
+        # Search mode -> (min_relative_score, score_gap). Chunks must score at
+        # least min_relative_score times the best score, and the ranking stops
+        # at a drop between neighbours larger than score_gap times the best
+        self.score_thresholds = {**SCORE_THRESHOLDS, **(score_thresholds or {})}
+        # ...but never cut below this many chunks
+        self.min_chunks = min_chunks
+        # Word-trigram Jaccard similarity above which two chunks count as duplicates
+        self.duplicate_threshold = duplicate_threshold
+        # Shortest shared text (in characters) that makes two chunks neighbours
+        self.min_merge_overlap = min_merge_overlap
+
+    def build(self, results: list[dict]) -> tuple[str, list[dict], dict]:
+        '''
+        Return (context_block, used_results, stats).
+
+        used_results are the (possibly merged) chunks that made it into the
+        context, in the order they appear there.
+        '''
+        tokens_before = self.count_tokens("\n\n".join(format_chunk(r) for r in results))
+
+        ranked = sorted(results, key=lambda r: r.get("score", 0), reverse=True)
+        # Results without a mode come from vector search, the original one
+        mode = ranked[0].get("search_mode", "vector") if ranked else "vector"
+        min_relative_score, score_gap = self.score_thresholds.get(mode, SCORE_THRESHOLDS["vector"])
+        ranked = self._drop_low_scores(ranked, min_relative_score)
+        ranked = self._cut_at_score_gap(ranked, score_gap)
+        ranked = self._drop_duplicates(ranked)
+        ranked = self._merge_neighbours(ranked)
+        used, blocks, tokens_after = self._pack(ranked)
+
+        context_block = "\n\n".join(blocks)
+        stats = {
+            "chunks_in": len(results),
+            "chunks_used": len(used),
+            "tokens_before": tokens_before,
+            "tokens_after": tokens_after,
+            "tokens_saved": max(0, tokens_before - tokens_after),
+            "token_budget": self.token_budget,
+        }
+        return context_block, used, stats
+
+    def _drop_low_scores(self, ranked: list[dict], min_relative_score: float) -> list[dict]:
+        if not ranked:
+            return ranked
+        best = ranked[0].get("score", 0)
+        if best <= 0:
+            return ranked
+        return [r for r in ranked if r.get("score", 0) >= best * min_relative_score]
+
+    def _cut_at_score_gap(self, ranked: list[dict], score_gap: float) -> list[dict]:
+        if not ranked:
+            return ranked
+        best = abs(ranked[0].get("score", 0))
+        for i in range(max(1, self.min_chunks), len(ranked)):
+            if ranked[i - 1].get("score", 0) - ranked[i].get("score", 0) > best * score_gap:
+                return ranked[:i]
+        return ranked
+
+    def _drop_duplicates(self, ranked: list[dict]) -> list[dict]:
+        kept, kept_shingles = [], []
+        for result in ranked:
+            shingles = _shingles(result["content"])
+            duplicate = any(
+                len(shingles & other) / len(shingles | other) >= self.duplicate_threshold
+                for other in kept_shingles
+            )
+            if not duplicate:
+                kept.append(result)
+                kept_shingles.append(shingles)
+        return kept
+
+    def _merge_neighbours(self, ranked: list[dict]) -> list[dict]:
+        merged: list[dict] = []
+        for result in ranked:
+            for target in merged:
+                if (target["metadata"].get("source") != result["metadata"].get("source")
+                        or not _pages_meet(target["metadata"], result["metadata"])):
+                    continue
+                overlap = _overlap_length(target["content"], result["content"], self.min_merge_overlap)
+                if overlap:
+                    target["content"] = target["content"] + result["content"][overlap:]
+                    _join_pages(target["metadata"], result["metadata"])
+                    break
+                overlap = _overlap_length(result["content"], target["content"], self.min_merge_overlap)
+                if overlap:
+                    target["content"] = result["content"] + target["content"][overlap:]
+                    _join_pages(target["metadata"], result["metadata"])
+                    break
+            else:
+                # Copy so merging never edits the (possibly cached) search results
+                merged.append({**result, "metadata": dict(result["metadata"])})
+        return merged
+
+    def _pack(self, ranked: list[dict]) -> tuple[list[dict], list[str], int]:
+        used, blocks, total = [], [], 0
+        separator = self.count_tokens("\n\n")
+        for result in ranked:
+            block = format_chunk(result)
+            cost = self.count_tokens(block) + (separator if blocks else 0)
+            if total + cost <= self.token_budget:
+                used.append(result)
+                blocks.append(block)
+                total += cost
+            elif not blocks:
+                # The best chunk alone is over budget: keep its beginning
+                block = self._truncate(block, self.token_budget)
+                used.append({**result, "content": block.split("\n", 1)[-1]})
+                blocks.append(block)
+                total = self.count_tokens(block)
+            # Smaller chunks further down may still fit, so keep going
+        return used, blocks, total
+
+    def _truncate(self, text: str, budget: int) -> str:
+        tokens = self.count_tokens(text)
+        if tokens <= budget:
+            return text
+        cut = int(len(text) * budget / tokens)
+        while cut > 0 and self.count_tokens(text[:cut]) > budget:
+            cut = int(cut * 0.9)
+        return text[:cut].rsplit(" ", 1)[0]
@@ -0,0 +1,134 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+# SQLite's default limit on bound parameters is well above this, but keeping
+# IN (...) lists short keeps each lookup cheap.
+_LOOKUP_BATCH = 500
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed store of chunk embeddings.
+
+    Entries are keyed by sha256(model name + chunk text), so the same chunk is
+    embedded once no matter how many vaults it lands in or how often its file
+    is re-uploaded. Vectors are stored as float32 blobs in a local SQLite file.
+    When the stored vectors exceed `max_bytes`, the least recently used ones
+    are evicted down to 90% of the limit.
+    """
+
+    def __init__(self, db_path: str = "data/embedding_cache.db", max_bytes: int = 512 * 1024 * 1024):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+        self._entries, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model_name: str, texts: list[str]) -> dict[int, np.ndarray]:
+        '''Return {index in texts: vector} for every text that is already cached.'''
+        keys = [self.make_key(model_name, t) for t in texts]
+        found: dict[str, np.ndarray] = {}
+        with self._lock:
+            for start in range(0, len(keys), _LOOKUP_BATCH):
+                batch = list(set(keys[start:start + _LOOKUP_BATCH]))
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found]
+                )
+                self._conn.commit()
+
+        result = {i: found[k] for i, k in enumerate(keys) if k in found}
+        self.hits += len(result)
+        self.misses += len(texts) - len(result)
+        return result
+
+    def put_many(self, model_name: str, texts: list[str], vectors) -> None:
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((self.make_key(model_name, text), model_name, blob, now))
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+            inserted = self._conn.total_changes - before
+            if inserted:
+                self._entries += inserted
+                # Vectors from one model all have the same size
+                self._bytes += inserted * len(rows[0][2])
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        '''Drop least recently used entries until the cache is at 90% of max_bytes. Caller holds the lock.'''
+        target = int(self.max_bytes * 0.9)
+        while self._bytes > target and self._entries > 0:
+            avg = max(1, self._bytes // self._entries)
+            to_remove = max(1, (self._bytes - target) // avg)
+            removed, freed = self._conn.execute(
+                """
+                SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM (
+                    SELECT vector FROM embeddings ORDER BY last_used LIMIT ?
+                )
+                """,
+                (to_remove,)
+            ).fetchone()
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (to_remove,)
+            )
+            self._conn.commit()
+            if removed == 0:
+                break
+            self._entries -= removed
+            self._bytes -= freed
+            self.evictions += removed
+
+    def stats(self) -> dict:
+        return {
+            "entries": self._entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,46 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+
+class ExecutorService:
+    """
+    Bounded worker pools for the blocking parts of the backend.
+
+    The FastAPI endpoints are async, but sentence-transformers, Chroma and
+    pdfplumber are all blocking. Calling them directly from an endpoint
+    stalls the event loop for every other user, so they are sent to one of
+    these pools and awaited instead (GPT4All runs in the LLMScheduler's own
+    worker processes):
+
+      - cpu:     embedding, vector search and other calls that release the GIL
+      - process: pure-Python CPU work such as PDF parsing
+    """
+
+    def __init__(self, cpu_threads: int = 4, pdf_processes: int = 2):
+        self.cpu_threads = max(1, cpu_threads)
+        self.pdf_processes = max(1, pdf_processes)
+
+        self.cpu_pool = ThreadPoolExecutor(max_workers=self.cpu_threads, thread_name_prefix="vault-cpu")
+        # Worker processes are only started the first time they are needed,
+        # so hot-reloads and lightweight scripts don't pay for them.
+        self._process_pool: ProcessPoolExecutor | None = None
+        self._process_lock = threading.Lock()
+
+    @property
+    def process_pool(self) -> ProcessPoolExecutor:
+        with self._process_lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(max_workers=self.pdf_processes)
+            return self._process_pool
+
+    async def run_cpu(self, fn: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.cpu_pool, partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self.cpu_pool.shutdown(wait=False, cancel_futures=True)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
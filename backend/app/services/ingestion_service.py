@@ -0,0 +1,606 @@
+import asyncio
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+
+import aiosqlite
+
+from app.services.metrics_service import COUNT_BUCKETS
+from app.utils.memory import rss_mb
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+JOB_COLUMNS = (
+    "id, user_id, vault_name, filename, file_path, status, pages_total, pages_parsed, "
+    "chunks_total, chunks_embedded, error, created_at, started_at, finished_at, pages_per_sec, "
+    "chunks_added, chunks_removed, chunks_kept, batch_id, pdf_backend, extract_timings, peak_rss_mb, peak_pending_chunks"
+)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _settle(future: asyncio.Future, error: Exception | None = None):
+    # The job may have stopped waiting (and cancelled the future) already
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+def _job_to_dict(row) -> dict:
+    return {
+        "id": row[0],
+        "vault": row[2],
+        "filename": row[3],
+        "status": row[5],
+        "pages_total": row[6],
+        "pages_parsed": row[7],
+        "chunks_total": row[8],
+        "chunks_embedded": row[9],
+        "error": row[10],
+        "created_at": row[11],
+        "started_at": row[12],
+        "finished_at": row[13],
+        "pages_per_sec": row[14],
+        "chunks_added": row[15],
+        "chunks_removed": row[16],
+        "chunks_kept": row[17],
+        "batch_id": row[18],
+        "pdf_backend": row[19],
+        # {backend: {"pages", "seconds"}, "fallback_pages": n}
+        "extract_timings": json.loads(row[20]) if row[20] else None,
+        "peak_rss_mb": row[21],
+        "peak_pending_chunks": row[22],
+    }
+
+
+class IngestionService:
+    """
+    Persistent background queue for PDF ingestion.
+
+    /upload only stores the file and inserts a row into `ingestion_jobs`;
+    a small pool of asyncio workers claims queued rows and runs parse → chunk
+    → embed → index on the executor pools. Progress is kept in memory while a
+    job runs, flushed to SQLite every `progress_interval` seconds, and merged
+    into GET /jobs/{id} responses so clients see live page/chunk counts.
+
+    Embedding and index writes are shared pipeline stages fed through bounded
+    queues of `embed_batch_size`-chunk batches. A worker parses and chunks
+    its PDF lazily, one batch at a time: while one batch is written to Chroma
+    the next is embedded and the worker is already parsing the following
+    pages, and a full queue makes it wait instead of piling chunks up in
+    memory. Memory use therefore doesn't grow with document length; each job
+    records the process's peak RSS and the most of its chunks waiting in the
+    pipeline at once. Jobs uploaded together share a batch_id (see get_batch).
+    With a `metrics` registry, job outcomes and durations, pages, chunks,
+    extraction time per PDF backend and per-batch stage times are recorded.
+    """
+
+    def __init__(self, db_path: str, pdf_processor, vector_service, executors,
+                 num_workers: int = 2, vault_root: Path = Path("data/vaults"),
+                 poll_interval: float = 2.0, progress_interval: float = 1.0,
+                 embed_batch_size: int = 64, queue_size: int = 4, metrics=None):
+        self.db_path = db_path
+        self.pdf_processor = pdf_processor
+        self.vector_service = vector_service
+        self.executors = executors
+        self.num_workers = max(1, num_workers)
+        self.vault_root = Path(vault_root)
+        self.poll_interval = poll_interval
+        self.progress_interval = progress_interval
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.queue_size = max(1, queue_size)
+
+        self._workers: list[asyncio.Task] = []
+        self._stages: list[asyncio.Task] = []
+        self._embed_queue: asyncio.Queue | None = None
+        self._write_queue: asyncio.Queue | None = None
+        self._wakeup = asyncio.Event()
+        # job_id -> live counters / cancel flag, only for jobs running in this process
+        self._progress: dict[int, dict] = {}
+        # Job ID -> its unfinished vault sync, for _cleanup_partial
+        self._syncs: dict[int, dict] = {}
+        self._cancel_events: dict[int, threading.Event] = {}
+
+        self._metrics = None
+        if metrics is not None:
+            self._register_metrics(metrics)
+
+    def _register_metrics(self, metrics):
+        self._metrics = {
+            "jobs": metrics.counter("vault_ingestion_jobs_total", "Ingestion jobs by final status", ("status",)),
+            "job_seconds": metrics.histogram("vault_ingestion_job_seconds", "Time from starting an ingestion job to finishing it",
+                                             ("status",)),
+            "pages": metrics.counter("vault_ingestion_pages_total", "PDF pages parsed by ingestion jobs"),
+            "chunks": metrics.counter("vault_ingestion_chunks_total", "Chunks synced into vaults, by what happened to them",
+                                      ("result",)),
+            "chunks_per_file": metrics.histogram("vault_ingestion_chunks_per_file", "Chunks per ingested file",
+                                                 buckets=COUNT_BUCKETS),
+            "batch_seconds": metrics.histogram("vault_ingestion_batch_seconds", "Time to embed or write one batch of chunks",
+                                               ("stage",)),
+            "extract_seconds": metrics.counter("vault_pdf_extract_seconds_total", "Time spent extracting page text, per PDF backend",
+                                               ("backend",)),
+            "extract_pages": metrics.counter("vault_pdf_extract_pages_total", "Pages read, per PDF backend", ("backend",)),
+        }
+        metrics.gauge("vault_ingestion_running_jobs", "Ingestion jobs running in this process", lambda: len(self._progress))
+        metrics.gauge("vault_ingestion_queued_batches", "Chunk batches waiting for the embed or write stage",
+                      lambda: {"embed": self._embed_queue.qsize() if self._embed_queue else 0,
+                               "write": self._write_queue.qsize() if self._write_queue else 0}, ("stage",))
+
+    def _record_job(self, status: str, progress: dict, seconds: float):
+        if self._metrics is None:
+            return
+        m = self._metrics
+        m["jobs"].inc(status=status)
+        m["job_seconds"].observe(seconds, status=status)
+        m["pages"].inc(progress["pages_parsed"] or 0)
+        if status == JOB_COMPLETED:
+            m["chunks_per_file"].observe(progress["chunks_total"] or 0)
+            for result in ("added", "removed", "kept"):
+                m["chunks"].inc(progress[f"chunks_{result}"] or 0, result=result)
+        for backend, entry in (progress["extract_timings"] or {}).items():
+            if backend != "fallback_pages":
+                m["extract_seconds"].inc(entry["seconds"], backend=backend)
+                m["extract_pages"].inc(entry["pages"], backend=backend)
+
+    def _observe_batch(self, stage: str, began: float):
+        if self._metrics is not None:
+            self._metrics["batch_seconds"].observe(time.perf_counter() - began, stage=stage)
+
+    # ── Lifecycle ───────────────────────────────────────────────────────────
+
+    async def start(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            # Jobs that were running when the server stopped start over
+            await db.execute(
+                "UPDATE ingestion_jobs SET status = ?, started_at = NULL, pages_parsed = 0, chunks_embedded = 0 WHERE status = ?",
+                (JOB_QUEUED, JOB_RUNNING)
+            )
+            await db.commit()
+        self._embed_queue = asyncio.Queue(maxsize=self.queue_size)
+        self._write_queue = asyncio.Queue(maxsize=self.queue_size)
+        self._stages = [asyncio.create_task(self._embed_loop()), asyncio.create_task(self._write_loop())]
+        self._workers = [asyncio.create_task(self._worker_loop()) for _ in range(self.num_workers)]
+        print(f"Ingestion queue started with {self.num_workers} worker(s)")
+
+    async def stop(self):
+        for event in self._cancel_events.values():
+            event.set()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for task in self._stages:
+            task.cancel()
+        await asyncio.gather(*self._stages, return_exceptions=True)
+        self._stages = []
+
+    # ── Public API ──────────────────────────────────────────────────────────
+
+    async def enqueue(self, db: aiosqlite.Connection, user_id: int, vault_name: str, filename: str, file_path: str,
+                      replace_existing: bool = False, pdf_backend: str | None = None) -> int:
+        cursor = await db.execute(
+            "INSERT INTO ingestion_jobs (user_id, vault_name, filename, file_path, status, created_at, replace_existing, pdf_backend) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, vault_name, filename, file_path, JOB_QUEUED, _now(), int(replace_existing), pdf_backend)
+        )
+        await db.commit()
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    async def enqueue_batch(self, db: aiosqlite.Connection, user_id: int, vault_name: str, batch_id: str,
+                            files: list[tuple[str, str, bool]], pdf_backend: str | None = None) -> list[int]:
+        '''Queue (filename, file_path, replace_existing) files in one transaction; returns their job IDs.'''
+        job_ids = []
+        created_at = _now()
+        for filename, file_path, replace_existing in files:
+            cursor = await db.execute(
+                "INSERT INTO ingestion_jobs (user_id, vault_name, filename, file_path, status, created_at, replace_existing, batch_id, pdf_backend) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, vault_name, filename, file_path, JOB_QUEUED, created_at, int(replace_existing), batch_id, pdf_backend)
+            )
+            job_ids.append(cursor.lastrowid)
+        await db.commit()
+        self._wakeup.set()
+        return job_ids
+
+    async def has_active_job(self, db: aiosqlite.Connection, user_id: int, vault_name: str, filename: str) -> bool:
+        async with db.execute(
+            "SELECT 1 FROM ingestion_jobs WHERE user_id = ? AND vault_name = ? AND filename = ? AND status IN (?, ?)",
+            (user_id, vault_name, filename, *ACTIVE_STATUSES)
+        ) as cursor:
+            return await cursor.fetchone() is not None
+
+    async def get_job(self, db: aiosqlite.Connection, job_id: int, user_id: int) -> dict | None:
+        async with db.execute(
+            f"SELECT {JOB_COLUMNS} FROM ingestion_jobs WHERE id = ? AND user_id = ?", (job_id, user_id)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            return None
+        job = _job_to_dict(row)
+        if job["status"] == JOB_RUNNING and job_id in self._progress:
+            job.update(self._progress[job_id])
+        return job
+
+    async def list_jobs(self, db: aiosqlite.Connection, user_id: int, vault_name: str | None = None, limit: int = 50) -> list[dict]:
+        query = f"SELECT {JOB_COLUMNS} FROM ingestion_jobs WHERE user_id = ?"
+        params: list = [user_id]
+        if vault_name:
+            query += " AND vault_name = ?"
+            params.append(vault_name)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        async with db.execute(query, tuple(params)) as cursor:
+            rows = await cursor.fetchall()
+        jobs = [_job_to_dict(r) for r in rows]
+        for job in jobs:
+            if job["status"] == JOB_RUNNING and job["id"] in self._progress:
+                job.update(self._progress[job["id"]])
+        return jobs
+
+    async def get_batch(self, db: aiosqlite.Connection, batch_id: str, user_id: int) -> dict | None:
+        '''Per-file status of a bulk upload, plus totals and throughput since its first file started.'''
+        async with db.execute(
+            f"SELECT {JOB_COLUMNS} FROM ingestion_jobs WHERE batch_id = ? AND user_id = ? ORDER BY id", (batch_id, user_id)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        if not rows:
+            return None
+        jobs = [_job_to_dict(r) for r in rows]
+        for job in jobs:
+            if job["status"] == JOB_RUNNING and job["id"] in self._progress:
+                job.update(self._progress[job["id"]])
+
+        counts = {status: 0 for status in (JOB_QUEUED, JOB_RUNNING, JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)}
+        for job in jobs:
+            counts[job["status"]] += 1
+        pages = sum(job["pages_parsed"] or 0 for job in jobs)
+        chunks = sum(job["chunks_embedded"] or 0 for job in jobs)
+
+        started = [job["started_at"] for job in jobs if job["started_at"]]
+        elapsed = None
+        if started:
+            active = counts[JOB_QUEUED] or counts[JOB_RUNNING]
+            end = _now() if active else max(job["finished_at"] or job["started_at"] for job in jobs if job["started_at"])
+            elapsed = (datetime.fromisoformat(end) - datetime.fromisoformat(min(started))).total_seconds()
+
+        def rate(amount: float) -> float | None:
+            return round(amount / elapsed, 2) if elapsed else None
+
+        return {
+            "batch_id": batch_id,
+            "files_total": len(jobs),
+            **{f"files_{status}": count for status, count in counts.items()},
+            "pages_parsed": pages,
+            "chunks_embedded": chunks,
+            "elapsed_seconds": round(elapsed, 2) if elapsed is not None else None,
+            "pages_per_sec": rate(pages),
+            "chunks_per_sec": rate(chunks),
+            "files_per_min": rate(counts[JOB_COMPLETED] * 60),
+            "peak_rss_mb": max((job["peak_rss_mb"] for job in jobs if job["peak_rss_mb"] is not None), default=None),
+            "jobs": jobs,
+        }
+
+    async def cancel_job(self, db: aiosqlite.Connection, job_id: int, user_id: int) -> dict | None:
+        job = await self.get_job(db, job_id, user_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return job
+
+        # A queued job is cancelled on the spot; a running one is flagged and
+        # stops at the next page/batch boundary.
+        await db.execute(
+            "UPDATE ingestion_jobs SET cancel_requested = 1, status = CASE WHEN status = ? THEN ? ELSE status END, "
+            "finished_at = CASE WHEN status = ? THEN ? ELSE finished_at END WHERE id = ?",
+            (JOB_QUEUED, JOB_CANCELLED, JOB_QUEUED, _now(), job_id)
+        )
+        await db.commit()
+        if job_id in self._cancel_events:
+            self._cancel_events[job_id].set()
+        return await self.get_job(db, job_id, user_id)
+
+    # ── Worker ──────────────────────────────────────────────────────────────
+
+    async def _worker_loop(self):
+        while True:
+            try:
+                job = await self._claim_next()
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ingestion worker error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _claim_next(self) -> dict | None:
+        async with aiosqlite.connect(self.db_path) as db:
+            # Single statement, so two workers can never claim the same job
+            async with db.execute(
+                f"""
+                UPDATE ingestion_jobs SET status = ?, started_at = ?
+                WHERE id = (SELECT id FROM ingestion_jobs WHERE status = ? ORDER BY id LIMIT 1)
+                RETURNING {JOB_COLUMNS}, replace_existing
+                """,
+                (JOB_RUNNING, _now(), JOB_QUEUED)
+            ) as cursor:
+                row = await cursor.fetchone()
+            await db.commit()
+        if not row:
+            return None
+        job = _job_to_dict(row)
+        job["user_id"] = row[1]
+        job["file_path"] = row[4]
+        job["replace_existing"] = bool(row[-1])
+        return job
+
+    async def _run_job(self, job: dict):
+        job_id = job["id"]
+        progress = {"pages_total": None, "pages_parsed": 0, "chunks_total": None, "chunks_embedded": 0, "pages_per_sec": None,
+                    "chunks_added": None, "chunks_removed": None, "chunks_kept": None, "extract_timings": None,
+                    "peak_rss_mb": None, "peak_pending_chunks": None}
+        cancel = threading.Event()
+        self._progress[job_id] = progress
+        self._cancel_events[job_id] = cancel
+        began = time.perf_counter()
+
+        task = asyncio.ensure_future(self._ingest(job, progress, cancel))
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=self.progress_interval)
+                await self._save_progress(job_id, progress)
+                if not cancel.is_set() and await self._cancel_requested(job_id):
+                    cancel.set()
+
+            await task
+            await self._finish(job_id, JOB_COMPLETED, progress)
+            self._record_job(JOB_COMPLETED, progress, time.perf_counter() - began)
+            print(f"Ingestion job {job_id} completed: {job['filename']} -> {job['vault']}")
+        except JobCancelled:
+            await self._cleanup_partial(job)
+            await self._finish(job_id, JOB_CANCELLED, progress)
+            self._record_job(JOB_CANCELLED, progress, time.perf_counter() - began)
+            print(f"Ingestion job {job_id} cancelled")
+        except asyncio.CancelledError:
+            # Server shutdown: the job stays 'running' and start() queues it
+            # again, so its upload has to stay where it is
+            cancel.set()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            raise
+        except Exception as e:
+            await self._cleanup_partial(job)
+            await self._finish(job_id, JOB_FAILED, progress, error=str(e))
+            self._record_job(JOB_FAILED, progress, time.perf_counter() - began)
+            print(f"Ingestion job {job_id} failed: {e}")
+        finally:
+            self._progress.pop(job_id, None)
+            self._cancel_events.pop(job_id, None)
+            self._syncs.pop(job_id, None)
+        # Reached a terminal state (a completed job's file was already moved into the vault)
+        self._remove_upload(job["file_path"])
+
+    async def _ingest(self, job: dict, progress: dict, cancel: threading.Event):
+        def check_cancelled():
+            if cancel.is_set():
+                raise JobCancelled()
+
+        def on_page(pages_parsed: int, pages_total: int):
+            progress["pages_parsed"] = pages_parsed
+            progress["pages_total"] = pages_total
+            check_cancelled()
+
+        # Pages are parsed and chunked lazily, a batch at a time, as the
+        # pipeline takes chunks; page text itself is extracted in parallel on
+        # the process pool
+        extract_stats = {}
+        chunks = self.pdf_processor.iter_chunks(
+            job["file_path"], job["vault"], progress_callback=on_page, executor=self.executors.process_pool,
+            workers=self.executors.pdf_processes, stats=extract_stats, backend=job["pdf_backend"], source=job["filename"]
+        )
+        # Re-uploads only embed new chunks and drop the ones that disappeared
+        sync = await self.executors.run_cpu(self.vector_service.begin_sync, job["vault"], job["filename"])
+        self._syncs[job["id"]] = sync
+        progress["chunks_total"] = 0
+        try:
+            await self._embed_and_write(job, sync, chunks, progress, cancel)
+        finally:
+            try:
+                chunks.close()
+            except ValueError:
+                # Still running on a thread after a cancellation; it stops at the next page
+                pass
+        progress["pages_per_sec"] = extract_stats.get("pages_per_sec")
+        progress["extract_timings"] = extract_stats.get("timings")
+        check_cancelled()
+        if not progress["chunks_total"]:
+            raise ValueError("PDF contained no extractable text.")
+        sync_stats = await self.executors.run_cpu(self.vector_service.finish_sync, job["vault"], sync)
+        self._syncs.pop(job["id"], None)
+        progress["chunks_added"] = sync_stats["added"]
+        progress["chunks_removed"] = sync_stats["removed"]
+        progress["chunks_kept"] = sync_stats["kept"]
+        check_cancelled()
+
+        vault_dir = self.vault_root / job["vault"]
+        vault_dir.mkdir(parents=True, exist_ok=True)
+        shutil.move(job["file_path"], str(vault_dir / job["filename"]))
+
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "INSERT INTO vault_files (user_id, vault_name, filename, uploaded_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id, vault_name, filename) DO UPDATE SET uploaded_at = excluded.uploaded_at",
+                (job["user_id"], job["vault"], job["filename"], _now())
+            )
+            await db.commit()
+
+    # ── Pipeline stages ─────────────────────────────────────────────────────
+
+    def _next_batch(self, chunks, sync: dict) -> tuple[int, list[str], list[str], list[dict]]:
+        '''Parse up to embed_batch_size more chunks; returns (chunks read, ids, documents, metadatas) to write.'''
+        batch = list(islice(chunks, self.embed_batch_size))
+        return (len(batch), *self.vector_service.plan_batch(sync, batch))
+
+    async def _embed_and_write(self, job: dict, sync: dict, chunks, progress: dict, cancel: threading.Event):
+        '''Feed a file's new chunks through the embed and write stages and wait until all are stored.'''
+        loop = asyncio.get_running_loop()
+        pending: list[tuple[asyncio.Future, int]] = []
+        try:
+            while True:
+                if cancel.is_set():
+                    raise JobCancelled()
+                read, ids, documents, metadatas = await self.executors.run_cpu(self._next_batch, chunks, sync)
+                if not read:
+                    break
+                progress["chunks_total"] += read
+                # Chunks the vault already holds count as done
+                progress["chunks_embedded"] += read - len(ids)
+
+                # Surface a failed batch now rather than after parsing the rest
+                for done, _ in pending:
+                    if done.done():
+                        done.result()
+                pending = [(done, size) for done, size in pending if not done.done()]
+                if ids:
+                    batch = {
+                        "vault": job["vault"],
+                        "ids": ids,
+                        "documents": documents,
+                        "metadatas": metadatas,
+                        "progress": progress,
+                        "cancel": cancel,
+                        "done": loop.create_future(),
+                    }
+                    pending.append((batch["done"], len(ids)))
+                    # Waits while the stages are busy (backpressure)
+                    await self._embed_queue.put(batch)
+                self._record_memory(progress, sum(size for done, size in pending if not done.done()))
+            await asyncio.gather(*(done for done, _ in pending))
+        except asyncio.CancelledError:
+            cancel.set()
+            raise
+        except Exception:
+            # Let batches already in the pipeline settle before the caller cleans up
+            cancel.set()
+            await asyncio.gather(*(done for done, _ in pending), return_exceptions=True)
+            raise
+
+    @staticmethod
+    def _record_memory(progress: dict, pending_chunks: int):
+        rss = rss_mb()
+        if rss is not None and rss > (progress["peak_rss_mb"] or 0):
+            progress["peak_rss_mb"] = rss
+        progress["peak_pending_chunks"] = max(progress["peak_pending_chunks"] or 0, pending_chunks)
+
+    async def _embed_loop(self):
+        while True:
+            batch = await self._embed_queue.get()
+            try:
+                if batch["cancel"].is_set():
+                    raise JobCancelled()
+                began = time.perf_counter()
+                batch["embeddings"] = await self.executors.run_cpu(self.vector_service.embed_documents, batch["documents"])
+                self._observe_batch("embed", began)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _settle(batch["done"], e)
+                continue
+            await self._write_queue.put(batch)
+
+    async def _write_loop(self):
+        while True:
+            batch = await self._write_queue.get()
+            try:
+                if batch["cancel"].is_set():
+                    raise JobCancelled()
+                began = time.perf_counter()
+                await self.executors.run_cpu(
+                    self.vector_service.write_chunks, batch["vault"], batch["ids"], batch["documents"],
+                    batch["metadatas"], batch["embeddings"]
+                )
+                self._observe_batch("write", began)
+                batch["progress"]["chunks_embedded"] += len(batch["ids"])
+                _settle(batch["done"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _settle(batch["done"], e)
+
+    # ── Helpers ─────────────────────────────────────────────────────────────
+
+    async def _save_progress(self, job_id: int, progress: dict):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "UPDATE ingestion_jobs SET pages_total = ?, pages_parsed = ?, chunks_total = ?, chunks_embedded = ?, pages_per_sec = ?, "
+                "chunks_added = ?, chunks_removed = ?, chunks_kept = ?, extract_timings = ?, peak_rss_mb = ?, peak_pending_chunks = ? "
+                "WHERE id = ?",
+                (progress["pages_total"], progress["pages_parsed"], progress["chunks_total"], progress["chunks_embedded"],
+                 progress["pages_per_sec"], progress["chunks_added"], progress["chunks_removed"], progress["chunks_kept"],
+                 json.dumps(progress["extract_timings"]) if progress["extract_timings"] else None,
+                 progress["peak_rss_mb"], progress["peak_pending_chunks"], job_id)
+            )
+            await db.commit()
+
+    async def _cancel_requested(self, job_id: int) -> bool:
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute("SELECT cancel_requested FROM ingestion_jobs WHERE id = ?", (job_id,)) as cursor:
+                row = await cursor.fetchone()
+        return bool(row and row[0])
+
+    async def _finish(self, job_id: int, status: str, progress: dict, error: str | None = None):
+        await self._save_progress(job_id, progress)
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "UPDATE ingestion_jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, error, _now(), job_id)
+            )
+            await db.commit()
+
+    async def _cleanup_partial(self, job: dict):
+        '''Drop any chunks a failed or cancelled job already wrote to the vault.'''
+        sync = self._syncs.pop(job["id"], None)
+        try:
+            if job["replace_existing"]:
+                # The file's previous chunks are still in use (finish_sync
+                # only removes them once the new version is complete), so
+                # just take out the new ones this sync wrote
+                if sync is not None:
+                    await self.executors.run_cpu(self.vector_service.abandon_sync, job["vault"], sync)
+            else:
+                await self.executors.run_cpu(self.vector_service.delete_source, job["vault"], job["filename"])
+        except Exception as e:
+            print(f"Error cleaning up job {job['id']}: {e}")
+
+    @staticmethod
+    def _remove_upload(file_path: str):
+        if os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# Words that match nearly every chunk, so they only add noise to an OR query
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers
+him his how i if in into is it its itself just me more most my no nor not of off on once only or other our
+ours out over own same she should so some such than that the their theirs them then there these they this
+those through to too under until up very was we were what when where which while who whom why will with would
+you your yours
+""".split())
+
+
+def match_phrases(query_text: str) -> list[str]:
+    '''
+    The query's terms as quoted FTS5 phrases, without duplicates.
+
+    Each whitespace-separated term becomes a phrase of its word tokens, so
+    "AB-1234" must match "AB" immediately followed by "1234" (exact part
+    numbers, clause IDs). Stopwords and one-character terms are dropped.
+    '''
+    phrases = []
+    for term in query_text.split():
+        tokens = _WORD.findall(term)
+        if not tokens or all(token.lower() in STOPWORDS for token in tokens):
+            continue
+        if len(tokens) == 1 and len(tokens[0]) < 2:
+            continue
+        phrases.append('"' + " ".join(tokens) + '"')
+    return list(dict.fromkeys(phrases))
+
+
+def build_match_query(query_text: str) -> str:
+    '''
+    Turn free text into a safe FTS5 MATCH expression: the query's phrases
+    (see match_phrases) OR-ed, so BM25 ranks chunks that match more of them
+    higher. Empty if the query has no usable terms.
+    '''
+    return " OR ".join(match_phrases(query_text))
+
+
+class LexicalIndex:
+    """
+    BM25 keyword index over vault chunks, stored in SQLite FTS5.
+
+    Every vault gets its own pair of tables: `chunks_<h>` holds the chunk
+    text and metadata keyed by the same chunk IDs as Chroma, and `fts_<h>` is
+    an external-content FTS5 index over it kept in sync by triggers. <h> is a
+    hash of the vault name, so any vault name maps to a valid table name and
+    dropping a vault is a cheap DROP TABLE.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._known_vaults: set[str] = set()
+
+    @staticmethod
+    def _suffix(vault_name: str) -> str:
+        return hashlib.sha1(vault_name.encode("utf-8")).hexdigest()[:16]
+
+    def _ensure_vault(self, vault_name: str) -> str:
+        '''Create the vault's tables if needed and return their suffix. Caller holds the lock.'''
+        h = self._suffix(vault_name)
+        if vault_name in self._known_vaults:
+            return h
+        self._conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS chunks_{h} (
+                rowid INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL UNIQUE,
+                source TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_{h}_source ON chunks_{h}(source);
+            CREATE VIRTUAL TABLE IF NOT EXISTS fts_{h} USING fts5(
+                content, content='chunks_{h}', content_rowid='rowid',
+                tokenize='unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS chunks_{h}_ai AFTER INSERT ON chunks_{h} BEGIN
+                INSERT INTO fts_{h}(rowid, content) VALUES (new.rowid, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_{h}_ad AFTER DELETE ON chunks_{h} BEGIN
+                INSERT INTO fts_{h}(fts_{h}, rowid, content) VALUES ('delete', old.rowid, old.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_{h}_au AFTER UPDATE OF content ON chunks_{h} BEGIN
+                INSERT INTO fts_{h}(fts_{h}, rowid, content) VALUES ('delete', old.rowid, old.content);
+                INSERT INTO fts_{h}(rowid, content) VALUES (new.rowid, new.content);
+            END;
+        """)
+        self._known_vaults.add(vault_name)
+        return h
+
+    def _existing_vault(self, vault_name: str) -> str | None:
+        '''The vault's table suffix if its tables exist, without creating them. Caller holds the lock.'''
+        h = self._suffix(vault_name)
+        if vault_name in self._known_vaults:
+            return h
+        row = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"chunks_{h}",)
+        ).fetchone()
+        if row is None:
+            return None
+        self._known_vaults.add(vault_name)
+        return h
+
+    # ── Writes ──────────────────────────────────────────────────────────────
+
+    def upsert_chunks(self, vault_name: str, ids: list[str], documents: list[str], metadatas: list[dict]):
+        rows = [(i, m.get("source", ""), json.dumps(m), d) for i, d, m in zip(ids, documents, metadatas)]
+        with self._lock:
+            h = self._ensure_vault(vault_name)
+            self._conn.executemany(
+                f"""
+                INSERT INTO chunks_{h} (chunk_id, source, metadata, content) VALUES (?, ?, ?, ?)
+                ON CONFLICT(chunk_id) DO UPDATE SET
+                    source = excluded.source, metadata = excluded.metadata, content = excluded.content
+                """,
+                rows
+            )
+            self._conn.commit()
+
+    def update_metadata(self, vault_name: str, ids: list[str], metadatas: list[dict]):
+        with self._lock:
+            h = self._existing_vault(vault_name)
+            if h is None:
+                return
+            self._conn.executemany(
+                f"UPDATE chunks_{h} SET metadata = ? WHERE chunk_id = ?",
+                [(json.dumps(m), i) for i, m in zip(ids, metadatas)]
+            )
+            self._conn.commit()
+
+    def delete_ids(self, vault_name: str, ids: list[str]):
+        with self._lock:
+            h = self._existing_vault(vault_name)
+            if h is None:
+                return
+            self._conn.executemany(f"DELETE FROM chunks_{h} WHERE chunk_id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def delete_source(self, vault_name: str, source: str):
+        with self._lock:
+            h = self._existing_vault(vault_name)
+            if h is None:
+                return
+            self._conn.execute(f"DELETE FROM chunks_{h} WHERE source = ?", (source,))
+            self._conn.commit()
+
+    def delete_vault(self, vault_name: str):
+        h = self._suffix(vault_name)
+        with self._lock:
+            self._conn.executescript(f"""
+                DROP TABLE IF EXISTS fts_{h};
+                DROP TABLE IF EXISTS chunks_{h};
+            """)
+            self._known_vaults.discard(vault_name)
+
+    # ── Reads (never create a vault's tables) ───────────────────────────────
+
+    def has_chunks(self, vault_name: str) -> bool:
+        with self._lock:
+            h = self._existing_vault(vault_name)
+            return h is not None and self._conn.execute(f"SELECT 1 FROM chunks_{h} LIMIT 1").fetchone() is not None
+
+    def get_chunks(self, vault_name: str, ids: list[str]) -> dict[str, dict]:
+        '''{chunk_id: {"content", "metadata"}} for the IDs still in the vault.'''
+        found = {}
+        with self._lock:
+            h = self._existing_vault(vault_name)
+            if h is None:
+                return found
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT chunk_id, content, metadata FROM chunks_{h} WHERE chunk_id IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for chunk_id, content, metadata in rows:
+                    found[chunk_id] = {"content": content, "metadata": json.loads(metadata)}
+        return found
+
+    def search(self, vault_name: str, query_text: str, n_results: int = 5, min_term_share: float = 0.0) -> list[dict]:
+        '''
+        BM25-ranked chunks, best first. score is the (positive) BM25 relevance.
+
+        With min_term_share, chunks must contain at least that share of the
+        query's terms (and at least one), so a chunk that only shares one
+        common word with a longer question isn't returned.
+        '''
+        phrases = match_phrases(query_text)
+        if not phrases:
+            return []
+        min_terms = max(1, math.ceil(min_term_share * len(phrases)))
+        with self._lock:
+            h = self._existing_vault(vault_name)
+            if h is None:
+                return []
+            rows = self._conn.execute(
+                f"""
+                SELECT c.rowid, c.chunk_id, c.content, c.metadata, bm25(fts_{h}) AS rank
+                FROM fts_{h} JOIN chunks_{h} c ON c.rowid = fts_{h}.rowid
+                WHERE fts_{h} MATCH ?
+                ORDER BY rank
+                LIMIT ?
+                """,
+                # Extra candidates when some will be filtered out below
+                (" OR ".join(phrases), n_results if min_terms == 1 else n_results * 4)
+            ).fetchall()
+            if min_terms > 1 and rows:
+                # Ask FTS5 which candidates match each phrase, so terms are
+                # counted with the index's own tokenizer
+                matched = Counter()
+                placeholders = ",".join("?" * len(rows))
+                for phrase in phrases:
+                    matched.update(rowid for (rowid,) in self._conn.execute(
+                        f"SELECT rowid FROM fts_{h} WHERE fts_{h} MATCH ? AND rowid IN ({placeholders})",
+                        (phrase, *(row[0] for row in rows))
+                    ))
+                rows = [row for row in rows if matched[row[0]] >= min_terms]
+        # FTS5's bm25() is negative, lower is better
+        return [
+            {"id": chunk_id, "content": content, "metadata": json.loads(metadata), "score": round(-rank, 4)}
+            for _, chunk_id, content, metadata, rank in rows[:n_results]
+        ]
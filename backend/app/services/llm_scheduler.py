@@ -0,0 +1,489 @@
+import asyncio
+import importlib
+import itertools
+import math
+import multiprocessing
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator
+
+from app.services.metrics_service import TOKEN_BUCKETS, TOKEN_RATE_BUCKETS
+
+# Lower runs first: answers a user is waiting on go ahead of background titles
+PRIORITY_ANSWER = 0
+PRIORITY_TITLE = 1
+
+_WAIT_SAMPLES = 500
+
+# Fallback answers LLMService returns instead of raising. They live here so the
+# API process can recognise them (e.g. to keep them out of the answer cache)
+# without importing GPT4All.
+NO_CONTEXT_RESPONSE = "I don't have any relevant context to answer this query."
+ERROR_RESPONSE = "An error occurred while generating a response."
+
+DEFAULT_LLM_SERVICE = "app.services.llm_service:LLMService"
+
+
+class SchedulerBusy(Exception):
+    '''The LLM queue is full (or a request waited too long); retry after `retry_after` seconds.'''
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueTimeout(SchedulerBusy):
+    pass
+
+
+def _load_service_class(path: str):
+    '''"package.module:ClassName" -> the class.'''
+    module_name, _, class_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _worker_main(conn, llm_kwargs: dict, service_class: str = DEFAULT_LLM_SERVICE):
+    '''
+    Entry point of an LLM worker process. `service_class` names the model
+    wrapper to load ("module:Class"); anything with LLMService's methods works.
+
+    Requests arrive on `conn` as (kind, request_id, payload) and are handled
+    one at a time; answers stream back as ("token", id, text) messages and
+    every request ends with ("done", id, stats) or ("error", id, message).
+    The stats include the request's usage: seconds to the first token
+    (prompt evaluation), seconds after it (generation) and token counts.
+    A separate thread keeps reading the pipe so "stop" messages can cut a
+    generation short.
+    '''
+    # Imported here so the API process never loads GPT4All itself
+    LLMService = _load_service_class(service_class)
+
+    service = None
+    jobs: queue.Queue = queue.Queue()
+    stops: dict[int, threading.Event] = {}
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def reader():
+        while True:
+            try:
+                kind, request_id, payload = conn.recv()
+            except (EOFError, OSError):
+                jobs.put(None)
+                return
+            if kind == "stop":
+                if request_id in stops:
+                    stops[request_id].set()
+            elif kind == "shutdown":
+                jobs.put(None)
+                return
+            else:
+                stops[request_id] = threading.Event()
+                jobs.put((kind, request_id, payload))
+
+    threading.Thread(target=reader, name="vault-llm-reader", daemon=True).start()
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        kind, request_id, payload = job
+        stop = stops[request_id]
+        try:
+            if service is None:
+                # Loaded on first use, so hot-reloads don't pay for it
+                service = LLMService(**llm_kwargs)
+            began = time.perf_counter()
+            first_token_at = None
+            tokens = 0
+            if kind == "answer":
+                for token in service.stream_answer(payload["query"], payload["context"], stop=stop):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    tokens += 1
+                    send(("token", request_id, token))
+            elif kind == "title":
+                send(("token", request_id, service.generate_chat_title(payload["query"])))
+            else:
+                raise ValueError(f"Unknown LLM request kind {kind!r}")
+            finished = time.perf_counter()
+            usage = {"seconds": finished - began}
+            if kind == "answer":
+                first_token_at = first_token_at or finished
+                usage.update({"prompt_seconds": first_token_at - began, "generate_seconds": finished - first_token_at,
+                              "prompt_tokens": getattr(service, "last_prompt_tokens", None), "completion_tokens": tokens})
+            send(("done", request_id, {"prompts": service.prompt_stats(),
+                                       "chars_per_token": service.chars_per_token, "usage": usage}))
+        except Exception as e:
+            send(("error", request_id, str(e)))
+        finally:
+            stops.pop(request_id, None)
+
+
+class _Job:
+    def __init__(self, request_id: int, kind: str, payload: dict, user_id, priority: int):
+        self.id = request_id
+        self.kind = kind
+        self.payload = payload
+        self.user_id = user_id
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.started_at: float | None = None
+        self.state = "queued"  # queued -> running -> finished, or expired / cancelled
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.worker: "_Worker | None" = None
+        self.timer: asyncio.TimerHandle | None = None
+        self.usage: dict = {}
+
+
+class _Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.job: _Job | None = None
+        self.prompts: dict = {}
+        self.alive = False
+
+
+class LLMScheduler:
+    """
+    Schedules LLM work onto a pool of model worker processes.
+
+    Each worker process owns its own GPT4All instance(s), so generations run
+    truly in parallel and never contend for one model. Requests wait in a
+    bounded queue ordered by priority (answers before titles) and, within a
+    priority, round-robin across users so one user's burst can't starve the
+    others. A request that finds the queue full, or that waits longer than
+    `queue_timeout`, fails fast with SchedulerBusy, which carries a
+    Retry-After estimate. An answer depends only on its query and context,
+    never on the chat it was asked in, so any worker can take any request.
+
+    With a `metrics` registry it records queue waits, prompt evaluation and
+    generation times, token counts and outcomes per request.
+    """
+
+    def __init__(self, workers: int = 1, max_queue: int = 32, queue_timeout: float = 60.0,
+                 llm_kwargs: dict | None = None, service_class: str = DEFAULT_LLM_SERVICE, metrics=None):
+        self.num_workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.queue_timeout = queue_timeout
+        self.llm_kwargs = llm_kwargs or {}
+        self.service_class = service_class
+
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = [_Worker(i) for i in range(self.num_workers)]
+        # priority -> user_id -> jobs; the user order is the round-robin order
+        self._queues: dict[int, OrderedDict] = {PRIORITY_ANSWER: OrderedDict(), PRIORITY_TITLE: OrderedDict()}
+        self._queued = 0
+        self._jobs: dict[int, _Job] = {}
+        self._ids = itertools.count(1)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+        self.chars_per_token: float | None = None
+        self.dispatched = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waits_ms: deque = deque(maxlen=_WAIT_SAMPLES)
+        # Moving average of how long a request occupies a worker, for Retry-After
+        self._service_seconds = 5.0
+
+        self._metrics = None
+        if metrics is not None:
+            self._register_metrics(metrics)
+
+    def _register_metrics(self, metrics):
+        self._metrics = {
+            "requests": metrics.counter("vault_llm_requests_total", "LLM requests by kind and outcome", ("kind", "outcome")),
+            "queue_wait": metrics.histogram("vault_llm_queue_wait_seconds", "Time LLM requests waited for a worker", ("kind",)),
+            "seconds": metrics.histogram("vault_llm_request_seconds", "Time a worker spent on an LLM request", ("kind",)),
+            "prompt_seconds": metrics.histogram("vault_llm_prompt_seconds", "Time to an answer's first token (prompt evaluation)"),
+            "generate_seconds": metrics.histogram("vault_llm_generation_seconds", "Time spent generating an answer after its first token"),
+            "prompt_tokens": metrics.histogram("vault_llm_prompt_tokens", "Tokens evaluated for an answer's prompt",
+                                               buckets=TOKEN_BUCKETS),
+            "completion_tokens": metrics.histogram("vault_llm_completion_tokens", "Tokens generated per answer",
+                                                   buckets=TOKEN_BUCKETS),
+            "tokens_per_second": metrics.histogram("vault_llm_tokens_per_second", "Answer generation speed after the first token",
+                                                   buckets=TOKEN_RATE_BUCKETS),
+        }
+        metrics.gauge("vault_llm_queue_depth", "LLM requests waiting for a worker", lambda: self._queued)
+        metrics.gauge("vault_llm_busy_workers", "LLM workers handling a request",
+                      lambda: sum(1 for w in self._workers if w.job is not None))
+
+    def _count(self, kind: str, outcome: str):
+        if self._metrics is not None:
+            self._metrics["requests"].inc(kind=kind, outcome=outcome)
+
+    def _observe_usage(self, job: _Job):
+        if self._metrics is None:
+            return
+        usage = job.usage
+        m = self._metrics
+        if usage.get("seconds") is not None:
+            m["seconds"].observe(usage["seconds"], kind=job.kind)
+        if job.kind != "answer":
+            return
+        m["prompt_seconds"].observe(usage["prompt_seconds"])
+        m["generate_seconds"].observe(usage["generate_seconds"])
+        if usage.get("prompt_tokens"):
+            m["prompt_tokens"].observe(usage["prompt_tokens"])
+        m["completion_tokens"].observe(usage["completion_tokens"])
+        if usage["generate_seconds"] > 0 and usage["completion_tokens"] > 1:
+            # The first token arrives with the prompt evaluation
+            m["tokens_per_second"].observe((usage["completion_tokens"] - 1) / usage["generate_seconds"])
+
+    # ── Lifecycle ───────────────────────────────────────────────────────────
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        for worker in self._workers:
+            self._spawn(worker)
+        print(f"LLM scheduler started with {self.num_workers} worker process(es)")
+
+    def _spawn(self, worker: _Worker):
+        parent_conn, child_conn = self._ctx.Pipe()
+        worker.process = self._ctx.Process(target=_worker_main, args=(child_conn, self.llm_kwargs, self.service_class),
+                                           name=f"vault-llm-{worker.index}", daemon=True)
+        worker.process.start()
+        child_conn.close()
+        worker.conn = parent_conn
+        worker.alive = True
+        threading.Thread(target=self._read_worker, args=(worker, parent_conn),
+                         name=f"vault-llm-pipe-{worker.index}", daemon=True).start()
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.alive = False
+            try:
+                worker.conn.send(("shutdown", None, None))
+            except (OSError, AttributeError):
+                pass
+        for worker in self._workers:
+            if worker.process is not None:
+                await asyncio.to_thread(worker.process.join, 5)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+
+    # ── Submitting work ─────────────────────────────────────────────────────
+
+    def retry_after(self) -> int:
+        '''Seconds until a queued request would probably be started.'''
+        backlog = (self._queued + 1) / self.num_workers
+        return max(1, min(120, math.ceil(backlog * self._service_seconds)))
+
+    def ensure_capacity(self, kind: str = "answer"):
+        '''Raise SchedulerBusy now if the queue is full, before the caller does any other work.'''
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            self._count(kind, "rejected")
+            raise SchedulerBusy("The assistant is busy, please try again shortly.", self.retry_after())
+
+    def submit(self, kind: str, payload: dict, user_id=None, priority: int = PRIORITY_ANSWER) -> _Job:
+        self.ensure_capacity(kind)
+        job = _Job(next(self._ids), kind, payload, user_id, priority)
+        self._jobs[job.id] = job
+        self._queues[priority].setdefault(user_id, deque()).append(job)
+        self._queued += 1
+        self._idle.clear()
+        if self.queue_timeout:
+            job.timer = self._loop.call_later(self.queue_timeout, self._expire, job)
+        self._dispatch()
+        return job
+
+    async def results(self, job: _Job, usage: dict | None = None) -> AsyncIterator[str]:
+        '''
+        Yield the job's tokens; raises QueueTimeout if it never got a worker.
+        When it is done, `usage` gets its queue wait, prompt and generation
+        seconds and token counts.
+        '''
+        try:
+            while True:
+                kind, data = await job.events.get()
+                if kind == "token":
+                    yield data
+                elif kind == "done":
+                    if usage is not None:
+                        usage.update(data)
+                    return
+                elif kind == "expired":
+                    raise QueueTimeout("The assistant is busy, please try again shortly.", self.retry_after())
+                else:
+                    raise RuntimeError(data)
+        finally:
+            # Consumer went away early (e.g. client disconnected)
+            self.cancel(job)
+
+    def cancel(self, job: _Job):
+        '''Drop a queued job or stop a running one; does nothing once it has finished.'''
+        if job.state == "queued":
+            job.state = "cancelled"
+            self._queued -= 1
+            self._count(job.kind, "cancelled")
+            self._forget(job)
+        elif job.state == "running":
+            try:
+                job.worker.conn.send(("stop", job.id, None))
+            except OSError:
+                pass
+
+    def stream(self, kind: str, payload: dict, user_id=None, priority: int = PRIORITY_ANSWER,
+               usage: dict | None = None):
+        '''submit() + results(); SchedulerBusy for a full queue is raised here, before iteration.'''
+        return self.results(self.submit(kind, payload, user_id, priority), usage)
+
+    async def run(self, kind: str, payload: dict, user_id=None, priority: int = PRIORITY_ANSWER,
+                  usage: dict | None = None) -> str:
+        return "".join([token async for token in self.stream(kind, payload, user_id, priority, usage)])
+
+    async def wait_idle(self, settle: float = 0.5):
+        '''Return once no LLM request has been queued or running for `settle` seconds.'''
+        while True:
+            await self._idle.wait()
+            await asyncio.sleep(settle)
+            if self._idle.is_set():
+                return
+
+    # ── Dispatch ────────────────────────────────────────────────────────────
+
+    def _next_job(self) -> _Job | None:
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            while users:
+                user_id, jobs = next(iter(users.items()))
+                job = jobs.popleft()
+                if jobs:
+                    users.move_to_end(user_id)
+                else:
+                    del users[user_id]
+                if job.state == "queued":
+                    return job
+        return None
+
+    def _dispatch(self):
+        while self._queued:
+            idle = [w for w in self._workers if w.alive and w.job is None]
+            if not idle:
+                return
+            job = self._next_job()
+            if job is None:
+                return
+            worker = idle[0]
+
+            self._queued -= 1
+            job.state = "running"
+            job.worker = worker
+            job.started_at = time.monotonic()
+            if job.timer is not None:
+                job.timer.cancel()
+            worker.job = job
+            self.dispatched += 1
+            job.usage["queue_seconds"] = job.started_at - job.enqueued_at
+            self._waits_ms.append(job.usage["queue_seconds"] * 1000)
+            if self._metrics is not None:
+                self._metrics["queue_wait"].observe(job.usage["queue_seconds"], kind=job.kind)
+            try:
+                worker.conn.send((job.kind, job.id, job.payload))
+            except OSError as e:
+                self._finish(job, "error", f"LLM worker unavailable: {e}")
+
+    def _expire(self, job: _Job):
+        if job.state != "queued":
+            return
+        job.state = "expired"
+        self._queued -= 1
+        self.timed_out += 1
+        self._count(job.kind, "expired")
+        self._forget(job)
+        job.events.put_nowait(("expired", None))
+
+    def _forget(self, job: _Job):
+        self._jobs.pop(job.id, None)
+        if job.timer is not None:
+            job.timer.cancel()
+        self._update_idle()
+
+    def _update_idle(self):
+        if self._queued == 0 and all(w.job is None for w in self._workers):
+            self._idle.set()
+
+    def _finish(self, job: _Job, kind: str, data):
+        job.state = "finished"
+        worker = job.worker
+        if worker is not None and worker.job is job:
+            worker.job = None
+        if job.started_at is not None:
+            elapsed = time.monotonic() - job.started_at
+            self._service_seconds = 0.8 * self._service_seconds + 0.2 * elapsed
+        self._count(job.kind, "completed" if kind == "done" else "failed")
+        job.events.put_nowait((kind, data))
+        self._forget(job)
+        self._dispatch()
+
+    # ── Worker messages (reader threads hand them to the event loop) ────────
+
+    def _read_worker(self, worker: _Worker, conn):
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                self._loop.call_soon_threadsafe(self._worker_exited, worker, conn)
+                return
+            self._loop.call_soon_threadsafe(self._on_message, worker, message)
+
+    def _on_message(self, worker: _Worker, message):
+        kind, request_id, data = message
+        job = self._jobs.get(request_id)
+        if job is None:
+            return
+        if kind == "token":
+            job.events.put_nowait(("token", data))
+        elif kind == "done":
+            worker.prompts = data.get("prompts", {})
+            self.chars_per_token = data.get("chars_per_token", self.chars_per_token)
+            job.usage.update(data.get("usage", {}))
+            self._observe_usage(job)
+            self._finish(job, "done", job.usage)
+        elif kind == "error":
+            self._finish(job, "error", data)
+
+    def _worker_exited(self, worker: _Worker, conn):
+        if worker.conn is not conn or not worker.alive:
+            return
+        worker.alive = False
+        print(f"LLM worker {worker.index} exited unexpectedly, restarting it")
+        if worker.job is not None:
+            self._finish(worker.job, "error", "LLM worker crashed")
+        self._spawn(worker)
+        self._dispatch()
+
+    # ── Stats ───────────────────────────────────────────────────────────────
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits_ms)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))], 1) if waits else 0.0
+
+        return {
+            "workers": self.num_workers,
+            "busy_workers": sum(1 for w in self._workers if w.job is not None),
+            "queue_depth": self._queued,
+            "queue_depth_by_priority": {
+                "answer": sum(1 for jobs in self._queues[PRIORITY_ANSWER].values() for j in jobs if j.state == "queued"),
+                "title": sum(1 for jobs in self._queues[PRIORITY_TITLE].values() for j in jobs if j.state == "queued"),
+            },
+            "max_queue": self.max_queue,
+            "dispatched": self.dispatched,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_ms": {"avg": round(sum(waits) / len(waits), 1) if waits else 0.0,
+                        "p50": percentile(0.5), "p95": percentile(0.95)},
+            "prompts": [w.prompts for w in self._workers],
+        }
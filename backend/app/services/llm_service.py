@@ -1,45 +1,310 @@
+import contextlib
 import os
+import threading
+from typing import Iterator
+
 from gpt4all import GPT4All
 
+from app.services.context_builder import DEFAULT_CHARS_PER_TOKEN, estimate_tokens
+from app.services.llm_scheduler import ERROR_RESPONSE, NO_CONTEXT_RESPONSE
+
+# Kept identical for every answer so it is evaluated once per model instance;
+# the retrieved context travels with each question instead.
+SYSTEM_PROMPT = """You are an intelligent AI assistant for Vault AI. You must answer the user's query ONLY if the core topic is present in the provided context.
+Every user message starts with the Context Data retrieved for that question, followed by the question itself.
+CRITICAL RULES:
+1. If the user asks about a topic not mentioned in the Context Data of their message, you MUST refuse to answer and say: "I cannot find the answer to that in your documents." DO NOT provide general knowledge on topics missing from the context.
+2. If the topic IS present in the context, you may use your knowledge to refine and expand upon the provided information.
+3. When using information from the context, you MUST cite the exact source filename and page using exactly the [Source: ..., Page: ...] tags provided."""
+
+
+def build_user_prompt(query: str, context: str) -> str:
+    return f"""Context Data:
+{context}
+
+Question: {query}"""
+
+
+def _evaluated_tokens(model: GPT4All) -> int:
+    '''Tokens currently in the model's KV cache.'''
+    try:
+        return model.model.context.n_past
+    except AttributeError:
+        return 0
+
+
+class _PromptPrefix:
+    '''
+    A GPT4All instance in a chat session whose KV cache holds the evaluated
+    system prompt. Each answer starts from there: the cache is rewound to the
+    end of the system prompt, so no earlier question or answer is in context
+    and only the new user message is evaluated.
+
+    There is one prefix per model instance rather than a session per chat:
+    answers don't see the chat's earlier turns (each question carries its own
+    retrieved context), so the system prompt is all that two turns of a chat
+    have in common, and it is the same for every chat. Per-chat sessions
+    would hold the same tokens once per chat in memory.
+
+    This drives GPT4All's internals (prompt_model, context.n_past and the
+    current_chat_session setter) as of gpt4all 2.8, the version pinned in
+    requirements.txt; LLMService.verify_prefix checks the result against a
+    fresh session when the model is loaded.
+    '''
+
+    def __init__(self, model: GPT4All):
+        self.model = model
+        self.tokens = 0  # Length of the evaluated prefix; 0 until it is evaluated
+        self._stack: contextlib.ExitStack | None = None
+
+    def open(self):
+        self.close()
+        self._stack = contextlib.ExitStack()
+        self._stack.enter_context(self.model.chat_session(system_prompt=SYSTEM_PROMPT))
+        # What GPT4All.generate does on a session's first turn: evaluate the
+        # system prompt on its own, with nothing generated
+        self.model.model.prompt_model(SYSTEM_PROMPT, "%1%2", lambda token_id, response: True,
+                                      n_predict=0, reset_context=True, special=True)
+        self.tokens = _evaluated_tokens(self.model)
+
+    def rewind(self):
+        '''Drop everything after the system prompt (evaluating it first if needed).'''
+        if not self.tokens:
+            self.open()
+        self.model.model.context.n_past = self.tokens
+        # generate() only evaluates the history's last message, and evaluates
+        # the system prompt again while it is the only one, so a stand-in turn
+        # stays after it
+        system = self.model.current_chat_session[0]
+        self.model.current_chat_session = [system, {"role": "assistant", "content": ""}]
+
+    def close(self):
+        if self._stack is not None:
+            self._stack.close()
+            self._stack = None
+        self.tokens = 0
+
+
 class LLMService:
-    def __init__(self, model_name="Llama-3.2-1B-Instruct-Q4_0.gguf"):
+    def __init__(self, model_name="Llama-3.2-1B-Instruct-Q4_0.gguf", n_ctx: int = 2048, reuse_prefix: bool = True,
+                 verify_prefix: bool = True):
         # Create a directory locally inside the backend to store the downloaded model
-        model_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "models")
-        os.makedirs(model_dir, exist_ok=True)
-        print(f"Checking for model in {model_dir}... Loading into memory (this is not a download, just reading the local file)...")
-        
+        self.model_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "models")
+        os.makedirs(self.model_dir, exist_ok=True)
+        print(f"Checking for model in {self.model_dir}... Loading into memory (this is not a download, just reading the local file)...")
+
         # This will securely download the model to the 'models' directory if it doesn't already exist.
         # It runs completely offline after the initial download and is optimized for CPU inference!
-        self.model = GPT4All(model_name=model_name, model_path=model_dir, allow_download=True)
+        self.model_name = model_name
+        self.n_ctx = n_ctx
+        self.model = GPT4All(model_name=model_name, model_path=self.model_dir, allow_download=True, n_ctx=n_ctx)
         print("Local LLM model successfully loaded into memory.")
-        
+        # self.model serves one-off prompts (titles, and answers when the prefix is off)
+        self._scratch_lock = threading.Lock()
+
+        # GPT4All's Python bindings don't expose the tokenizer, so prompt sizes
+        # are estimated from a characters-per-token ratio that is re-measured
+        # against the model's own token count after every answer.
+        self.chars_per_token = DEFAULT_CHARS_PER_TOKEN
+        # Tokens the model evaluated for the last answer's prompt, for /metrics
+        self.last_prompt_tokens: int | None = None
+
+        # Answers get their own instance so titles (another system prompt)
+        # don't evict the evaluated prefix. The weights are memory mapped and
+        # shared; the second instance only adds a KV cache.
+        self._prefix: _PromptPrefix | None = None
+        if reuse_prefix:
+            self._prefix = _PromptPrefix(GPT4All(model_name=model_name, model_path=self.model_dir,
+                                                 allow_download=False, n_ctx=n_ctx))
+        self._prefix_lock = threading.Lock()
+        # Why the prefix was turned off, if it was (see /stats/llm)
+        self.prefix_disabled: str | None = None
+        self.prefix_verified: bool | None = None
+        self.answers = 0
+        self.prefix_evaluations = 0
+        self.prompt_tokens_evaluated = 0
+        self.prompt_tokens_reused = 0
+        if self._prefix is not None and verify_prefix:
+            self.verify_prefix()
+
+    def count_tokens(self, text: str) -> int:
+        return estimate_tokens(text, self.chars_per_token)
+
+    def _calibrate(self, prompt_chars: int, prompt_tokens: int):
+        '''Update chars_per_token from the tokens the model evaluated for the last prompt.'''
+        if prompt_chars <= 0 or prompt_tokens <= 0:
+            return
+        self.last_prompt_tokens = prompt_tokens
+        # Moving average, so one odd prompt doesn't swing the estimate. The
+        # chat template's tokens are included, which errs on the safe side.
+        self.chars_per_token = 0.8 * self.chars_per_token + 0.2 * (prompt_chars / prompt_tokens)
+
+    # ── Prompt prefix ───────────────────────────────────────────────────────
+
+    @contextlib.contextmanager
+    def _answer_model(self, user_prompt: str):
+        '''
+        Yield (model, prompt_chars, tokens_before) for one answer, with only
+        the system prompt in the model's KV cache.
+
+        Without the reused prefix (reuse_prefix=False) every answer evaluates
+        the system prompt again in a fresh session.
+        '''
+        with self._prefix_lock:
+            prefix = self._prefix
+            if prefix is not None:
+                try:
+                    reused = prefix.tokens > 0
+                    prefix.rewind()
+                except Exception as e:
+                    # Bindings without prompt_model / current_chat_session
+                    self._disable_prefix(f"the GPT4All bindings don't support it ({e!r})")
+                    prefix = None
+            if prefix is not None:
+                if reused:
+                    self.prompt_tokens_reused += prefix.tokens
+                else:
+                    self.prefix_evaluations += 1
+                    self.prompt_tokens_evaluated += prefix.tokens
+                try:
+                    yield prefix.model, len(user_prompt), prefix.tokens
+                    self.answers += 1
+                except BaseException:
+                    # The KV cache may be half-updated, so don't reuse it
+                    prefix.close()
+                    raise
+                return
+
+        with self._scratch_lock, self.model.chat_session(system_prompt=SYSTEM_PROMPT):
+            yield self.model, len(SYSTEM_PROMPT) + len(user_prompt), 0
+            self.answers += 1
+
+    def _disable_prefix(self, reason: str):
+        '''Go back to evaluating the system prompt for every answer.'''
+        print(f"WARNING: reuse of the evaluated system prompt is off, every answer evaluates it again: {reason}")
+        if self._prefix is not None:
+            self._prefix.close()
+            self._prefix = None
+        self.prefix_disabled = reason
+
+    def verify_prefix(self, query: str = "What does the report recommend?",
+                      context: str = "[Source: report.pdf, Page: 1]\nThe report recommends weekly backups.",
+                      max_tokens: int = 16) -> bool:
+        '''
+        Answer one question greedily from the reused prefix (twice, so the
+        second answer starts from a rewound cache) and from a fresh session.
+        Reuse is turned off if they differ: a wrong n_past would otherwise
+        corrupt every answer.
+        '''
+        if self._prefix is None:
+            return False
+        user_prompt = build_user_prompt(query, context)
+        try:
+            reused = []
+            for _ in range(2):
+                with self._answer_model(user_prompt) as (model, _, _):
+                    reused.append(model.generate(user_prompt, max_tokens=max_tokens, temp=0))
+            with self._scratch_lock, self.model.chat_session(system_prompt=SYSTEM_PROMPT):
+                fresh = self.model.generate(user_prompt, max_tokens=max_tokens, temp=0)
+        except Exception as e:
+            self._disable_prefix(f"checking it against a fresh session failed ({e!r})")
+            self.prefix_verified = False
+            return False
+        if self._prefix is None:
+            # _answer_model already turned it off
+            self.prefix_verified = False
+            return False
+        self.prefix_verified = all(answer == fresh for answer in reused)
+        if not self.prefix_verified:
+            self._disable_prefix(f"answers from it differ from a fresh session ({reused!r} vs {fresh!r})")
+        return self.prefix_verified
+
+    def _measure_prompt(self, model: GPT4All, prompt_chars: int, tokens_before: int, generated: int):
+        '''Count the tokens evaluated for an answer's prompt and calibrate chars_per_token with them.'''
+        if tokens_before + prompt_chars / self.chars_per_token + generated >= self.n_ctx * 0.9:
+            # GPT4All may have shifted the context to make room, which
+            # overwrites the prefix and leaves n_past meaningless
+            if self._prefix is not None:
+                self._prefix.close()
+            return
+        prompt_tokens = _evaluated_tokens(model) - tokens_before - generated
+        self.prompt_tokens_evaluated += max(0, prompt_tokens)
+        self._calibrate(prompt_chars, prompt_tokens)
+
+    def prompt_stats(self) -> dict:
+        '''How much prompt evaluation the reused system prompt saved.'''
+        total = self.prompt_tokens_evaluated + self.prompt_tokens_reused
+        return {
+            "reuse_prefix": self._prefix is not None,
+            "prefix_verified": self.prefix_verified,
+            "prefix_disabled": self.prefix_disabled,
+            "prefix_tokens": self._prefix.tokens if self._prefix is not None else 0,
+            "prefix_evaluations": self.prefix_evaluations,
+            "answers": self.answers,
+            "prompt_tokens_evaluated": self.prompt_tokens_evaluated,
+            "prompt_tokens_reused": self.prompt_tokens_reused,
+            "reuse_rate": round(self.prompt_tokens_reused / total, 4) if total else 0.0,
+            "chars_per_token": round(self.chars_per_token, 3),
+        }
+
+    # ── Generation ──────────────────────────────────────────────────────────
+
     def generate_answer(self, query: str, context: str) -> str:
         try:
             if not context:
-                return "I don't have any relevant context to answer this query."
-                
-            system_prompt = f"""You are an intelligent AI assistant for Vault AI. You must answer the user's query ONLY if the core topic is present in the provided context.
-CRITICAL RULES:
-1. If the user asks about a topic not mentioned in the Context Data below, you MUST refuse to answer and say: "I cannot find the answer to that in your documents." DO NOT provide general knowledge on topics missing from the context.
-2. If the topic IS present in the context, you may use your knowledge to refine and expand upon the provided information.
-3. When using information from the context, you MUST cite the exact source filename and page using exactly the [Source: ..., Page: ...] tags provided.
+                return NO_CONTEXT_RESPONSE
+
+            user_prompt = build_user_prompt(query, context)
+            generated = 0
+            self.last_prompt_tokens = None
 
-Context Data: 
-{context}"""
-            
-            with self.model.chat_session(system_prompt=system_prompt):
+            def count(token_id, response):
+                nonlocal generated
+                generated += 1
+                return True
+
+            with self._answer_model(user_prompt) as (model, prompt_chars, tokens_before):
                 # The generate method natively handles chat templating within a session
-                response = self.model.generate(query, max_tokens=2048, temp=0.3)
-                
+                response = model.generate(user_prompt, max_tokens=2048, temp=0.3, callback=count)
+                self._measure_prompt(model, prompt_chars, tokens_before, generated)
+
             return response.strip()
         except Exception as e:
             print(f"LLM Generation Error: {e}")
-            return "An error occurred while generating a response."
+            return ERROR_RESPONSE
+
+    def stream_answer(self, query: str, context: str, stop: threading.Event | None = None) -> Iterator[str]:
+        """
+        Same as generate_answer, but yields tokens as GPT4All produces them.
+        Setting `stop` ends generation early (e.g. when the client disconnects).
+        """
+        if not context:
+            yield NO_CONTEXT_RESPONSE
+            return
+
+        try:
+            user_prompt = build_user_prompt(query, context)
+            generated = 0
+            self.last_prompt_tokens = None
+
+            def keep_going(token_id, response):
+                # Returning False tells GPT4All to stop generating
+                nonlocal generated
+                generated += 1
+                return stop is None or not stop.is_set()
+
+            with self._answer_model(user_prompt) as (model, prompt_chars, tokens_before):
+                for token in model.generate(user_prompt, max_tokens=2048, temp=0.3, streaming=True, callback=keep_going):
+                    yield token
+                self._measure_prompt(model, prompt_chars, tokens_before, generated)
+        except Exception as e:
+            print(f"LLM Streaming Error: {e}")
+            yield ERROR_RESPONSE
 
     def generate_chat_title(self, query: str) -> str:
         try:
             prompt = f"Summarize the following user query in 3 to 4 words. Do not include quotes, periods, or extra text.\n\nQuery: {query}"
-            with self.model.chat_session(system_prompt="You are a helpful assistant that summarizes text concisely."):
+            with self._scratch_lock, self.model.chat_session(system_prompt="You are a helpful assistant that summarizes text concisely."):
                 response = self.model.generate(prompt, max_tokens=10, temp=0.3)
             title = response.strip().replace('"', '').replace("'", "")
             return title[:50]
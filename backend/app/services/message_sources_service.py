@@ -0,0 +1,182 @@
+import asyncio
+import json
+import sqlite3
+from contextlib import closing
+
+import aiosqlite
+
+from app.services.vector_db_service import make_chunk_id
+
+
+class MessageSourceStore:
+    """
+    Sources of assistant messages, stored as references to vault chunks.
+
+    Each source is a row in `message_sources` holding the chunk ID, file, page
+    and score; the chunk text is looked up in the vault when the message is
+    read. Chunks that leave the vault (a deleted file, or a re-upload that
+    dropped them) have their text copied into the rows citing them first, as
+    VectorDBService's source_archive, so the message can still show it.
+
+    Messages saved before this table existed carry a JSON copy of every chunk
+    in `chat_messages.sources`; a background task moves those over in
+    batches, and until then they are read as before.
+    """
+
+    def __init__(self, db_path: str, vector_service, executors, batch_size: int = 200):
+        self.db_path = db_path
+        self.vector_service = vector_service
+        self.executors = executors
+        self.batch_size = batch_size
+        self._task: asyncio.Task | None = None
+
+    # ── Lifecycle ───────────────────────────────────────────────────────────
+
+    async def start(self):
+        self._task = asyncio.create_task(self._migrate_legacy())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # ── Writes ──────────────────────────────────────────────────────────────
+
+    async def save(self, db: aiosqlite.Connection, message_id: int, results: list[dict], snapshots: set[str] = frozenset()):
+        '''Insert references to `results` for a message; the caller commits.'''
+        rows = []
+        for position, result in enumerate(results):
+            metadata = result.get("metadata") or {}
+            chunk_id = result.get("id") or make_chunk_id(metadata.get("source", ""), result.get("content", ""))
+            rows.append((
+                message_id, position, chunk_id, metadata.get("source"), metadata.get("page"), result.get("score"),
+                result.get("content") if chunk_id in snapshots else None
+            ))
+        if rows:
+            await db.executemany(
+                "INSERT INTO message_sources (message_id, position, chunk_id, source, page, score, content) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    # ── Snapshots ───────────────────────────────────────────────────────────
+    # Blocking: VectorDBService calls these on its worker threads before deleting chunks
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def cited_chunks(self, vault_name: str, chunk_ids: list[str]) -> set[str]:
+        '''Those of `chunk_ids` that messages in the vault's chats cite without a copy of their text.'''
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"""
+                SELECT DISTINCT s.chunk_id FROM message_sources s
+                JOIN chat_messages m ON m.id = s.message_id JOIN chats c ON c.id = m.chat_id
+                WHERE s.chunk_id IN ({','.join('?' * len(chunk_ids))}) AND s.content IS NULL AND c.vault_name = ?
+                """,
+                [*chunk_ids, vault_name]
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def snapshot_chunks(self, vault_name: str, texts: dict[str, str]):
+        '''Keep {chunk_id: text} on the vault's message sources that cite those chunks.'''
+        with closing(self._connect()) as conn:
+            conn.executemany(
+                """
+                UPDATE message_sources SET content = ? WHERE chunk_id = ? AND content IS NULL AND message_id IN (
+                    SELECT m.id FROM chat_messages m JOIN chats c ON c.id = m.chat_id WHERE c.vault_name = ?
+                )
+                """,
+                [(text, chunk_id, vault_name) for chunk_id, text in texts.items()]
+            )
+            conn.commit()
+
+    # ── Reads ───────────────────────────────────────────────────────────────
+
+    async def load(self, db: aiosqlite.Connection, vault_name: str, message_ids: list[int]) -> dict[int, list[dict]]:
+        '''{message_id: sources} with chunk text filled in, for messages of one chat (so one vault).'''
+        if not message_ids:
+            return {}
+        async with db.execute(
+            f"""
+            SELECT message_id, chunk_id, source, page, score, content FROM message_sources
+            WHERE message_id IN ({','.join('?' * len(message_ids))})
+            ORDER BY message_id, position
+            """,
+            message_ids
+        ) as cursor:
+            rows = await cursor.fetchall()
+        if not rows:
+            return {}
+
+        chunks = await self.executors.run_cpu(
+            self.vector_service.get_chunks, vault_name, [row[1] for row in rows if row[5] is None]
+        )
+        sources: dict[int, list[dict]] = {}
+        for message_id, chunk_id, source, page, score, content in rows:
+            chunk = chunks.get(chunk_id)
+            if chunk is not None:
+                metadata = chunk["metadata"]
+                content = chunk["content"]
+            else:
+                metadata = {"source": source, "page": page, "domain": vault_name}
+            sources.setdefault(message_id, []).append(
+                {"id": chunk_id, "content": content or "", "metadata": metadata, "score": score}
+            )
+        return sources
+
+    # ── Legacy rows ─────────────────────────────────────────────────────────
+
+    async def _migrate_legacy(self):
+        moved = 0
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                while True:
+                    async with db.execute(
+                        """
+                        SELECT m.id, c.vault_name, m.sources FROM chat_messages m JOIN chats c ON c.id = m.chat_id
+                        WHERE m.sources IS NOT NULL LIMIT ?
+                        """,
+                        (self.batch_size,)
+                    ) as cursor:
+                        rows = await cursor.fetchall()
+                    if not rows:
+                        break
+                    for message_id, vault_name, sources_json in rows:
+                        await self._migrate_message(db, message_id, vault_name, sources_json)
+                    await db.commit()
+                    moved += len(rows)
+                    # Give request handlers a turn between batches
+                    await asyncio.sleep(0)
+                # Messages of chats that no longer exist
+                await db.execute("UPDATE chat_messages SET sources = NULL WHERE sources IS NOT NULL")
+                await db.commit()
+                if moved:
+                    # The freed pages are reused by new rows; VACUUM (offline,
+                    # with the server stopped) returns them to the filesystem
+                    print(f"Moved the sources of {moved} message(s) to chunk references")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Message source migration stopped after {moved} message(s): {e}")
+
+    async def _migrate_message(self, db: aiosqlite.Connection, message_id: int, vault_name: str, sources_json: str):
+        try:
+            results = json.loads(sources_json) if sources_json else []
+        except ValueError:
+            results = []
+        ids = [
+            r.get("id") or make_chunk_id((r.get("metadata") or {}).get("source", ""), r.get("content", ""))
+            for r in results
+        ]
+        stored = await self.executors.run_cpu(self.vector_service.get_chunks, vault_name, ids) if ids else {}
+        # Keep the text of chunks the vault no longer has
+        snapshots = {chunk_id for chunk_id in ids if chunk_id not in stored}
+        await db.execute("DELETE FROM message_sources WHERE message_id = ?", (message_id,))
+        await self.save(db, message_id, [{**r, "id": chunk_id} for r, chunk_id in zip(results, ids)], snapshots)
+        await db.execute("UPDATE chat_messages SET sources = NULL WHERE id = ?", (message_id,))
@@ -0,0 +1,214 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds: from a cached lookup (~1 ms) to a long generation
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 100, 200)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: tuple, values: tuple, extra: tuple = ()) -> str:
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if labels.keys() != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self) -> list[str]:
+        return []
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_label_text(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        # Buckets are "less than or equal", so a value on a bound counts in it
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # [count per bucket (the last one is +Inf), sum, count]
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, math.inf), counts):
+                cumulative += bucket_count
+                le = (("le", _format_value(float(bound))),)
+                lines.append(f"{self.name}_bucket{_label_text(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_label_text(self.label_names, key)} {count}")
+        return lines
+
+
+class Gauge(_Metric):
+    '''Read when scraped: `collect` returns a number, or {label values: number} for labelled gauges.'''
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, collect, labels: tuple = ()):
+        super().__init__(name, help_text, labels)
+        self.collect = collect
+
+    def _samples(self) -> list[str]:
+        value = self.collect()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        return [
+            f"{self.name}{_label_text(self.label_names, key if isinstance(key, tuple) else (key,))} {_format_value(number)}"
+            for key, number in items if number is not None
+        ]
+
+
+class MetricsRegistry:
+    """
+    Counters, histograms and gauges rendered in the Prometheus text format
+    for GET /metrics.
+
+    Services that take a `metrics` registry create their metrics on it;
+    asking for a name twice returns the metric already registered.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help_text, labels, buckets)
+
+    def gauge(self, name: str, help_text: str, collect, labels: tuple = ()) -> Gauge:
+        return self._register(Gauge, name, help_text, collect, labels)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # One failing gauge shouldn't take the whole scrape down
+                print(f"Metric {metric.name} failed to render: {e}")
+        return "\n".join(lines) + "\n"
+
+
+class RequestTimer:
+    """
+    Durations of the stages of one request.
+
+    They are returned in a Server-Timing header (browser dev tools show it
+    per request) and, once the request finishes, recorded in `histogram`
+    labelled with the endpoint and stage. Stages that run concurrently can
+    add up to more than the total.
+    """
+
+    def __init__(self, endpoint: str, histogram: Histogram | None = None):
+        self.endpoint = endpoint
+        self.histogram = histogram
+        self.stages: dict[str, float] = {}
+        self._started = time.perf_counter()
+        self._finished = False
+
+    @contextmanager
+    def span(self, stage: str):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - began)
+
+    def add(self, stage: str, seconds: float | None):
+        if seconds is not None:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def as_dict(self) -> dict:
+        '''Milliseconds per stage, plus the total so far.'''
+        return {**{stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()},
+                "total": round(self.elapsed() * 1000, 1)}
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{stage};dur={ms}" for stage, ms in self.as_dict().items())
+
+    def finish(self):
+        '''Record the stages and the total in the histogram; only the first call counts.'''
+        if self._finished or self.histogram is None:
+            return
+        self._finished = True
+        for stage, seconds in self.stages.items():
+            self.histogram.observe(seconds, endpoint=self.endpoint, stage=stage)
+        self.histogram.observe(self.elapsed(), endpoint=self.endpoint, stage="total")
@@ -1,38 +1,335 @@
+import abc
+import math
+import string
+import threading
+import time
+from collections import deque
 import pdfplumber
+import pypdfium2
+from concurrent.futures import Executor
 from pathlib import Path
+from typing import Callable, Iterator
+
+# pdfium is not thread-safe; calls from one process are serialized
+_PDFIUM_LOCK= threading.Lock()
+
+_READABLE= set(string.punctuation)
+
+
+class PDFDocument(abc.ABC):
+    """
+    An open PDF read one page at a time by an extraction backend.
+
+    Backends subclass this and are registered in PDF_BACKENDS under their
+    name, which is what vaults, uploads and VAULT_PDF_BACKEND refer to.
+    """
+    name= ""
+
+    def __init__(self, file_path: str):
+        self.file_path= file_path
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        '''Number of pages.'''
+
+    @abc.abstractmethod
+    def page_text(self, index: int) -> str:
+        '''Text of the page at `index` (0-based).'''
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PdfiumDocument(PDFDocument):
+    '''Plain text straight from pdfium's text layer; no layout analysis, so several times faster than pdfplumber.'''
+    name= "pdfium"
+
+    def __init__(self, file_path: str):
+        super().__init__(file_path)
+        with _PDFIUM_LOCK:
+            self._pdf= pypdfium2.PdfDocument(file_path)
+
+    def __len__(self) -> int:
+        return len(self._pdf)
+
+    def page_text(self, index: int) -> str:
+        with _PDFIUM_LOCK:
+            page= self._pdf[index]
+            textpage= page.get_textpage()
+            try:
+                return textpage.get_text_range()
+            finally:
+                textpage.close()
+                page.close()
+
+    def close(self):
+        with _PDFIUM_LOCK:
+            self._pdf.close()
+
+
+class PdfplumberDocument(PDFDocument):
+    '''pdfplumber's layout-aware extraction: slower, but copes with some fonts pdfium reads as garbage.'''
+    name= "pdfplumber"
+
+    def __init__(self, file_path: str):
+        super().__init__(file_path)
+        self._pdf= pdfplumber.open(file_path)
+
+    def __len__(self) -> int:
+        return len(self._pdf.pages)
+
+    def page_text(self, index: int) -> str:
+        page= self._pdf.pages[index]
+        try:
+            return page.extract_text() or ""
+        finally:
+            # pdfplumber caches layout objects per page; drop them as we go
+            page.close()
+
+    def close(self):
+        self._pdf.close()
+
+
+PDF_BACKENDS: dict[str, type[PDFDocument]]= {
+    PdfiumDocument.name: PdfiumDocument,
+    PdfplumberDocument.name: PdfplumberDocument,
+}
+
+
+def looks_garbled(text: str) -> bool:
+    '''
+    Whether extracted text is empty or mostly not text. Fonts without a
+    usable encoding come out as replacement characters, symbols or private-use
+    code points instead of letters.
+    '''
+    chars= [c for c in text if not c.isspace()]
+    if not chars:
+        return True
+    readable= sum(1 for c in chars if c.isalnum() or c in _READABLE)
+    return readable / len(chars) < 0.5
+
+
+def _add_timing(timings: dict, backend: str, pages: int, seconds: float):
+    entry= timings.setdefault(backend, {"pages": 0, "seconds": 0.0})
+    entry["pages"]+= pages
+    entry["seconds"]= round(entry["seconds"] + seconds, 4)
+
+
+def merge_timings(total: dict, part: dict):
+    '''Add one page range's extraction timings into a file's.'''
+    for backend, entry in part.items():
+        if backend == "fallback_pages":
+            total["fallback_pages"]= total.get("fallback_pages", 0) + entry
+        else:
+            _add_timing(total, backend, entry["pages"], entry["seconds"])
+
+
+def iter_page_range(file_path: str, start: int, end: int, backend: str, fallback: str | None,
+                    timings: dict) -> Iterator[tuple[int, str]]:
+    '''
+    Yield (page_number, text) for pages [start, end) read with `backend`.
+    Pages it returns nothing or garbage for are read again with `fallback`
+    (opened only if needed). Time spent in each backend goes into `timings`.
+    '''
+    timings.setdefault("fallback_pages", 0)
+    primary= PDF_BACKENDS[backend](file_path)
+    secondary= None
+    try:
+        for i in range(start, end):
+            began= time.perf_counter()
+            text= primary.page_text(i)
+            _add_timing(timings, backend, 1, time.perf_counter() - began)
+            if fallback and looks_garbled(text):
+                if secondary is None:
+                    secondary= PDF_BACKENDS[fallback](file_path)
+                began= time.perf_counter()
+                retry= secondary.page_text(i)
+                _add_timing(timings, fallback, 1, time.perf_counter() - began)
+                timings["fallback_pages"]+= 1
+                if not looks_garbled(retry) or not text.strip():
+                    text= retry
+            '''we will add 1 in page number as it will start from 0, but we
+            as humans starts counting at 1.'''
+            yield i+1, text
+    finally:
+        primary.close()
+        if secondary is not None:
+            secondary.close()
+
+
+def extract_page_range(file_path: str, start: int, end: int, backend: str = PdfplumberDocument.name,
+                       fallback: str | None = None) -> tuple[list[tuple[int, str]], dict]:
+    '''Extract pages [start, end) of a PDF; returns (pages, timings). Module-level so a process pool can pickle it.'''
+    timings= {}
+    pages= list(iter_page_range(file_path, start, end, backend, fallback, timings))
+    return pages, timings
+
 
 class PDFProcessor:
-    def __init__(self, chunking_service):
+    def __init__(self, chunking_service, pages_per_task: int = 8, parallel_min_pages: int = 16,
+                 backend: str = PdfiumDocument.name, fallback_backend: str | None = PdfplumberDocument.name):
         self.chunking_service= chunking_service
-    def process_pdf(self, file_path: str, domain: str) -> list[dict]:
-        all_structured_chunks=[]
-        source_filename= Path(file_path).name
-
-        # We will now use "with" to ensure the PDF is closed correctly
-        with pdfplumber.open(file_path) as pdf:
-            for i, page in enumerate(pdf.pages):
-                '''we will add 1 in page number as it will start from 0, but we
-                as humans starts counting at 1.'''
-                page_number= i+1
-
-                #1. Extract the raw text from the 'page' object
-                raw_text= page.extract_text()
-                #Skip empty/image only pages
-                if not raw_text or not raw_text.strip():
-                    continue
-
-                # Here now we start chunking
-                chunks= self.chunking_service.create_chunks(raw_text)
-
-                for chunk_content in chunks:
-                    payload={
-                        "content":chunk_content,
-                        "metadata":{
-                            "source":source_filename,
-                            "page": page_number,
-                            "domain": domain
-                        }
+        # Page ranges handed to each worker process. Small enough to balance
+        # the load, big enough to amortise re-opening the PDF in every task.
+        self.pages_per_task= pages_per_task
+        # Below this, starting work in other processes costs more than it saves
+        self.parallel_min_pages= parallel_min_pages
+        # Default extractor, and the one that re-reads pages it gets nothing from
+        self.backend= self.check_backend(backend)
+        self.fallback_backend= self.check_backend(fallback_backend) if fallback_backend else None
+
+    @staticmethod
+    def check_backend(name: str) -> str:
+        if name not in PDF_BACKENDS:
+            raise ValueError(f"Unknown PDF backend {name!r} (available: {', '.join(PDF_BACKENDS)})")
+        return name
+
+    def iter_pages(self, file_path: str, progress_callback: Callable[[int, int], None] | None = None,
+                   executor: Executor | None = None, workers: int = 1, stats: dict | None = None,
+                   backend: str | None = None) -> Iterator[tuple[int, str]]:
+        '''
+        Yield (page_number, text) in page order, reading pages only as they are consumed.
+
+        With an executor (a ProcessPoolExecutor with `workers` processes), page
+        ranges are extracted in parallel, a few ranges ahead of the consumer.
+        Without one, or for short documents, pages are read one by one in this
+        process.
+
+        `backend` overrides the processor's default extractor. stats, if given,
+        receives the page count, throughput, backend and per-backend timings
+        once the last page has been yielded.
+        '''
+        started= time.perf_counter()
+        backend= self.check_backend(backend or self.backend)
+        fallback= self.fallback_backend if self.fallback_backend != backend else None
+        try:
+            with PDF_BACKENDS[backend](file_path) as pdf:
+                pages_total= len(pdf)
+        except Exception as e:
+            if fallback is None:
+                raise
+            print(f"{backend} could not open {Path(file_path).name} ({e}); using {fallback}")
+            backend, fallback= fallback, None
+            with PDF_BACKENDS[backend](file_path) as pdf:
+                pages_total= len(pdf)
+
+        timings= {}
+        if executor is None or workers < 2 or pages_total < self.parallel_min_pages:
+            mode= "sequential"
+            yield from self._iter_sequential(file_path, pages_total, backend, fallback, timings, progress_callback)
+        else:
+            mode= "parallel"
+            yield from self._iter_parallel(file_path, pages_total, backend, fallback, timings, executor, workers,
+                                           progress_callback)
+
+        elapsed= time.perf_counter() - started
+        pages_per_sec= round(pages_total / elapsed, 2) if elapsed > 0 else float(pages_total)
+        fallback_pages= timings.get("fallback_pages", 0)
+        print(f"Extracted {pages_total} pages from {Path(file_path).name} in {elapsed:.2f}s "
+              f"({pages_per_sec} pages/s, {mode}, {backend}"
+              + (f", {fallback_pages} page(s) re-read with {fallback})" if fallback_pages else ")"))
+        if stats is not None:
+            stats.update({"pages": pages_total, "seconds": round(elapsed, 3),
+                          "pages_per_sec": pages_per_sec, "mode": mode, "backend": backend, "timings": timings})
+
+    def extract_pages(self, file_path: str, progress_callback: Callable[[int, int], None] | None = None,
+                      executor: Executor | None = None, workers: int = 1, stats: dict | None = None,
+                      backend: str | None = None) -> list[tuple[int, str]]:
+        '''Return [(page_number, text), ...] in page order; see iter_pages.'''
+        return list(self.iter_pages(file_path, progress_callback, executor, workers, stats, backend))
+
+    def _iter_sequential(self, file_path, pages_total, backend, fallback, timings, progress_callback):
+        for page in iter_page_range(file_path, 0, pages_total, backend, fallback, timings):
+            if progress_callback:
+                progress_callback(page[0], pages_total)
+            yield page
+
+    def _iter_parallel(self, file_path, pages_total, backend, fallback, timings, executor, workers, progress_callback):
+        # Aim for a few ranges per worker so one slow range doesn't stall the rest
+        range_size= max(1, min(self.pages_per_task, math.ceil(pages_total / (workers * 2))))
+        starts= iter(range(0, pages_total, range_size))
+        window= deque()
+
+        def submit_next():
+            start= next(starts, None)
+            if start is not None:
+                window.append(executor.submit(
+                    extract_page_range, file_path, start, min(start + range_size, pages_total), backend, fallback
+                ))
+
+        # Only a couple of ranges per worker are in flight (and in memory) at
+        # once; the next one is submitted as the consumer takes a range
+        for _ in range(workers * 2):
+            submit_next()
+        parsed= 0
+        try:
+            # Collect in submission order, which is page order
+            while window:
+                range_pages, range_timings= window.popleft().result()
+                submit_next()
+                merge_timings(timings, range_timings)
+                parsed+= len(range_pages)
+                if progress_callback:
+                    progress_callback(parsed, pages_total)
+                yield from range_pages
+        finally:
+            for future in window:
+                future.cancel()
+
+    def iter_chunks(self, file_path: str, domain: str, progress_callback: Callable[[int, int], None] | None = None,
+                    executor: Executor | None = None, workers: int = 1, stats: dict | None = None,
+                    backend: str | None = None, source: str | None = None) -> Iterator[dict]:
+        '''
+        Yield {"content", "metadata"} chunks as pages are extracted, so a
+        document is never held in memory whole. `source` names the chunks'
+        file (default: the file's name on disk).
+        '''
+        source_filename= source or Path(file_path).name
+        pages= self.iter_pages(file_path, progress_callback, executor, workers, stats, backend)
+
+        if self.chunking_service.mode == "tokens":
+            # Chunks run across pages; "page" is where a chunk starts
+            for chunk in self.chunking_service.stream_chunks(pages):
+                yield {
+                    "content": chunk["content"],
+                    "metadata": {
+                        "source": source_filename,
+                        "page": chunk["page_start"],
+                        "page_end": chunk["page_end"],
+                        "domain": domain
+                    }
+                }
+            return
+
+        for page_number, raw_text in pages:
+            #Skip empty/image only pages
+            if not raw_text or not raw_text.strip():
+                continue
+
+            # Here now we start chunking
+            chunks= self.chunking_service.create_chunks(raw_text)
+
+            for chunk_content in chunks:
+                yield {
+                    "content":chunk_content,
+                    "metadata":{
+                        "source":source_filename,
+                        "page": page_number,
+                        "domain": domain
                     }
-                    all_structured_chunks.append(payload)
+                }
 
-        return  all_structured_chunks
\ No newline at end of file
+    def process_pdf(self, file_path: str, domain: str, progress_callback: Callable[[int, int], None] | None = None,
+                    executor: Executor | None = None, workers: int = 1, stats: dict | None = None,
+                    backend: str | None = None) -> list[dict]:
+        '''
+        All of a PDF's chunks as a list; see iter_chunks.
+        progress_callback, if given, is called with (pages_parsed, pages_total) as pages are extracted.
+        '''
+        return list(self.iter_chunks(file_path, domain, progress_callback, executor, workers, stats, backend))
@@ -0,0 +1,111 @@
+import asyncio
+import re
+
+import aiosqlite
+
+from app.services.llm_scheduler import PRIORITY_TITLE, SchedulerBusy
+
+TITLE_PENDING = "pending"
+TITLE_FINAL = "final"
+
+_WORD = re.compile(r"[\w'-]+", re.UNICODE)
+
+# Words that carry no topic on their own; dropped from extractive titles
+_STOPWORDS = {
+    "a", "about", "an", "and", "any", "are", "as", "at", "be", "can", "could", "do", "does", "for", "from",
+    "give", "how", "i", "in", "is", "it", "me", "my", "of", "on", "or", "please", "show", "tell", "that",
+    "the", "there", "this", "to", "was", "we", "what", "when", "where", "which", "who", "why", "will",
+    "with", "would", "you", "your", "explain", "describe", "list", "summarize", "summarise",
+}
+
+
+def extractive_title(query: str, max_words: int = 5, max_length: int = 50) -> str:
+    '''Cheap provisional title: the first few content words of the query.'''
+    words = [w for w in _WORD.findall(query) if w.lower() not in _STOPWORDS]
+    if not words:
+        return query[:30] + '...' if len(query) > 30 else query
+    title = " ".join(words[:max_words])
+    title = title[0].upper() + title[1:]
+    return title[:max_length]
+
+
+class TitleService:
+    """
+    Generates chat titles in the background.
+
+    New chats are created straight away with an extractive title and
+    title_status 'pending'. A single worker then asks the LLM for a proper
+    title at the scheduler's lowest priority, and only once no LLM request
+    has been queued or running for a moment, so titles never delay a user's
+    first answer. When it is done the chat row is updated and title_status
+    becomes 'final'.
+    """
+
+    def __init__(self, db_path: str, scheduler, idle_settle: float = 0.5):
+        self.db_path = db_path
+        self.scheduler = scheduler
+        self.idle_settle = idle_settle
+        self._queue: asyncio.Queue[tuple[int, str]] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        # Chats whose title was still pending when the server stopped
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                """
+                SELECT c.id, (SELECT content FROM chat_messages m WHERE m.chat_id = c.id AND m.role = 'user' ORDER BY m.id LIMIT 1)
+                FROM chats c WHERE c.title_status = ?
+                """,
+                (TITLE_PENDING,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            for chat_id, query in rows:
+                if query:
+                    self.enqueue(chat_id, query)
+            # No saved question to title them from (the first answer failed):
+            # their extractive title is as good as it gets
+            orphans = [(TITLE_FINAL, chat_id, TITLE_PENDING) for chat_id, query in rows if not query]
+            if orphans:
+                await db.executemany("UPDATE chats SET title_status = ? WHERE id = ? AND title_status = ?", orphans)
+                await db.commit()
+        self._task = asyncio.create_task(self._worker_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def enqueue(self, chat_id: int, query: str):
+        self._queue.put_nowait((chat_id, query))
+
+    async def _worker_loop(self):
+        while True:
+            chat_id, query = await self._queue.get()
+            try:
+                await self.scheduler.wait_idle(self.idle_settle)
+                title = (await self.scheduler.run("title", {"query": query}, priority=PRIORITY_TITLE)).strip()
+                async with aiosqlite.connect(self.db_path) as db:
+                    if title:
+                        await db.execute(
+                            "UPDATE chats SET title = ?, title_status = ? WHERE id = ? AND title_status = ?",
+                            (title, TITLE_FINAL, chat_id, TITLE_PENDING)
+                        )
+                    else:
+                        # Keep the extractive title
+                        await db.execute(
+                            "UPDATE chats SET title_status = ? WHERE id = ? AND title_status = ?",
+                            (TITLE_FINAL, chat_id, TITLE_PENDING)
+                        )
+                    await db.commit()
+            except asyncio.CancelledError:
+                raise
+            except SchedulerBusy as e:
+                # Answers are keeping the model busy; try again later
+                await asyncio.sleep(e.retry_after)
+                self.enqueue(chat_id, query)
+            except Exception as e:
+                print(f"Title generation for chat {chat_id} failed: {e}")
@@ -1,10 +1,54 @@
 import chromadb
+import hashlib
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable
 from chromadb.utils import embedding_functions
+from app.services.cache_service import LRUCache, normalize_query
+
+
+def make_chunk_id(source: str, content: str) -> str:
+    '''Content-derived chunk ID, stable across re-uploads of the same file.'''
+    digest= hashlib.sha256(f"{source}\0{content}".encode("utf-8")).hexdigest()[:32]
+    return f"{source}_{digest}"
+
+
+def assign_chunk_ids(processed_chunks: list[dict], seen: dict[str, int] | None = None) -> list[str]:
+    '''
+    IDs for a file's chunks; repeated identical chunks get an occurrence suffix.
+    Pass the same `seen` dict for each batch of a file read in batches.
+    '''
+    ids= []
+    seen= {} if seen is None else seen
+    for chunk in processed_chunks:
+        chunk_id= make_chunk_id(chunk["metadata"]["source"], chunk["content"])
+        occurrence= seen.get(chunk_id, 0)
+        seen[chunk_id]= occurrence + 1
+        ids.append(chunk_id if occurrence == 0 else f"{chunk_id}_{occurrence}")
+    return ids
+
+
+def _add_seconds(timings: dict | None, stage: str, began: float):
+    if timings is not None:
+        timings[stage]= timings.get(stage, 0.0) + time.perf_counter() - began
+
+SEARCH_MODES= ("vector", "lexical", "hybrid")
+
+# Share of the query's terms a chunk needs in lexical-only search, which has
+# no vector score to weed out chunks that share a single word with the query
+LEXICAL_MIN_TERM_SHARE= 0.5
+
+# Reciprocal rank fusion constant; 60 is the usual choice from the RRF paper
+RRF_K= 60
+
 
 class VectorDBService:
-    def __init__(self, db_path:str= "data/chroma_db"):
+    def __init__(self, db_path:str= "data/chroma_db", model_name: str= "all-MiniLM-L6-v2", embedding_cache=None,
+                 query_cache_size: int= 1024, result_cache_size: int= 2048, lexical_index=None,
+                 search_mode: str= "vector", version_store=None, source_archive=None):
         self.db_path= Path(db_path)
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -13,7 +57,37 @@ class VectorDBService:
 
         # Initializing the Embedding Function(This will translate)
         # We will be using a model that is small, fast and great for our use
-        self.emb_fn= embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
+        self.model_name= model_name
+        self.emb_fn= embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_name)
+
+        # Optional EmbeddingCache; when set, chunks are only embedded on a cache miss
+        self.embedding_cache= embedding_cache
+
+        # Repeated questions skip the sentence-transformer, and repeated
+        # (vault, query, n_results) lookups skip Chroma entirely. Result keys
+        # carry a per-vault generation that is bumped whenever the vault
+        # changes, so stale entries are never returned and simply age out.
+        self.query_embedding_cache= LRUCache(max_size=query_cache_size)
+        self.result_cache= LRUCache(max_size=result_cache_size)
+        self._vault_generations: dict[str, int]= {}
+        self._generation_lock= threading.Lock()
+        # Optional persistent per-vault version counter (e.g. the AnswerCache),
+        # bumped together with the in-memory generation
+        self.version_store= version_store
+        # Optional store of chat message sources (MessageSourceStore); chunks
+        # that messages cite get their text copied there before they are deleted
+        self.source_archive= source_archive
+
+        # Optional LexicalIndex (SQLite FTS5) kept in sync with every write.
+        # "hybrid" runs keyword and vector search side by side and fuses the
+        # rankings; until the embedding model has answered once, hybrid
+        # searches fall back to the lexical index alone.
+        self.lexical_index= lexical_index
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {search_mode!r}, expected one of {SEARCH_MODES}")
+        self.search_mode= search_mode if lexical_index is not None else "vector"
+        self._embedder_ready= threading.Event()
+        self._search_pool= ThreadPoolExecutor(max_workers=4, thread_name_prefix="vault-search")
 
     def get_or_create_vault(self, vault_name:str):
         ''' We pass our embedding function here os Chroma handles
@@ -29,68 +103,378 @@ class VectorDBService:
             print(f"Deleted vector collection for vault: {vault_name}")
         except Exception as e:
             print(f"Error deleting collection {vault_name}: {e}")
-    def add_to_vault(self, vault_name:str, processed_chunks: list[dict]):
-        collection= self.get_or_create_vault(vault_name)
-        # Before adding, we find and delete everything from this specific file.
-        # This prevents "ghost chunks" from old versions.
-        source_file = processed_chunks[0]["metadata"]["source"]
+        finally:
+            if self.lexical_index is not None:
+                self.lexical_index.delete_vault(vault_name)
+            self.invalidate_vault(vault_name)
 
-        # We use a 'where' filter to target only the chunks from this file
-        collection.delete(where={"source": source_file})
-        print(f"Deleted existing entries for: {source_file}")
-
-        ids=[]
-        documents=[]
-        metadatas=[]
-
-        for i, chunk in enumerate(processed_chunks):
-            '''We will set the ID as source_filename + chunk index (e.g, manual.pdf_0)'''
-            file_name= chunk["metadata"]["source"]
-            unique_id= f"{file_name}_chunk_{i}"
-            ids.append(unique_id)
-            documents.append(chunk["content"])
-            metadatas.append(chunk["metadata"])
-
-        #Now we batch everything together and add it to the vault in one call
-        collection.add(
-            ids= ids,
-            documents= documents,
-            metadatas= metadatas
-        )
-        print(f"SSuccessfully added {len(documents)} chunks to vault: {vault_name}")
+    def invalidate_vault(self, vault_name: str):
+        '''Forget cached search results for a vault after its contents change.'''
+        with self._generation_lock:
+            self._vault_generations[vault_name]= self._vault_generations.get(vault_name, 0) + 1
+        if self.version_store is not None:
+            self.version_store.bump_vault(vault_name)
+
+    def _vault_generation(self, vault_name: str) -> int:
+        with self._generation_lock:
+            return self._vault_generations.get(vault_name, 0)
 
-    def search_vault(self, vault_name:str, query_text:str, n_results: int=5):
+    def embed_query(self, query_text: str) -> list[float]:
+        # Whitespace doesn't change the embedding, so it is safe to fold it
+        key= (self.model_name, " ".join(query_text.split()))
+        embedding= self.query_embedding_cache.get(key)
+        if embedding is None:
+            embedding= [float(x) for x in self.emb_fn([query_text])[0]]
+            self._embedder_ready.set()
+            self.query_embedding_cache.put(key, embedding)
+        return embedding
+
+    def warm_up(self):
+        '''Load the embedding model ahead of the first query.'''
         try:
-            # Access the specific vault
-            collection= self.get_or_create_vault(vault_name)
+            self.emb_fn(["warm up"])
+            self._embedder_ready.set()
+        except Exception as e:
+            print(f"Embedding model warm-up failed: {e}")
+
+    def cache_stats(self) -> dict:
+        stats= {
+            "query_embeddings": self.query_embedding_cache.stats(),
+            "retrieval_results": self.result_cache.stats(),
+        }
+        if self.embedding_cache is not None:
+            stats["chunk_embeddings"]= self.embedding_cache.stats()
+        return stats
+
+    def embed_documents(self, texts: list[str]) -> list:
+        '''Embed texts, reusing cached vectors for any chunk that was embedded before.'''
+        if self.embedding_cache is None:
+            vectors= list(self.emb_fn(texts))
+            self._embedder_ready.set()
+            return vectors
+
+        vectors= self.embedding_cache.get_many(self.model_name, texts)
+        missing= [i for i in range(len(texts)) if i not in vectors]
+        if missing:
+            new_vectors= self.emb_fn([texts[i] for i in missing])
+            self._embedder_ready.set()
+            self.embedding_cache.put_many(self.model_name, [texts[i] for i in missing], new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i]= vector
+        return [vectors[i] for i in range(len(texts))]
+
+    def _archive_cited(self, vault_name: str, collection, ids: list[str]):
+        '''Copy the text of chunks that chat messages cite to source_archive, before they are deleted.'''
+        if self.source_archive is None or not ids:
+            return
+        cited= self.source_archive.cited_chunks(vault_name, ids)
+        if cited:
+            stored= collection.get(ids= list(cited), include=["documents"])
+            self.source_archive.snapshot_chunks(vault_name, dict(zip(stored["ids"], stored["documents"])))
+
+    def delete_source(self, vault_name: str, source_file: str, batch_size: int = 256):
+        '''Remove every chunk that came from one file.'''
+        collection= self.get_or_create_vault(vault_name)
+        if self.source_archive is not None:
+            ids= collection.get(where={"source": source_file}, include=[])["ids"]
+            for start in range(0, len(ids), batch_size):
+                self._archive_cited(vault_name, collection, ids[start:start+batch_size])
+        collection.delete(where={"source": source_file})
+        if self.lexical_index is not None:
+            self.lexical_index.delete_source(vault_name, source_file)
+        self.invalidate_vault(vault_name)
+
+    def add_to_vault(self, vault_name:str, processed_chunks: list[dict], batch_size: int = 256,
+                     progress_callback: Callable[[int, int], None] | None = None) -> dict:
+        '''
+        Sync one file's chunks into the vault and return {"added", "removed", "kept", "updated"}.
+
+        Chunk IDs are derived from the content, so re-ingesting a revised
+        file only embeds chunks that are new, deletes the ones that are gone,
+        and leaves unchanged chunks alone (a chunk that only moved to another
+        page just gets its metadata updated).
+        '''
+        if not processed_chunks:
+            return {"added": 0, "removed": 0, "kept": 0, "updated": 0}
+        sync= self.begin_sync(vault_name, processed_chunks[0]["metadata"]["source"])
+        total= len(processed_chunks)
+
+        # Add in batches so large files stay under Chroma's batch limit and
+        # callers can report embedding progress
+        for start in range(0, total, batch_size):
+            batch= processed_chunks[start:start+batch_size]
+            ids, documents, metadatas= self.plan_batch(sync, batch)
+            if ids:
+                self.write_chunks(vault_name, ids, documents, metadatas, self.embed_documents(documents))
+            if progress_callback:
+                progress_callback(start + len(batch), total)
+
+        return self.finish_sync(vault_name, sync)
 
-            #Perform the semantic search
-            results= collection.query(
-                query_texts=[query_text],
-                n_results=n_results
+    def begin_sync(self, vault_name: str, source_file: str) -> dict:
+        '''
+        Start syncing one file's chunks into the vault, batch by batch (see
+        plan_batch), then finish_sync. Only chunk IDs (and metadata of moved
+        chunks) are kept between batches, so memory use doesn't grow with the
+        text of the document.
+        '''
+        collection= self.get_or_create_vault(vault_name)
+        # What this file currently has in the vault (IDs + metadata only, no vectors)
+        existing= collection.get(where={"source": source_file}, include=["metadatas"])
+        return {
+            "source": source_file,
+            # Chunks in the vault not yet seen in the new version; what's left at the end is deleted
+            "unseen": dict(zip(existing["ids"], existing["metadatas"])),
+            # Base chunk ID -> times seen, for the suffixes of repeated chunks
+            "occurrences": {},
+            "to_update": {},
+            # IDs of the new chunks, so an abandoned sync can take them out again
+            "written": [],
+            "added": 0,
+            "kept": 0,
+        }
+
+    def plan_batch(self, sync: dict, chunks: list[dict]) -> tuple[list[str], list[str], list[dict]]:
+        '''
+        Classify the next chunks of a file being synced. Returns (ids,
+        documents, metadatas) of the ones to embed and write; unchanged chunks
+        are kept, and ones that only moved get their metadata updated by
+        finish_sync.
+        '''
+        ids, documents, metadatas= [], [], []
+        for chunk, chunk_id in zip(chunks, assign_chunk_ids(chunks, sync["occurrences"])):
+            metadata= chunk["metadata"]
+            if chunk_id in sync["unseen"]:
+                if sync["unseen"].pop(chunk_id) != metadata:
+                    sync["to_update"][chunk_id]= metadata
+                sync["kept"]+= 1
+            else:
+                ids.append(chunk_id)
+                documents.append(chunk["content"])
+                metadatas.append(metadata)
+        sync["written"].extend(ids)
+        sync["added"]+= len(ids)
+        return ids, documents, metadatas
+
+    def write_chunks(self, vault_name: str, ids: list[str], documents: list[str], metadatas: list[dict], embeddings):
+        '''
+        Store one batch of already-embedded chunks in Chroma and the lexical
+        index. Cached results aren't invalidated per batch; finish_sync (or
+        abandon_sync) does it once per file.
+        '''
+        collection= self.get_or_create_vault(vault_name)
+        # Keep every call under Chroma's batch limit
+        step= self.client.get_max_batch_size()
+        for start in range(0, len(ids), step):
+            collection.upsert(
+                ids= ids[start:start+step],
+                documents= documents[start:start+step],
+                metadatas= metadatas[start:start+step],
+                # Precomputed so Chroma doesn't re-embed chunks we already know
+                embeddings= embeddings[start:start+step]
             )
-            # We have to turn nested list into a clean list of dicts
-            formatted_results=[]
-            # results['documents'][0] contains the text
-            # results['metadatas'][0] contains the source/page
-            # results['distances'][0] is the "distance" (lower = more similar)
-            list_of_docs= results['documents'][0]
-            list_of_metadatas= results['metadatas'][0]
-            list_of_dists= results['distances'][0]
-            if not results['documents'] or not results['documents'][0]:
-                return []
-            for doc, meta, dist in zip(list_of_docs, list_of_metadatas, list_of_dists):
-                # In Chroma with l2 distance, lower is better. 0 is exact match.
-                # > 1.2 is usually weakly related. We drop them.
-                if dist > 1.2:
-                    continue
-                formatted_results.append({
-                    "content": doc,
-                    "metadata": meta,
-                    "score": round(1-dist,4)
-                })
-            return formatted_results
+        if self.lexical_index is not None:
+            self.lexical_index.upsert_chunks(vault_name, ids, documents, metadatas)
+
+    def finish_sync(self, vault_name: str, sync: dict, batch_size: int = 256) -> dict:
+        '''Apply a sync's metadata updates and deletions once its new chunks are written.'''
+        collection= self.get_or_create_vault(vault_name)
+        to_update= list(sync["to_update"].items())
+        to_delete= list(sync["unseen"])
+        for start in range(0, len(to_update), batch_size):
+            update_ids= [chunk_id for chunk_id, _ in to_update[start:start+batch_size]]
+            update_metadatas= [metadata for _, metadata in to_update[start:start+batch_size]]
+            collection.update(ids= update_ids, metadatas= update_metadatas)
+            if self.lexical_index is not None:
+                self.lexical_index.update_metadata(vault_name, update_ids, update_metadatas)
+        # Old chunks go last, so the file is never missing from search mid-update
+        for start in range(0, len(to_delete), batch_size):
+            self._archive_cited(vault_name, collection, to_delete[start:start+batch_size])
+            collection.delete(ids= to_delete[start:start+batch_size])
+            if self.lexical_index is not None:
+                self.lexical_index.delete_ids(vault_name, to_delete[start:start+batch_size])
+        self.invalidate_vault(vault_name)
+
+        stats= {"added": sync["added"], "removed": len(to_delete), "kept": sync["kept"], "updated": len(to_update)}
+        print(f"Synced {sync['source']} into vault {vault_name}: {stats}")
+        return stats
+
+    def abandon_sync(self, vault_name: str, sync: dict, batch_size: int = 256):
+        '''
+        Undo an unfinished sync: delete the new chunks it already wrote, so
+        the file's previous version is left in the vault as it was.
+        '''
+        collection= self.get_or_create_vault(vault_name)
+        written= sync["written"]
+        for start in range(0, len(written), batch_size):
+            collection.delete(ids= written[start:start+batch_size])
+            if self.lexical_index is not None:
+                self.lexical_index.delete_ids(vault_name, written[start:start+batch_size])
+        self.invalidate_vault(vault_name)
+        print(f"Abandoned sync of {sync['source']} in vault {vault_name}: removed {len(written)} new chunks")
+
+    def rebuild_lexical_index(self, vault_name: str, page_size: int = 1000):
+        '''Copy a vault's chunks from Chroma into the lexical index (for vaults created before it existed).'''
+        if self.lexical_index is None:
+            return
+        collection= self.get_or_create_vault(vault_name)
+        offset= 0
+        while True:
+            page= collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            self.lexical_index.upsert_chunks(vault_name, page["ids"], page["documents"], page["metadatas"])
+            offset+= len(page["ids"])
+        print(f"Rebuilt lexical index for vault {vault_name}: {offset} chunks")
+
+    def backfill_lexical_index(self):
+        '''
+        Index the chunks of vaults created before the lexical index existed.
+        Run once in the background at startup; until it reaches a vault, that
+        vault's keyword search finds nothing and hybrid search is vector-only.
+        '''
+        if self.lexical_index is None:
+            return
+        try:
+            for collection in self.client.list_collections():
+                # Chroma < 0.6 lists names, later versions Collection objects
+                vault_name= getattr(collection, "name", collection)
+                if not self.lexical_index.has_chunks(vault_name) and self.get_or_create_vault(vault_name).count() > 0:
+                    self.rebuild_lexical_index(vault_name)
+        except Exception as e:
+            print(f"Lexical index backfill failed: {e}")
+
+    def search_vault(self, vault_name:str, query_text:str, n_results: int=5, mode: str | None= None,
+                     timings: dict | None= None):
+        '''
+        mode is "vector", "lexical" or "hybrid" (defaults to the service's search_mode);
+        each result's "search_mode" says which one ran, since scores differ by mode.
+        Seconds spent embedding the query, in Chroma, in the keyword index and
+        fusing go into `timings` ("embed", "vector", "lexical", "fuse").
+        '''
+        mode= mode or self.search_mode
+        if mode != "vector" and self.lexical_index is None:
+            mode= "vector"
+        if mode == "hybrid" and not self._embedder_ready.is_set():
+            # Cold embedding model: answer from the keyword index right away
+            # and load the model in the background for the next query
+            mode= "lexical"
+            self._search_pool.submit(self.warm_up)
+
+        cache_key= (vault_name, self._vault_generation(vault_name), normalize_query(query_text), n_results, mode)
+        cached= self.result_cache.get(cache_key)
+        if cached is not None:
+            # Hand out copies so callers can't modify the cached entry
+            return [{**r, "metadata": dict(r["metadata"])} for r in cached]
+
+        try:
+            if mode == "vector":
+                formatted_results= self._vector_search(vault_name, query_text, n_results, timings)
+            elif mode == "lexical":
+                formatted_results= self._lexical_search(vault_name, query_text, n_results, timings,
+                                                        min_term_share= LEXICAL_MIN_TERM_SHARE)
+            else:
+                # Twice as many candidates from each side gives the fusion room to re-rank
+                lexical_future= self._search_pool.submit(self._lexical_search, vault_name, query_text, n_results * 2, timings)
+                vector_results= self._vector_search(vault_name, query_text, n_results * 2, timings)
+                lexical_results= lexical_future.result()
+                began= time.perf_counter()
+                formatted_results= fuse_rankings(vector_results, lexical_results, n_results)
+                _add_seconds(timings, "fuse", began)
+            for result in formatted_results:
+                result["search_mode"]= mode
+
+            self.result_cache.put(cache_key, formatted_results)
+            return [{**r, "metadata": dict(r["metadata"])} for r in formatted_results]
 
         except Exception as e:
             print(f"Search failed:{e}")
             return[]
+
+    def _lexical_search(self, vault_name: str, query_text: str, n_results: int, timings: dict | None= None,
+                        min_term_share: float= 0.0) -> list[dict]:
+        began= time.perf_counter()
+        results= self.lexical_index.search(vault_name, query_text, n_results, min_term_share)
+        _add_seconds(timings, "lexical", began)
+        return results
+
+    def get_chunks(self, vault_name: str, ids: list[str]) -> dict[str, dict]:
+        '''Text and metadata of stored chunks by ID; IDs no longer in the vault are left out.'''
+        ids= list(dict.fromkeys(ids))
+        found= self.lexical_index.get_chunks(vault_name, ids) if self.lexical_index is not None else {}
+        missing= [i for i in ids if i not in found]
+        if missing:
+            try:
+                collection= self.client.get_collection(name=vault_name, embedding_function=self.emb_fn)
+            except Exception:
+                return found
+            results= collection.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, doc, meta in zip(results["ids"], results["documents"], results["metadatas"]):
+                found[chunk_id]= {"content": doc, "metadata": meta}
+        return found
+
+    def _vector_search(self, vault_name: str, query_text: str, n_results: int, timings: dict | None= None) -> list[dict]:
+        began= time.perf_counter()
+        query_embedding= self.embed_query(query_text)
+        _add_seconds(timings, "embed", began)
+
+        # Access the specific vault
+        began= time.perf_counter()
+        collection= self.get_or_create_vault(vault_name)
+
+        #Perform the semantic search
+        results= collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results
+        )
+        _add_seconds(timings, "vector", began)
+        # We have to turn nested list into a clean list of dicts
+        formatted_results=[]
+        # results['documents'][0] contains the text
+        # results['metadatas'][0] contains the source/page
+        # results['distances'][0] is the "distance" (lower = more similar)
+        if not results['documents'] or not results['documents'][0]:
+            return []
+        list_of_docs= results['documents'][0]
+        list_of_metadatas= results['metadatas'][0]
+        list_of_dists= results['distances'][0]
+        list_of_ids= results['ids'][0]
+        for chunk_id, doc, meta, dist in zip(list_of_ids, list_of_docs, list_of_metadatas, list_of_dists):
+            # In Chroma with l2 distance, lower is better. 0 is exact match.
+            # > 1.2 is usually weakly related. We drop them.
+            if dist > 1.2:
+                continue
+            formatted_results.append({
+                "id": chunk_id,
+                "content": doc,
+                "metadata": meta,
+                "score": round(1-dist,4)
+            })
+        return formatted_results
+
+
+def fuse_rankings(vector_results: list[dict], lexical_results: list[dict], n_results: int) -> list[dict]:
+    '''
+    Reciprocal rank fusion of the two result lists.
+
+    Each chunk scores sum(1 / (RRF_K + rank)) over the lists it appears in.
+    The score is scaled so a chunk ranked first by both searches gets 1.0.
+    vector_score / lexical_score keep the raw per-search scores.
+    '''
+    fused: dict[str, dict]= {}
+    for kind, results in (("vector", vector_results), ("lexical", lexical_results)):
+        for rank, result in enumerate(results, start=1):
+            entry= fused.setdefault(result["id"], {
+                "id": result["id"],
+                "content": result["content"],
+                "metadata": result["metadata"],
+                "rrf": 0.0,
+            })
+            entry["rrf"]+= 1.0 / (RRF_K + rank)
+            entry[f"{kind}_score"]= result["score"]
+
+    best_possible= 2.0 / (RRF_K + 1)
+    ranked= sorted(fused.values(), key=lambda r: r["rrf"], reverse=True)[:n_results]
+    for entry in ranked:
+        entry["score"]= round(entry.pop("rrf") / best_possible, 4)
+    return ranked
@@ -0,0 +1,21 @@
+import os
+import sys
+
+
+def rss_mb() -> float | None:
+    '''Resident memory of this process in MB, or None where it can't be read cheaply.'''
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return None
+    # No cheap current figure outside Linux; ru_maxrss is the peak so far
+    # (kilobytes on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 1024), 1)
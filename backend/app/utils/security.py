@@ -4,6 +4,9 @@ from datetime import datetime, timedelta, timezone
 from typing import Optional
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
+import aiosqlite
+from app import config
+from app.database import get_db
 
 SECRET_KEY = "vault_ai_super_secret_dev_key"
 ALGORITHM = "HS256"
@@ -44,3 +47,11 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
     
     return int(user_id)
+
+async def require_admin(current_user_id: int = Depends(get_current_user), db: aiosqlite.Connection = Depends(get_db)):
+    # users.role is a self-service job title, so admins are listed in config instead
+    async with db.execute("SELECT username FROM users WHERE id = ?", (current_user_id,)) as cursor:
+        row = await cursor.fetchone()
+    if row is None or row[0] not in config.ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user_id
@@ -0,0 +1,118 @@
+"""
+End-to-end /chat/query latency against the deterministic stub LLM
+Run with: python -m benchmarks.bench_chat [requests]
+
+The real app (search, context packing, answer cache, SQLite, the LLM worker
+process) is driven through TestClient with StubLLMService loaded in the
+worker. The app keeps its databases next to its package and under the
+working directory, so it runs from a throwaway copy in a temp directory and
+nothing under backend/ is touched.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.common import BACKEND_DIR, percentiles, rate
+from benchmarks.synthetic import make_pages, make_pdf, make_queries
+
+VAULT = "benchmark"
+
+
+def run(requests: int = 50, pages: int = 40, workdir: str | None = None, timeout: float = 1800) -> dict:
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        shutil.copytree(BACKEND_DIR / "app", Path(tmp) / "app", ignore=shutil.ignore_patterns("__pycache__"))
+        # The copy shadows backend/app (cwd comes first on sys.path); benchmarks/ still comes from backend/
+        python_path = [str(BACKEND_DIR)] + [p for p in os.environ.get("PYTHONPATH", "").split(os.pathsep) if p]
+        env = {**os.environ, "PYTHONPATH": os.pathsep.join(python_path),
+               "VAULT_LLM_SERVICE": "benchmarks.stub_llm:StubLLMService"}
+        child = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_chat", "--child", str(requests), str(pages)],
+            cwd=tmp, env=env, capture_output=True, text=True, timeout=timeout
+        )
+        if child.returncode != 0:
+            raise RuntimeError(f"Chat benchmark failed:\n{child.stderr[-4000:]}")
+        return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+def _wait_for_job(client, headers, job_id: int, timeout: float = 600) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/jobs/{job_id}", headers=headers).json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.2)
+    raise TimeoutError(f"Ingestion job {job_id} did not finish")
+
+
+def _timed_post(client, path: str, body: dict, headers: dict) -> tuple[float, dict]:
+    started = time.perf_counter()
+    response = client.post(path, json=body, headers=headers)
+    elapsed = (time.perf_counter() - started) * 1000
+    response.raise_for_status()
+    return elapsed, response.json()
+
+
+def _child(requests: int, pages: int):
+    '''Runs inside the app copy; prints the result as the last line of stdout.'''
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    make_pdf("benchmark.pdf", make_pages(pages))
+    result = {"requests": requests, "pages": pages}
+    with TestClient(app) as client:
+        token = client.post("/auth/register", json={"username": "benchmark", "password": "benchmark"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        client.post("/vaults", json={"vault_name": VAULT, "user_id": 0}, headers=headers)
+
+        started = time.perf_counter()
+        with open("benchmark.pdf", "rb") as f:
+            job_id = client.post("/upload", data={"domain": VAULT}, files={"file": ("benchmark.pdf", f, "application/pdf")},
+                                 headers=headers).json()["job_id"]
+        job = _wait_for_job(client, headers, job_id)
+        seconds = time.perf_counter() - started
+        if job["status"] != "completed":
+            raise RuntimeError(f"Ingestion failed: {job['error']}")
+        result["upload"] = {"seconds": round(seconds, 3), "chunks": job["chunks_total"],
+                            "pages_per_sec": rate(pages, seconds), "peak_rss_mb": job["peak_rss_mb"]}
+
+        # Loads the stub in the LLM worker and the embedding model
+        _timed_post(client, "/chat/query", {"query": "warm up", "vault_name": VAULT}, headers)
+
+        questions = make_queries(requests)
+        misses, hits = [], []
+        for question in questions:
+            elapsed, _ = _timed_post(client, "/chat/query", {"query": question, "vault_name": VAULT}, headers)
+            misses.append(elapsed)
+        # Same questions, same vault: served from the answer cache
+        for question in questions:
+            elapsed, _ = _timed_post(client, "/chat/query", {"query": question, "vault_name": VAULT}, headers)
+            hits.append(elapsed)
+        result["query_uncached"] = percentiles(misses)
+        result["query_cached"] = percentiles(hits)
+
+        # A follow-up in one chat, so chat history is read and written every turn
+        chat_id, follow_ups = None, []
+        for question in make_queries(requests, seed=17):
+            body = {"query": question, "vault_name": VAULT, "chat_id": chat_id}
+            elapsed, answer = _timed_post(client, "/chat/query", body, headers)
+            chat_id = answer.get("chat_id", chat_id)
+            follow_ups.append(elapsed)
+        result["query_follow_up"] = percentiles(follow_ups)
+    print(json.dumps(result))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        _child(int(sys.argv[2]), int(sys.argv[3]))
+        return
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print(json.dumps(run(requests), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark: character chunking (per page) vs token chunking (streamed)
+Run with: python -m benchmarks.bench_chunking [pages]
+"""
+import sys
+import time
+
+from app.services.chunking_service import ChunkingService, embedding_token_counter, estimate_word_tokens
+from benchmarks.common import rate
+from benchmarks.synthetic import make_pages
+
+
+def measure(run, pages, count_tokens, repeat=3) -> dict:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = run(pages)
+        best = min(best, time.perf_counter() - started)
+    tokens = [sum(count_tokens(w) for w in c.split()) for c in chunks]
+    return {
+        "chunks": len(chunks),
+        "seconds": round(best, 4),
+        "chunks_per_sec": rate(len(chunks), best),
+        "avg_tokens": round(sum(tokens) / len(tokens), 1),
+        "max_tokens": max(tokens),
+        "chunks_under_50_tokens": sum(1 for t in tokens if t < 50),
+        "embedded_tokens": sum(tokens),
+    }
+
+
+def run(page_count: int = 500, count_tokens=None) -> dict:
+    '''Chunk the same synthetic pages both ways; returns {"chars": {...}, "tokens": {...}}.'''
+    pages = make_pages(page_count)
+    if count_tokens is None:
+        count_tokens = embedding_token_counter() or estimate_word_tokens
+
+    char_service = ChunkingService(chunk_size=800, chunk_overlap=150)
+
+    def run_chars(ps):
+        return [c for _, text in ps if text.strip() for c in char_service.create_chunks(text)]
+
+    def run_tokens(ps):
+        # A fresh service each run, so the word-count cache starts cold
+        service = ChunkingService(mode="tokens", chunk_tokens=200, overlap_tokens=40, count_tokens=count_tokens)
+        return [c["content"] for c in service.stream_chunks(iter(ps))]
+
+    return {
+        "pages": page_count,
+        "text_mb": round(sum(len(text) for _, text in pages) / 1e6, 2),
+        "token_counter": "tokenizer" if count_tokens is not estimate_word_tokens else "estimate",
+        "chars": measure(run_chars, pages, count_tokens),
+        "tokens": measure(run_tokens, pages, count_tokens),
+    }
+
+
+def main():
+    page_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    result = run(page_count)
+    print("=" * 60)
+    print(f"Chunking {page_count} pages ({result['text_mb']:.2f} MB of text)")
+    print("=" * 60)
+    print(f"Token counts from: {result['token_counter']}\n")
+    for label, key in (("chars, per page (800/150)", "chars"), ("tokens, streamed (200/40)", "tokens")):
+        r = result[key]
+        print(f"  {label:<28} {r['chunks']:>6} chunks  {r['chunks_per_sec']:>10.0f} chunks/s  "
+              f"{r['seconds'] * 1000:>8.1f} ms  avg {r['avg_tokens']:>5.0f} tok  max {r['max_tokens']:>4} tok  "
+              f"<50 tok: {r['chunks_under_50_tokens']:>5}  embedded: {r['embedded_tokens']} tok")
+
+
+if __name__ == "__main__":
+    main()
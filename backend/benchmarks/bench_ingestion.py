@@ -0,0 +1,69 @@
+"""
+Ingestion throughput: process_pdf (per PDF backend), create_chunks and add_to_vault
+Run with: python -m benchmarks.bench_ingestion [pages]
+"""
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+from app.services.chunking_service import ChunkingService
+from app.services.lexical_index_service import LexicalIndex
+from app.services.pdf_service import PDF_BACKENDS, PDFProcessor
+from app.services.vector_db_service import VectorDBService
+from benchmarks.common import rate, timed
+from benchmarks.synthetic import make_pages, make_pdf
+
+
+def run(page_count: int = 200, workdir: str | None = None) -> dict:
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        tmp = Path(tmp)
+        pdf_path = tmp / "synthetic.pdf"
+        make_pdf(str(pdf_path), make_pages(page_count))
+        chunker = ChunkingService(chunk_size=800, chunk_overlap=150)
+        result = {"pages": page_count, "pdf_mb": round(pdf_path.stat().st_size / 1e6, 2), "process_pdf": {}}
+
+        # Parse + chunk, once per extractor (no fallback, so each is timed alone)
+        chunks = None
+        for backend in PDF_BACKENDS:
+            processor = PDFProcessor(chunker, backend=backend, fallback_backend=None)
+            entry = {}
+            with timed(entry):
+                chunks = processor.process_pdf(str(pdf_path), "benchmark")
+            entry.update({"chunks": len(chunks), "pages_per_sec": rate(page_count, entry["seconds"]),
+                          "chunks_per_sec": rate(len(chunks), entry["seconds"])})
+            result["process_pdf"][backend] = entry
+
+        pages = PDFProcessor(chunker).extract_pages(str(pdf_path))
+        entry = {}
+        with timed(entry):
+            count = sum(len(chunker.create_chunks(text)) for _, text in pages if text.strip())
+        entry.update({"chunks": count, "chunks_per_sec": rate(count, entry["seconds"])})
+        result["create_chunks"] = entry
+
+        # Into an empty vault: every chunk is embedded and written
+        service = VectorDBService(db_path=str(tmp / "chroma"), lexical_index=LexicalIndex(str(tmp / "index.db")),
+                                  search_mode="hybrid")
+        service.warm_up()
+        entry = {}
+        with timed(entry):
+            entry["sync"] = service.add_to_vault("benchmark", chunks)
+        entry["chunks_per_sec"] = rate(len(chunks), entry["seconds"])
+        result["add_to_vault"] = entry
+
+        # The same file again: nothing to embed, only the diff against the vault
+        entry = {}
+        with timed(entry):
+            entry["sync"] = service.add_to_vault("benchmark", chunks)
+        entry["chunks_per_sec"] = rate(len(chunks), entry["seconds"])
+        result["add_to_vault_unchanged"] = entry
+        return result
+
+
+def main():
+    page_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(json.dumps(run(page_count), indent=2))
+
+
+if __name__ == "__main__":
+    main()
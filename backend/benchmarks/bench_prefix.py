@@ -0,0 +1,64 @@
+"""
+Prompt evaluation with and without the reused system-prompt prefix
+Run with: python -m benchmarks.bench_prefix [answers]
+
+Needs the real model (it is downloaded to models/ on first use, like the
+app). Each mode loads its own LLMService and answers the same questions over
+the same synthetic context; every answer is stopped after its first token,
+so the time to it is the prompt evaluation the prefix saves. The prefix
+mode's stats say whether its answers matched a fresh session's
+(prefix_verified); if not, reuse was turned off and the modes are the same.
+"""
+import json
+import sys
+import threading
+import time
+
+from benchmarks.common import percentiles
+from benchmarks.synthetic import make_chunks, make_queries
+
+
+def _answer_prompts(service, questions: list[str], contexts: list[str]) -> dict:
+    first_token_ms, prompt_tokens = [], []
+    for question, context in zip(questions, contexts):
+        stop = threading.Event()
+        started = time.perf_counter()
+        for _ in service.stream_answer(question, context, stop=stop):
+            if not stop.is_set():
+                first_token_ms.append((time.perf_counter() - started) * 1000)
+                stop.set()
+        if service.last_prompt_tokens:
+            prompt_tokens.append(service.last_prompt_tokens)
+    return {
+        "first_token": percentiles(first_token_ms),
+        "prompt_tokens_mean": round(sum(prompt_tokens) / len(prompt_tokens), 1) if prompt_tokens else None,
+        "stats": service.prompt_stats(),
+    }
+
+
+def run(answers: int = 20, chunks_per_answer: int = 4) -> dict:
+    from app.services.llm_service import LLMService
+
+    questions = make_queries(answers)
+    chunks = make_chunks(answers * chunks_per_answer)
+    contexts = ["\n\n".join(c["content"] for c in chunks[i:i + chunks_per_answer])
+                for i in range(0, len(chunks), chunks_per_answer)]
+    result = {"answers": answers}
+    for mode, reuse_prefix in (("fresh", False), ("prefix", True)):
+        service = LLMService(reuse_prefix=reuse_prefix)
+        # One answer first so both modes start warm (weights paged in, prefix evaluated)
+        _answer_prompts(service, ["warm up"], [contexts[0]])
+        result[mode] = _answer_prompts(service, questions, contexts)
+    fresh, prefix = result["fresh"]["first_token"], result["prefix"]["first_token"]
+    if fresh.get("count") and prefix.get("p50_ms"):
+        result["first_token_p50_speedup"] = round(fresh["p50_ms"] / prefix["p50_ms"], 3)
+    return result
+
+
+def main():
+    answers = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(json.dumps(run(answers), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+search_vault latency (p50/p95/p99) as a vault grows, per search mode
+Run with: python -m benchmarks.bench_search [sizes, e.g. 1000,10000,100000]
+
+Chunks get random unit vectors instead of real embeddings so a vault can be
+grown to a million chunks in minutes; queries are embedded for real, so the
+latencies include the query embedding, Chroma's ANN search and FTS5.
+"""
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.services.lexical_index_service import LexicalIndex
+from app.services.vector_db_service import SEARCH_MODES, VectorDBService, assign_chunk_ids
+from benchmarks.common import percentiles, rate
+from benchmarks.synthetic import make_chunks, make_queries
+
+VAULT = "benchmark"
+
+
+def grow(service: VectorDBService, start: int, end: int, dimensions: int, batch_size: int = 5000) -> float:
+    '''Write chunks start..end-1 with random embeddings; returns the seconds spent.'''
+    rng = np.random.default_rng(start)
+    spent = 0.0
+    for offset in range(start, end, batch_size):
+        chunks = make_chunks(min(batch_size, end - offset), start=offset)
+        vectors = rng.standard_normal((len(chunks), dimensions)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        # Record numbers make every ID unique, so no occurrence suffixes across batches
+        ids = assign_chunk_ids(chunks)
+        started = time.perf_counter()
+        service.write_chunks(VAULT, ids, [c["content"] for c in chunks], [c["metadata"] for c in chunks], vectors)
+        spent += time.perf_counter() - started
+    # As finish_sync would once the file is written
+    service.invalidate_vault(VAULT)
+    return spent
+
+
+def run(sizes: list[int] = (1000, 10000, 100000), queries: int = 100, modes=SEARCH_MODES,
+        workdir: str | None = None) -> dict:
+    results = []
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        tmp = Path(tmp)
+        service = VectorDBService(db_path=str(tmp / "chroma"), lexical_index=LexicalIndex(str(tmp / "index.db")),
+                                  search_mode="hybrid")
+        service.warm_up()
+        dimensions = len(service.embed_query("dimension probe"))
+
+        size = 0
+        for target in sorted(sizes):
+            seconds = grow(service, size, target, dimensions)
+            entry = {"chunks": target, "insert_chunks_per_sec": rate(target - size, seconds), "modes": {}}
+            size = target
+            for mode in modes:
+                # Fresh questions for every size and mode, so no cache answers them
+                questions = make_queries(queries + 5, seed=target * 10 + SEARCH_MODES.index(mode))
+                for question in questions[:5]:
+                    service.search_vault(VAULT, question, mode=mode)
+                samples = []
+                for question in questions[5:]:
+                    started = time.perf_counter()
+                    service.search_vault(VAULT, question, mode=mode)
+                    samples.append((time.perf_counter() - started) * 1000)
+                entry["modes"][mode] = percentiles(samples)
+            results.append(entry)
+            print(f"  {target:>9} chunks: " + "  ".join(
+                f"{mode} p50 {r['p50_ms']:.1f} / p95 {r['p95_ms']:.1f} / p99 {r['p99_ms']:.1f} ms"
+                for mode, r in entry["modes"].items()
+            ))
+    return {"queries_per_size": queries, "sizes": results}
+
+
+def main():
+    sizes = [int(s) for s in sys.argv[1].split(",")] if len(sys.argv) > 1 else [1000, 10000, 100000]
+    print(json.dumps(run(sizes), indent=2))
+
+
+if __name__ == "__main__":
+    main()
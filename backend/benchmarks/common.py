@@ -0,0 +1,63 @@
+"""Measurement helpers shared by the benchmarks."""
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def percentiles(samples_ms: list[float]) -> dict:
+    '''p50/p95/p99, mean and max of latency samples in milliseconds (nearest-rank).'''
+    if not samples_ms:
+        return {"count": 0}
+    ordered = sorted(samples_ms)
+
+    def rank(p: float) -> float:
+        return round(ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)], 3)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": rank(50),
+        "p95_ms": rank(95),
+        "p99_ms": rank(99),
+        "mean_ms": round(sum(ordered) / len(ordered), 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+@contextmanager
+def timed(result: dict, key: str = "seconds"):
+    '''Store the block's wall time in result[key].'''
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        result[key] = round(time.perf_counter() - started, 4)
+
+
+def rate(amount: float, seconds: float) -> float | None:
+    return round(amount / seconds, 2) if seconds > 0 else None
+
+
+def git_revision() -> dict:
+    '''Commit and dirty flag of the working tree, so results can be lined up with history.'''
+    def git(*args) -> str:
+        return subprocess.run(["git", *args], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=10).stdout.strip()
+    try:
+        return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--", "."))}
+    except (OSError, subprocess.SubprocessError):
+        return {"commit": None, "dirty": None}
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "argv": sys.argv[1:],
+    }
@@ -0,0 +1,78 @@
+"""
+Compare two benchmark result files metric by metric
+Run with: python -m benchmarks.compare <old.json> <new.json> [--all]
+
+Latencies and seconds are better lower, rates (*_per_sec) better higher;
+changes beyond the threshold (10%) are flagged.
+"""
+import json
+import sys
+
+THRESHOLD = 10.0
+
+
+def flatten(value, prefix: str = "") -> dict:
+    '''{"a": {"b": 1}} -> {"a.b": 1}; sizes in lists are keyed by their chunk count.'''
+    if isinstance(value, dict):
+        out = {}
+        for key, item in value.items():
+            out.update(flatten(item, f"{prefix}.{key}" if prefix else key))
+        return out
+    if isinstance(value, list):
+        out = {}
+        for index, item in enumerate(value):
+            label = item.get("chunks", index) if isinstance(item, dict) else index
+            out.update(flatten(item, f"{prefix}[{label}]"))
+        return out
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_sec")
+
+
+def is_timing(metric: str) -> bool:
+    return metric.endswith("_ms") or metric.endswith("seconds") or higher_is_better(metric)
+
+
+def compare(old: dict, new: dict, show_all: bool = False) -> list[tuple]:
+    '''Rows of (metric, old, new, % change, verdict), for timings unless show_all.'''
+    before, after = flatten(old["results"]), flatten(new["results"])
+    rows = []
+    for metric in sorted(before.keys() & after.keys()):
+        if not show_all and not is_timing(metric):
+            continue
+        a, b = before[metric], after[metric]
+        change = (b - a) / a * 100 if a else 0.0
+        verdict = ""
+        if is_timing(metric) and abs(change) >= THRESHOLD:
+            improved = change > 0 if higher_is_better(metric) else change < 0
+            verdict = "better" if improved else "WORSE"
+        rows.append((metric, a, b, change, verdict))
+    return rows
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if len(args) != 2:
+        print(__doc__.strip())
+        sys.exit(2)
+    with open(args[0]) as f:
+        old = json.load(f)
+    with open(args[1]) as f:
+        new = json.load(f)
+
+    print(f"old: {(old['git']['commit'] or '?')[:8]}{' (dirty)' if old['git']['dirty'] else ''}  {old['timestamp']}")
+    print(f"new: {(new['git']['commit'] or '?')[:8]}{' (dirty)' if new['git']['dirty'] else ''}  {new['timestamp']}\n")
+    rows = compare(old, new, "--all" in sys.argv)
+    width = max((len(r[0]) for r in rows), default=10)
+    for metric, a, b, change, verdict in rows:
+        print(f"  {metric:<{width}}  {a:>12.3f}  {b:>12.3f}  {change:>+8.1f}%  {verdict}")
+    if any(r[4] == "WORSE" for r in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Run the benchmark suite and write the results as JSON
+Run with: python -m benchmarks.run [--quick] [--only search,chat] [--sizes 1000,10000,100000,1000000]
+
+The prefix suite needs the real model, so it only runs when named in --only.
+
+Results land in benchmarks/results/<timestamp>-<commit>.json (or --out) and
+carry the git commit, so two runs can be diffed with benchmarks/compare.py.
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks import bench_chat, bench_chunking, bench_ingestion, bench_prefix, bench_search
+from benchmarks.common import BACKEND_DIR, environment, git_revision
+
+SUITES = ("chunking", "ingestion", "search", "chat")
+# Not run by default: they load the real LLM
+MODEL_SUITES = ("prefix",)
+RESULTS_DIR = BACKEND_DIR / "benchmarks" / "results"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vault AI ingestion and query benchmarks")
+    parser.add_argument("--quick", action="store_true", help="small sizes, for a smoke run")
+    parser.add_argument("--only", default=",".join(SUITES), help=f"comma-separated subset of {','.join(SUITES + MODEL_SUITES)}")
+    parser.add_argument("--sizes", help="vault sizes for the search benchmark (default 1000,10000,100000)")
+    parser.add_argument("--pages", type=int, help="pages in the synthetic PDF")
+    parser.add_argument("--queries", type=int, help="timed queries per vault size and per chat phase")
+    parser.add_argument("--out", help="result file (default benchmarks/results/<timestamp>-<commit>.json)")
+    args = parser.parse_args()
+
+    suites = [s.strip() for s in args.only.split(",") if s.strip()]
+    unknown = set(suites) - set(SUITES + MODEL_SUITES)
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(",")] if args.sizes else ([1000, 5000] if args.quick else [1000, 10000, 100000])
+    pages = args.pages or (40 if args.quick else 200)
+    queries = args.queries or (20 if args.quick else 100)
+
+    revision = git_revision()
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": revision,
+        "environment": environment(),
+        "settings": {"sizes": sizes, "pages": pages, "queries": queries},
+        "results": {},
+    }
+    runs = {
+        "chunking": lambda: bench_chunking.run(pages),
+        "ingestion": lambda: bench_ingestion.run(pages),
+        "search": lambda: bench_search.run(sizes, queries),
+        "chat": lambda: bench_chat.run(queries, pages),
+        "prefix": lambda: bench_prefix.run(queries),
+    }
+    for suite in suites:
+        print(f"▶ {suite}")
+        started = time.perf_counter()
+        report["results"][suite] = runs[suite]()
+        print(f"  done in {time.perf_counter() - started:.1f}s")
+
+    if args.out:
+        out = Path(args.out)
+    else:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        out = RESULTS_DIR / f"{stamp}-{(revision['commit'] or 'nogit')[:8]}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f"✅ Results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Deterministic stand-in for LLMService, so benchmarks measure everything but the model."""
+import hashlib
+import os
+import threading
+import time
+from typing import Iterator
+
+from app.services.context_builder import DEFAULT_CHARS_PER_TOKEN, estimate_tokens
+from app.services.llm_scheduler import NO_CONTEXT_RESPONSE
+from benchmarks.synthetic import WORDS
+
+
+class StubLLMService:
+    """
+    Load it in the LLM workers with VAULT_LLM_SERVICE=benchmarks.stub_llm:StubLLMService.
+
+    The answer is a function of the query and context only: `answer_tokens`
+    words picked by a hash of both, streamed with `token_delay_ms` between
+    them to stand in for generation time. Both come from
+    VAULT_STUB_LLM_TOKENS and VAULT_STUB_LLM_TOKEN_DELAY_MS.
+    """
+
+    chars_per_token = DEFAULT_CHARS_PER_TOKEN
+
+    def __init__(self, n_ctx: int = 2048, **kwargs):
+        self.answer_tokens = int(os.getenv("VAULT_STUB_LLM_TOKENS", "64"))
+        self.token_delay = int(os.getenv("VAULT_STUB_LLM_TOKEN_DELAY_MS", "0")) / 1000
+        self.answers = 0
+        self.last_prompt_tokens: int | None = None
+
+    def _tokens(self, query: str, context: str) -> list[str]:
+        digest = hashlib.sha256(f"{query}\0{context}".encode("utf-8")).digest()
+        return [WORDS[digest[i % len(digest)] * (i + 1) % len(WORDS)] + " " for i in range(self.answer_tokens)]
+
+    def stream_answer(self, query: str, context: str, stop: threading.Event | None = None) -> Iterator[str]:
+        if not context:
+            yield NO_CONTEXT_RESPONSE
+            return
+        self.answers += 1
+        self.last_prompt_tokens = estimate_tokens(query + context, self.chars_per_token)
+        for token in self._tokens(query, context):
+            if stop is not None and stop.is_set():
+                return
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield token
+
+    def generate_answer(self, query: str, context: str) -> str:
+        return "".join(self.stream_answer(query, context)).strip()
+
+    def generate_chat_title(self, query: str) -> str:
+        return " ".join(query.split()[:4])[:50]
+
+    def prompt_stats(self) -> dict:
+        return {"answers": self.answers, "chars_per_token": self.chars_per_token}
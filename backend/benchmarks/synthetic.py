@@ -0,0 +1,94 @@
+"""
+Deterministic synthetic documents for the benchmarks: page text, minimal
+PDFs (no PDF library needed), ready-made chunks and queries.
+"""
+import random
+
+WORDS = (
+    "the vault stores documents and answers questions about them using retrieval over embedded chunks "
+    "of text extracted from uploaded PDF files including reports contracts manuals invoices and notes "
+    "each page is parsed split into overlapping segments embedded with a sentence transformer model "
+    "revenue forecast quarter margin liability clause warranty termination schedule appendix figure "
+    "patient dosage protocol trial cohort outcome baseline variance sample interval estimate"
+).split()
+
+
+def make_sentence(rng: random.Random, low: int = 8, high: int = 24) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize() + "."
+
+
+def make_pages(count: int, seed: int = 7, words_per_page: tuple[int, int] = (350, 550)) -> list[tuple[int, str]]:
+    '''[(page_number, text)] of prose; every fifth page is short, like a title or figure page.'''
+    rng = random.Random(seed)
+    pages = []
+    for number in range(1, count + 1):
+        target = rng.randint(20, 60) if number % 5 == 0 else rng.randint(*words_per_page)
+        sentences, words = [], 0
+        while words < target:
+            sentence = make_sentence(rng)
+            sentences.append(sentence)
+            words += sentence.count(" ") + 1
+        # Extracted PDF text breaks lines mid-sentence
+        text = " ".join(sentences)
+        pages.append((number, "\n".join(text[i:i + 90] for i in range(0, len(text), 90))))
+    return pages
+
+
+def make_pdf(path: str, pages: list[tuple[int, str]]):
+    '''Write pages as a minimal text-only PDF (Helvetica, one text object per page).'''
+    objects: list[bytes] = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_ref = add(b"")
+    kids = []
+    for _, text in pages:
+        ops = ["BT /F1 10 Tf 40 800 Td 12 TL"]
+        for line in text.split("\n"):
+            line = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            ops.append(f"({line}) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1", "replace")
+        contents = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(add(
+            f"<< /Type /Page /Parent {pages_ref} 0 R /MediaBox [0 0 612 842] /Contents {contents} 0 R "
+            f"/Resources << /Font << /F1 {font} 0 R >> >> >>".encode()
+        ))
+    objects[pages_ref - 1] = (
+        f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>".encode()
+    )
+    catalog = add(f"<< /Type /Catalog /Pages {pages_ref} 0 R >>".encode())
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def make_chunks(count: int, start: int = 0, seed: int = 11, source: str = "synthetic.pdf") -> list[dict]:
+    '''Chunks numbered start..start+count-1, each a few sentences, as process_pdf returns them.'''
+    chunks = []
+    for n in range(start, start + count):
+        rng = random.Random(seed * 1_000_003 + n)
+        content = " ".join(make_sentence(rng) for _ in range(rng.randint(4, 8)))
+        chunks.append({
+            "content": f"{content} Record {n}.",
+            "metadata": {"source": source, "page": n // 4 + 1, "domain": "benchmark"},
+        })
+    return chunks
+
+
+def make_queries(count: int, seed: int = 13) -> list[str]:
+    '''Distinct questions, so result and query-embedding caches don't hide search cost.'''
+    rng = random.Random(seed)
+    return [f"What does the document say about {' '.join(rng.sample(WORDS, 3))} ({i})?" for i in range(count)]
@@ -68,11 +68,24 @@ export const FolderView: React.FC<FolderViewProps> = ({ folderName, onClose, onS
 
     try {
       const token = sessionStorage.getItem('token');
-      await fetch('http://127.0.0.1:8000/upload', {
+      const res = await fetch('http://127.0.0.1:8000/upload', {
         method: 'POST',
         headers: { 'Authorization': `Bearer ${token}` },
         body: formData,
       });
+      // Uploads are ingested in the background; wait for the job to finish
+      if (res.ok) {
+        const { job_id } = await res.json();
+        let status = 'queued';
+        while (status === 'queued' || status === 'running') {
+          await new Promise((resolve) => setTimeout(resolve, 1000));
+          const jobRes = await fetch(`http://127.0.0.1:8000/jobs/${job_id}`, {
+            headers: { 'Authorization': `Bearer ${token}` },
+          });
+          if (!jobRes.ok) break;
+          status = (await jobRes.json()).status;
+        }
+      }
       fetchDocuments();
     } catch (e) {
       console.error('Upload failed:', e);